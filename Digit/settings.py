@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.role_context.RoleContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "allauth.account.middleware.AccountMiddleware"
@@ -124,6 +125,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # a file rather than in-memory: the threaded close tests need writers to wait on
+        # SQLite's lock, which the shared-cache memory database reports as an error instead
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        # BEGIN IMMEDIATE: a transaction takes the write lock up front and waits up to `timeout`
+        # seconds for it. Deferred transactions that read first (rollups.catch_up) fail with
+        # "database is locked" at once when they try to upgrade while another close is writing.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     }
 }
 
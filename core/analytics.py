@@ -0,0 +1,502 @@
+# core/analytics.py
+"""
+Ratings / percentile analytics shared by the owner and manager endpoints.
+
+    menu_item_ratings(rp, start, end)                 -> [row per menu item]
+    staff_ratings(rp, start, end)                     -> ['ALL' row, row per server]
+    percentiles(rp, metric, qs, start, end, item)     -> {metric, item, n, percentiles}
+
+Results go through core/analytics_cache.py, keyed per restaurant and range with no
+role in the key, so an owner and a manager looking at the same restaurant compute
+once and share the entry. Row shaping (menu de-dupe and price choice, staff seeding
+and the 'ALL' row) happens here; a backend only returns grouped numbers:
+
+  rollups  ItemDailyStats / StaffDailyStats / DailySketch, caught up first (default);
+           a restaurant whose rollups haven't been built yet (rebuild_daily_stats) is
+           answered by sql until they are
+  sql      GROUP BY over TicketLineItem / TicketLink in the database
+  scan     one narrow pass over the same rows in Python (core/item_engine.py)
+
+  ANALYTICS_BACKEND   backend name (default "rollups")
+
+Item prices are exact medians on every backend (rollups sums per-day price counts);
+rollups answers percentiles from KLL sketches, sql and scan exactly over the range.
+`manage.py compare_analytics_backends` times the backends against each other.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+from collections import Counter, defaultdict
+from itertools import groupby
+
+from decouple import config
+from django.db.models import Count, ExpressionWrapper, F, FloatField, IntegerField, Max, Min, Q, Sum
+from django.db.models.functions import Cast, Round
+
+from . import analytics_cache, item_engine, sketches
+from .dates import filter_day_field, filter_days, restaurant_tz
+from .item_engine import median_counts, median_int
+from .line_items import MIN_CENTS, MAX_CENTS, norm_name
+from .models import ItemDailyStats, Review, StaffDailyStats, TicketLineItem, TicketLink
+from .rollups import catch_up, staff_active, stamp_missing
+
+ANALYTICS_BACKEND = config("ANALYTICS_BACKEND", default="rollups")
+
+
+def _weighted_median(pairs):
+    """Median of (median, observations) pairs, each weighted by its count."""
+    pairs = sorted((v, w) for v, w in pairs if v is not None and w)
+    total = sum(w for _, w in pairs)
+    if not total:
+        return None
+    seen = 0
+    for v, w in pairs:
+        seen += w
+        if seen * 2 >= total:
+            return v
+    return pairs[-1][0]
+
+
+def _rank(n: int, q: float) -> int:
+    """Index of the q-quantile in n sorted values (same rule as KLLSketch.quantiles)."""
+    return max(math.ceil(max(q, 0.0) * n), 1) - 1
+
+
+def _closed(rp, start, end):
+    return filter_days(TicketLink.objects.filter(restaurant=rp, status="closed", closed_at__isnull=False),
+                       start, end, restaurant_tz(rp))
+
+
+def _line_items(rp, start, end):
+    return filter_days(TicketLineItem.objects.filter(restaurant=rp), start, end, restaurant_tz(rp))
+
+
+def _item_filter(key: str) -> Q:
+    """Line items behind an item_price sketch key (core/sketches.item_key)."""
+    if not key:
+        return Q()
+    if key.startswith("name:"):
+        return Q(menu_item_id="", name_norm=key[5:])
+    return Q(menu_item_id=key)
+
+
+# ---------- backends ----------
+#
+# menu_groups(rp, start, end)  [{menu_item_id, name_norm, display, num_all, qty_all, num_rated,
+#                                qty_rated, stars_sum, plausible_prices, raw_prices}]
+#                              prices are [(median cents, observations)]
+# staff_groups(rp, start, end) [{staff_key, display, active, tickets, rated, stars}]
+# values(rp, metric, qs, start, end, key)
+#                              {"n", "values"}, tip_pct in basis points like the sketches
+
+class RollupBackend:
+    name = "rollups"
+
+    @staticmethod
+    def _ready(rp) -> bool:
+        """Fold what's new; False when the restaurant has no rollups yet (never built inside a request)."""
+        return catch_up(rp.id) is not None
+
+    def menu_groups(self, rp, start, end) -> list[dict]:
+        if not self._ready(rp):
+            return BACKENDS["sql"].menu_groups(rp, start, end)
+        qs = filter_day_field(ItemDailyStats.objects.filter(restaurant=rp), start, end)
+        counts = defaultdict(Counter)
+        for mid, nname, day_counts in qs.values_list("menu_item_id", "name_norm", "price_counts"):
+            counts[(mid, nname)].update({int(u): n for u, n in (day_counts or {}).items()})
+        prices = {}
+        for key, units in counts.items():
+            plausible = {u: n for u, n in units.items() if MIN_CENTS <= u <= MAX_CENTS}
+            prices[key] = ([(median_counts(plausible), sum(plausible.values()))],
+                           [(median_counts(units), sum(units.values()))])
+        groups = list(
+            qs.values("menu_item_id", "name_norm")
+            .annotate(display=Min("name"), num_all=Sum("num_tickets"), qty_all=Sum("qty"),
+                      num_rated=Sum("num_rated_tickets"), qty_rated=Sum("qty_rated"), stars_sum=Sum("stars_sum"))
+            .order_by("menu_item_id", "name_norm")
+        )
+        for g in groups:
+            g["plausible_prices"], g["raw_prices"] = prices.get((g["menu_item_id"], g["name_norm"]), ([], []))
+        return groups
+
+    def staff_groups(self, rp, start, end) -> list[dict]:
+        if not self._ready(rp):
+            return BACKENDS["sql"].staff_groups(rp, start, end)
+        return list(
+            filter_day_field(StaffDailyStats.objects.filter(restaurant=rp), start, end)
+            .values("staff_key")
+            .annotate(display=Max("name"), active=Max(Cast("is_active", IntegerField())), tickets=Sum("num_tickets"),
+                      rated=Sum("num_rated_tickets"), stars=Sum("stars_sum"))
+            .order_by("staff_key")
+        )
+
+    def values(self, rp, metric, qs, start, end, key) -> dict:
+        if not self._ready(rp):
+            return BACKENDS["sql"].values(rp, metric, qs, start, end, key)
+        return sketches.percentiles(rp, metric, qs, start, end, key=key)
+
+
+class SqlBackend:
+    """Grouped aggregates in the database. Medians have no portable SQL aggregate, so the
+    database sorts each group's prices and the middle values are picked here."""
+    name = "sql"
+
+    def menu_groups(self, rp, start, end) -> list[dict]:
+        li = _line_items(rp, start, end)
+        # one review per ticket (uniq_review_per_ticketlink), so the join never fans rows out
+        rated = Q(ticket_link__reviews__isnull=False)
+        groups = list(
+            li.values("menu_item_id", "name_norm")
+            .annotate(display=Min("name"), num_all=Count("id"), qty_all=Sum("qty"),
+                      num_rated=Count("ticket_link__reviews"), qty_rated=Sum("qty", filter=rated),
+                      stars_sum=Sum("ticket_link__reviews__stars"))
+            .order_by("menu_item_id", "name_norm")
+        )
+        prices = {}
+        sorted_units = (li.exclude(unit_cents=None).order_by("menu_item_id", "name_norm", "unit_cents")
+                        .values_list("menu_item_id", "name_norm", "unit_cents"))
+        for key, rows in groupby(sorted_units.iterator(chunk_size=5000), key=lambda r: (r[0], r[1])):
+            units = [u for _mid, _nname, u in rows]
+            plausible = [u for u in units if MIN_CENTS <= u <= MAX_CENTS]
+            prices[key] = ([(median_int(plausible), len(plausible))], [(median_int(units), len(units))])
+        for g in groups:
+            g["plausible_prices"], g["raw_prices"] = prices.get((g["menu_item_id"], g["name_norm"]), ([], []))
+        return groups
+
+    def staff_groups(self, rp, start, end) -> list[dict]:
+        tickets = _closed(rp, start, end)
+        stamp_missing(tickets)
+        active = staff_active(rp)
+        groups = list(
+            tickets.values("staff_key")
+            .annotate(display=Max("staff_name"), tickets=Count("id"), rated=Count("reviews"), stars=Sum("reviews__stars"))
+            .order_by("staff_key")
+        )
+        for g in groups:
+            g["active"] = active.get(g["staff_key"], True)
+        return groups
+
+    def values(self, rp, metric, qs, start, end, key) -> dict:
+        if metric == "item_price":
+            vals = (_line_items(rp, start, end).filter(_item_filter(key)).exclude(unit_cents=None)
+                    .values_list("unit_cents", flat=True).order_by("unit_cents"))
+        elif metric == "tip_pct":
+            vals = (_closed(rp, start, end).filter(total_cents__gt=0)
+                    .annotate(v=Round(ExpressionWrapper(F("tip_cents") * 10000.0 / F("total_cents"), output_field=FloatField())))
+                    .values_list("v", flat=True).order_by("v"))
+        else:
+            vals = _closed(rp, start, end).values_list("total_cents", flat=True).order_by("total_cents")
+        n = vals.count()
+        out = []
+        for q in qs:
+            v = vals[_rank(n, q)] if n else None
+            out.append(int(v) if v is not None else None)
+        return {"n": n, "values": out}
+
+
+class ScanBackend:
+    """Every row in the range pulled once (narrow columns) and aggregated in Python."""
+    name = "scan"
+
+    def _stars(self, rp, start, end) -> dict:
+        reviews = filter_days(Review.objects.filter(restaurant=rp, ticket_link__isnull=False), start, end,
+                              restaurant_tz(rp), field="ticket_link__closed_at")
+        return dict(reviews.values_list("ticket_link_id", "stars"))
+
+    def menu_groups(self, rp, start, end) -> list[dict]:
+        stars = self._stars(rp, start, end)
+        cols, names = item_engine.Columns(), {}
+        for mid, nname, name, tl_id, q, u, ln in _line_items(rp, start, end).values_list(
+            "menu_item_id", "name_norm", "name", "ticket_link_id", "qty", "unit_cents", "line_cents"
+        ).iterator(chunk_size=5000):
+            cols.add((mid, nname), q, u, ln, stars.get(tl_id))
+            names[(mid, nname)] = min(names.get((mid, nname), name), name)
+        agg = cols.aggregate()
+        return [
+            {
+                "menu_item_id": mid, "name_norm": nname, "display": names[(mid, nname)],
+                "num_all": agg["rows"][i], "qty_all": agg["qty"][i], "num_rated": agg["rated_rows"][i],
+                "qty_rated": agg["qty_rated"][i], "stars_sum": agg["stars_sum"][i],
+                "plausible_prices": [(agg["price_median"][i], agg["price_obs"][i])],
+                "raw_prices": [(agg["price_raw_median"][i], agg["price_raw_obs"][i])],
+            }
+            for (mid, nname), i in cols.keys.items()
+        ]
+
+    def staff_groups(self, rp, start, end) -> list[dict]:
+        tickets = _closed(rp, start, end)
+        stamp_missing(tickets)
+        stars, active = self._stars(rp, start, end), staff_active(rp)
+        acc = {}
+        for tl_id, key, display in tickets.values_list("id", "staff_key", "staff_name").iterator(chunk_size=5000):
+            g = acc.setdefault(key, {"staff_key": key, "display": display, "active": active.get(key, True),
+                                     "tickets": 0, "rated": 0, "stars": 0})
+            g["display"] = max(g["display"], display)
+            g["tickets"] += 1
+            s = stars.get(tl_id)
+            if s is not None:
+                g["rated"] += 1
+                g["stars"] += s
+        return list(acc.values())
+
+    def values(self, rp, metric, qs, start, end, key) -> dict:
+        if metric == "item_price":
+            vals = list(_line_items(rp, start, end).filter(_item_filter(key)).exclude(unit_cents=None)
+                        .values_list("unit_cents", flat=True))
+        else:
+            vals = []
+            for total, tip in _closed(rp, start, end).values_list("total_cents", "tip_cents").iterator(chunk_size=5000):
+                vals.extend(v for m, _key, v in sketches.ticket_observations(total, tip) if m == metric)
+        vals.sort()
+        return {"n": len(vals), "values": [vals[_rank(len(vals), q)] if vals else None for q in qs]}
+
+
+BACKENDS = {b.name: b for b in (RollupBackend(), SqlBackend(), ScanBackend())}
+
+
+def get_backend(name: str | None = None):
+    try:
+        return BACKENDS[name or ANALYTICS_BACKEND]
+    except KeyError:
+        raise ValueError(f"Unknown analytics backend {name or ANALYTICS_BACKEND!r}; one of {', '.join(BACKENDS)}.")
+
+
+# ---------- shaping ----------
+
+def _shape_menu(rp, groups) -> list[dict]:
+    """
+    Menu rows from a backend's (menu_item_id, name_norm) groups.
+    - De-dupes by id (preferred) or normalized name.
+    - Unit price is the median of the observed prices; falls back to menu_cache only
+      if no sane observed price exists.
+    """
+    menu_cache = getattr(rp, "menu_cache", None) or []
+    meta_by_id = {str(x.get("id")): x for x in menu_cache if str(x.get("id") or "")}
+    meta_by_name = {norm_name(x.get("name")): x for x in menu_cache if (x.get("name") or "").strip()}
+
+    # ---------- merge groups with de-dupe (id groups first so name-only rows fold into them) ----------
+    agg = {}
+    id_to_key = {}
+    name_to_key = {}
+
+    for g in sorted(groups, key=lambda g: (not g["menu_item_id"], g["menu_item_id"], g["name_norm"])):
+        mid, nname = g["menu_item_id"], g["name_norm"]
+
+        if mid:
+            key = id_to_key.get(mid)
+            if not key and nname in name_to_key:
+                key = name_to_key[nname]
+                id_to_key[mid] = key
+                agg[key]["menu_item_id"] = mid or agg[key]["menu_item_id"]
+            if not key:
+                key = mid
+                id_to_key[mid] = key
+                name_to_key.setdefault(nname, key)
+        else:
+            key = name_to_key.get(nname) or f"name:{nname}"
+            name_to_key.setdefault(nname, key)
+
+        rec = agg.setdefault(key, {
+            "menu_item_id": mid or None,
+            "name": g["display"],
+            "category": "",
+            "plausible_prices": [],   # (median, observations)
+            "raw_prices": [],
+            "cache_price": None,
+            "sum": 0,
+            "n": 0,
+            "qty_rated_tickets": 0,
+            "qty_all_tickets": 0,
+            "num_rated_tickets": 0,
+            "num_all_tickets": 0,
+        })
+
+        meta = meta_by_id.get(mid) or meta_by_name.get(nname)
+        if meta and not rec["category"]:
+            rec["category"] = (meta.get("category") or "").strip()
+        if meta and rec["cache_price"] is None:
+            try:
+                pc = meta.get("price_cents")
+                if pc is not None:
+                    rec["cache_price"] = int(pc)
+            except Exception:
+                pass
+
+        rec["plausible_prices"].extend(g["plausible_prices"])
+        rec["raw_prices"].extend(g["raw_prices"])
+        rec["qty_all_tickets"] += int(g["qty_all"] or 0)
+        rec["num_all_tickets"] += int(g["num_all"] or 0)
+        rec["sum"] += int(g["stars_sum"] or 0)
+        rec["n"] += int(g["num_rated"] or 0)
+        rec["qty_rated_tickets"] += int(g["qty_rated"] or 0)
+        rec["num_rated_tickets"] += int(g["num_rated"] or 0)
+
+    # ---------- shape + choose final price ----------
+    out = []
+    for r in agg.values():
+        price_cents = _weighted_median(r["plausible_prices"])
+        if price_cents is None:
+            price_cents = _weighted_median(r["raw_prices"])
+            if price_cents is not None and price_cents > MAX_CENTS and r["cache_price"] and MIN_CENTS <= r["cache_price"] <= MAX_CENTS:
+                price_cents = r["cache_price"]
+        if price_cents is None:
+            cp = r["cache_price"]
+            price_cents = cp if (cp is not None and MIN_CENTS <= cp <= MAX_CENTS) else 0
+
+        avg = (r["sum"] / r["n"]) if r["n"] else None
+        out.append({
+            "menu_item_id": r["menu_item_id"] or "",
+            "name": r["name"],
+            "category": r["category"],
+            "price_cents": int(price_cents or 0),
+            "avg_rating": round(avg, 3) if avg is not None else None,
+            "num_rated_tickets": r["num_rated_tickets"],
+            "total_qty_on_rated_tickets": r["qty_rated_tickets"],
+            "num_all_tickets": r["num_all_tickets"],
+            "total_qty_all_tickets": r["qty_all_tickets"],
+        })
+
+    def sort_key(row):
+        rated = row["avg_rating"] is not None
+        return (0 if rated else 1, -(row["avg_rating"] or 0), -row.get("num_all_tickets", 0))
+
+    out.sort(key=sort_key)
+    return out
+
+
+def _shape_staff(rp, groups) -> list[dict]:
+    """
+    Staff rows: an 'ALL' row first, then every cached staffer (even with 0 tickets)
+    plus any server seen on tickets. Tickets with no server count in ALL only.
+    """
+    staff_cache = getattr(rp, "staff_cache", None) or []
+
+    agg = {}
+    def seed_row(key, display, active=True):
+        if key not in agg:
+            agg[key] = {"display": display or "", "active": bool(active), "sum": 0, "n": 0, "tickets_all": 0, "tickets_rated": 0}
+
+    # seed every cached staffer so they appear even with 0 tickets
+    for s in staff_cache:
+        key = (str(s.get("id") or "").strip()
+               or (s.get("check_name") or "").strip()
+               or (s.get("name") or "").strip()
+               or f"seed:{id(s)}")
+        disp = (s.get("check_name") or s.get("name") or "").strip()
+        if disp:
+            seed_row(key, disp, s.get("is_active", True))
+
+    agg_all = {"display": "All staff", "active": True, "sum": 0, "n": 0, "tickets_all": 0, "tickets_rated": 0}
+
+    for g in sorted(groups, key=lambda g: g["staff_key"] or ""):
+        tickets, rated, stars = int(g["tickets"] or 0), int(g["rated"] or 0), int(g["stars"] or 0)
+        agg_all["tickets_all"] += tickets
+        agg_all["tickets_rated"] += rated
+        agg_all["n"] += rated
+        agg_all["sum"] += stars
+
+        key = g["staff_key"]
+        if not key:
+            continue
+        seed_row(key, g["display"] or key, g["active"])
+        row = agg[key]
+        row["tickets_all"] += tickets
+        row["tickets_rated"] += rated
+        row["n"] += rated
+        row["sum"] += stars
+
+    out = []
+    avg_all = (agg_all["sum"] / agg_all["n"]) if agg_all["n"] else None
+    out.append({
+        "staff_key": "ALL",
+        "name": agg_all["display"],
+        "avg_rating": round(avg_all, 3) if avg_all is not None else None,
+        "num_rated_tickets": agg_all["tickets_rated"],
+        "is_active_in_pos": True,
+        "num_all_tickets": agg_all["tickets_all"],
+    })
+    for key, r in agg.items():
+        avg = (r["sum"] / r["n"]) if r["n"] else None
+        out.append({
+            "staff_key": key,
+            "name": r["display"],
+            "avg_rating": round(avg, 3) if avg is not None else None,
+            "num_rated_tickets": r["tickets_rated"],
+            "is_active_in_pos": bool(r["active"]),
+            "num_all_tickets": r["tickets_all"],
+        })
+
+    def sort_key(row):
+        if row["staff_key"] == "ALL": return (-999, 0, 0)
+        rated = row["avg_rating"] is not None
+        return (0 if rated else 1, -(row["avg_rating"] or 0), -row["num_all_tickets"])
+
+    out[1:] = sorted(out[1:], key=sort_key)
+    return out
+
+
+# ---------- service ----------
+
+def compute_menu_items(rp, start=None, end=None, backend: str | None = None) -> list[dict]:
+    return _shape_menu(rp, get_backend(backend).menu_groups(rp, start, end))
+
+
+def compute_staff(rp, start=None, end=None, backend: str | None = None) -> list[dict]:
+    return _shape_staff(rp, get_backend(backend).staff_groups(rp, start, end))
+
+
+def _item_sketch_key(rp, item: str) -> str:
+    """item_price key for ?item=: a menu_item_id when the restaurant has one, else the normalized name."""
+    if not item or item.startswith("name:"):
+        return item
+    if TicketLineItem.objects.filter(restaurant=rp, menu_item_id=item).exists():
+        return item
+    return sketches.item_key("", norm_name(item))
+
+
+def compute_percentiles(rp, metric: str, qs, start=None, end=None, item: str = "", backend: str | None = None) -> dict:
+    key = _item_sketch_key(rp, item) if metric == "item_price" else ""
+    res = get_backend(backend).values(rp, metric, qs, start, end, key)
+    values = res["values"]
+    if metric == "tip_pct":
+        values = [round(v / 100, 2) if v is not None else None for v in values]
+    return {
+        "metric": metric,
+        "item": key,
+        "n": res["n"],
+        "percentiles": [{"p": round(q * 100, 4), "value": v} for q, v in zip(qs, values)],
+    }
+
+
+def menu_item_ratings(rp, start=None, end=None, backend: str | None = None) -> list[dict]:
+    """Menu analytics over closed tickets (dates inclusive, either may be None), cached."""
+    name = get_backend(backend).name
+    return analytics_cache.cached(f"{name}:menu", rp, start, end,
+                                  lambda: compute_menu_items(rp, start, end, backend=name))
+
+
+def staff_ratings(rp, start=None, end=None, backend: str | None = None) -> list[dict]:
+    """Staff analytics ('ALL' first, then cached staffers and servers seen on tickets), cached."""
+    name = get_backend(backend).name
+    return analytics_cache.cached(f"{name}:staff", rp, start, end,
+                                  lambda: compute_staff(rp, start, end, backend=name))
+
+
+def percentiles(rp, metric: str, qs, start=None, end=None, item: str = "", backend: str | None = None) -> dict:
+    """
+    Percentiles of ticket_total (cents), tip_pct (percent) or item_price (cents; one item
+    when `item` is a menu_item_id or name) over [start, end], cached. qs are fractions 0..1.
+    """
+    name = get_backend(backend).name
+    kind = f"{name}:pct:" + hashlib.sha1(f"{metric}|{item}|{qs}".encode()).hexdigest()[:16]
+    return analytics_cache.cached(kind, rp, start, end,
+                                  lambda: compute_percentiles(rp, metric, qs, start, end, item=item, backend=name))
+
+
+def percentile_args(params) -> tuple[str, list[float], str]:
+    """(metric, fractions, item) from ?metric=&p=&item=; ValueError with a user-facing message."""
+    metric = (params.get("metric") or "ticket_total").strip()
+    if metric not in sketches.METRICS:
+        raise ValueError(f"metric must be one of {', '.join(sketches.METRICS)}.")
+    return metric, sketches.parse_percentiles(params.get("p") or ""), (params.get("item") or "").strip()
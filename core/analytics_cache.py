@@ -0,0 +1,91 @@
+# core/analytics_cache.py
+"""
+Result cache for the owner/manager ratings analytics.
+
+Entries are keyed by (kind, restaurant, start, end, closed-ticket watermark,
+review watermark, restaurant generation):
+
+  closed watermark   count and max(closed_at) of the restaurant's closed tickets
+                     (the count grows with every close, including one committed
+                     late with an earlier closed_at than the max)
+  review watermark   max(updated_at) and count of the restaurant's reviews
+                     (the count catches deletes, which leave no timestamp)
+  generation         per-restaurant counter bumped by invalidate(); called on
+                     every close (record_close), on Review writes and after a rebuild
+
+The watermarks are read from the database, so another worker's close or review
+changes the key even when the generation lives in a per-process cache. Nothing
+is ever deleted: superseded entries just age out after ANALYTICS_CACHE_TTL.
+
+  ANALYTICS_CACHE       cache alias (default "default")
+  ANALYTICS_CACHE_TTL   seconds an entry lives (default 300; 0 disables caching)
+"""
+from __future__ import annotations
+
+from decouple import config
+from django.core.cache import caches
+from django.db.models import Count, Max
+
+from .models import Review, TicketLink
+
+CACHE_ALIAS = config("ANALYTICS_CACHE", default="default")
+CACHE_TTL   = int(config("ANALYTICS_CACHE_TTL", default="300"))
+
+_PREFIX = "analytics"
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _gen_key(restaurant_id) -> str:
+    return f"{_PREFIX}:gen:{restaurant_id}"
+
+
+def generation(restaurant_id) -> int:
+    return _cache().get(_gen_key(restaurant_id)) or 0
+
+
+def invalidate(restaurant_id) -> None:
+    """Drop every cached analytics result for one restaurant (other restaurants keep theirs)."""
+    if not restaurant_id:
+        return
+    cache, key = _cache(), _gen_key(restaurant_id)
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:  # not set yet (or evicted)
+            cache.set(key, 1, timeout=None)
+    except Exception:
+        # best effort: callers are close/review writes, and the watermarks still move the key
+        pass
+
+
+def watermarks(restaurant_id) -> tuple:
+    closed = (TicketLink.objects.filter(restaurant_id=restaurant_id, status="closed")
+              .aggregate(m=Max("closed_at"), n=Count("id")))
+    reviews = Review.objects.filter(restaurant_id=restaurant_id).aggregate(m=Max("updated_at"), n=Count("id"))
+    return (
+        closed["n"],
+        closed["m"].isoformat() if closed["m"] else "",
+        reviews["m"].isoformat() if reviews["m"] else "",
+        reviews["n"],
+    )
+
+
+def cached(kind: str, rp, start, end, compute):
+    """compute() for (kind, rp, start, end), served from cache while nothing changed."""
+    if CACHE_TTL <= 0:
+        return compute()
+    key = ":".join(str(p) for p in (
+        _PREFIX, kind, rp.id, generation(rp.id),
+        start.isoformat() if start else "", end.isoformat() if end else "",
+        *watermarks(rp.id),
+    ))
+    cache = _cache()
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    value = compute()
+    cache.set(key, value, timeout=CACHE_TTL)
+    return value
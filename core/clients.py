@@ -0,0 +1,102 @@
+# core/clients.py
+"""
+Shared outbound HTTP clients for Stripe, Twilio and SendGrid.
+
+Each client is built lazily on first use and then reused for the life of the
+process, so calls ride pooled keep-alive connections instead of a fresh TCP/TLS
+handshake per request. Timeouts and retry budgets come from env:
+
+  OUTBOUND_HTTP_TIMEOUT    seconds per request        (default 10)
+  OUTBOUND_HTTP_RETRIES    bounded retries per call   (default 2)
+  OUTBOUND_HTTP_POOL_SIZE  keep-alive sockets per host (default 10)
+  STRIPE_API_BASE          override the Stripe API base, e.g. the local stand-in
+                           (`manage.py stripe_standin`); unset = api.stripe.com
+"""
+from __future__ import annotations
+
+import threading
+
+import requests
+import stripe
+from decouple import config
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_TIMEOUT   = float(config("OUTBOUND_HTTP_TIMEOUT", default="10"))
+HTTP_RETRIES   = int(config("OUTBOUND_HTTP_RETRIES", default="2"))
+HTTP_POOL_SIZE = int(config("OUTBOUND_HTTP_POOL_SIZE", default="10"))
+
+SENDGRID_SEND_URL = "https://api.sendgrid.com/v3/mail/send"
+
+_lock = threading.Lock()
+_stripe_ready = False
+_twilio = None
+_sendgrid_session = None
+
+
+def pooled_session(retries: Retry | int = 0) -> requests.Session:
+    """requests.Session with a sized keep-alive pool on http/https."""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retries)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+def stripe_client():
+    """
+    Configure the stripe module once (api key, pooled RequestsClient, retry budget) and return it.
+    Stripe retries itself with idempotency keys, so the session adapter does not retry.
+    """
+    global _stripe_ready
+    if not _stripe_ready:
+        with _lock:
+            if not _stripe_ready:
+                stripe.api_key = config("STRIPE_SK")
+                api_base = config("STRIPE_API_BASE", default="").strip()
+                if api_base:
+                    stripe.api_base = api_base.rstrip("/")
+                requests_client = getattr(stripe, "RequestsClient", None) or stripe.http_client.RequestsClient
+                stripe.default_http_client = requests_client(timeout=HTTP_TIMEOUT, session=pooled_session())
+                stripe.max_network_retries = HTTP_RETRIES
+                _stripe_ready = True
+    return stripe
+
+
+def twilio_client():
+    """Single Twilio REST client on a pooled TwilioHttpClient."""
+    global _twilio
+    if _twilio is None:
+        with _lock:
+            if _twilio is None:
+                from twilio.http.http_client import TwilioHttpClient
+                from twilio.rest import Client
+
+                http = TwilioHttpClient(pool_connections=True, timeout=HTTP_TIMEOUT, max_retries=HTTP_RETRIES)
+                _twilio = Client(config("TWILIO_ACCOUNT_SID"), config("TWILIO_AUTH_TOKEN"), http_client=http)
+    return _twilio
+
+
+def _sendgrid():
+    global _sendgrid_session
+    if _sendgrid_session is None:
+        with _lock:
+            if _sendgrid_session is None:
+                # Only retry what SendGrid didn't accept (connect errors, 429, gateway errors)
+                retry = Retry(
+                    total=HTTP_RETRIES, connect=HTTP_RETRIES, read=0, status=HTTP_RETRIES,
+                    status_forcelist=(429, 502, 503, 504), allowed_methods=frozenset({"POST"}),
+                    backoff_factor=0.3, raise_on_status=False,
+                )
+                s = pooled_session(retry)
+                s.headers.update({
+                    "Authorization": f"Bearer {config('API_SENDGRID')}",
+                    "Content-Type": "application/json",
+                })
+                _sendgrid_session = s
+    return _sendgrid_session
+
+
+def sendgrid_send(message) -> requests.Response:
+    """POST a sendgrid.helpers.mail.Mail to the v3 API over the pooled session."""
+    return _sendgrid().post(SENDGRID_SEND_URL, json=message.get(), timeout=HTTP_TIMEOUT)
@@ -0,0 +1,251 @@
+# core/columnar.py
+"""
+Columnar (Parquet / Arrow IPC) export of closed tickets and their line items, for
+finance tooling that would otherwise re-read the XLSX exports or items_json.
+
+Two tables, Hive-partitioned by restaurant and local month of closed_at:
+
+    <root>/tickets/restaurant_id=<id>/month=YYYY-MM/part-<run>.parquet
+    <root>/line_items/restaurant_id=<id>/month=YYYY-MM/part-<run>.parquet
+
+so `pyarrow.dataset.dataset(root + "/tickets", partitioning="hive")` (or DuckDB,
+Spark, pandas) can prune on either key; restaurant_id and month come from the path,
+not the files. Line items come from TicketLineItem, the
+rows normalized from items_json at close (core/line_items.py); money is in cents.
+
+Tickets are read in closed_at order as a values_list projection with .iterator()
+and written COLUMNAR_BATCH rows at a time, with one batched line-item query per
+chunk. Only the current month's files are open, so memory stays flat.
+
+Runs are incremental. <root>/_manifest.json keeps each restaurant's watermark
+(last closed_at plus the ids folded in inside the overlap window, like the rollups'
+AnalyticsWatermark), and the next run only appends new part files for tickets
+closed since. Files are written in a hidden staging directory and moved into
+place just before the manifest is saved, so readers never see a half-written run.
+Pass full=True to drop a restaurant's partitions and write them again.
+
+pyarrow is optional (`pip install pyarrow`); without it HAS_PYARROW is False and
+export_restaurant() raises RuntimeError. `manage.py export_columnar` drives this.
+
+  COLUMNAR_EXPORT_DIR   dataset root (default MEDIA_ROOT/columnar)
+  COLUMNAR_BATCH        tickets per record batch (default 5000)
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+from decouple import config
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .dates import local_day, restaurant_tz
+from .models import TicketLineItem, TicketLink
+from .rollups import WATERMARK_OVERLAP
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+HAS_PYARROW = pa is not None
+
+COLUMNAR_EXPORT_DIR = config("COLUMNAR_EXPORT_DIR", default=os.path.join(settings.MEDIA_ROOT, "columnar"))
+COLUMNAR_BATCH = int(config("COLUMNAR_BATCH", default="5000"))
+
+FORMATS = {"parquet": "parquet", "arrow": "arrow"}   # format -> file extension
+
+MANIFEST = "_manifest.json"
+
+_TICKET_FIELDS = (
+    "id", "ticket_id", "ticket_number", "member__number", "server_name", "staff_key", "closed_at",
+    "total_cents", "tax_cents", "tip_cents", "paid_cents", "pos_ref",
+)
+_ITEM_FIELDS = ("ticket_link_id", "menu_item_id", "name", "name_norm", "qty", "unit_cents", "line_cents")
+
+
+def _schemas():
+    ts = pa.timestamp("us", tz="UTC")
+    tickets = pa.schema([
+        ("ticket_link_id", pa.int64()), ("ticket_id", pa.string()), ("ticket_number", pa.string()), ("member", pa.string()),
+        ("server", pa.string()), ("staff_key", pa.string()), ("closed_at", ts),
+        ("subtotal_cents", pa.int64()), ("tax_cents", pa.int64()), ("tip_cents", pa.int64()),
+        ("total_cents", pa.int64()), ("pos_ref", pa.string()),
+    ])
+    items = pa.schema([
+        ("ticket_link_id", pa.int64()), ("closed_at", ts), ("menu_item_id", pa.string()), ("name", pa.string()), ("name_norm", pa.string()),
+        ("qty", pa.int64()), ("unit_cents", pa.int64()), ("line_cents", pa.int64()),
+    ])
+    return {"tickets": tickets, "line_items": items}
+
+
+class _PartWriter:
+    """One part file, written in the run's hidden staging directory until the run succeeds."""
+
+    def __init__(self, path: Path, tmp: Path, schema, fmt: str):
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        self.path, self.tmp, self.schema = path, tmp, schema
+        self.writer = (pq.ParquetWriter(str(self.tmp), schema) if fmt == "parquet"
+                       else pa.ipc.new_file(str(self.tmp), schema))
+
+    def write(self, columns: dict) -> None:
+        self.writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def _partition(root: Path, table: str, restaurant_id: int) -> Path:
+    return root / table / f"restaurant_id={restaurant_id}"
+
+
+def load_manifest(root) -> dict:
+    try:
+        with open(Path(root) / MANIFEST) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_manifest(root: Path, manifest: dict) -> None:
+    tmp = root / f".{MANIFEST}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, root / MANIFEST)
+
+
+def _columns(schema) -> dict:
+    return {name: [] for name in schema.names}
+
+
+def export_restaurant(rp, root=None, fmt: str = "parquet", full: bool = False, batch: int = COLUMNAR_BATCH) -> dict:
+    """
+    Append rp's tickets closed since its watermark (all of them with full=True) to the
+    dataset at root. Returns {"tickets", "line_items", "files", "months"} for this run.
+    """
+    if not HAS_PYARROW:
+        raise RuntimeError("Columnar export needs pyarrow (pip install pyarrow).")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown columnar format {fmt!r}.")
+    root = Path(root or COLUMNAR_EXPORT_DIR)
+    root.mkdir(parents=True, exist_ok=True)
+    schemas, tz, ext = _schemas(), restaurant_tz(rp), FORMATS[fmt]
+    run = f"{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    staging = root / f".staging-{run}"   # dot-prefixed: dataset readers skip it
+
+    manifest = load_manifest(root)
+    mark = None if full else manifest.get(str(rp.id))
+    if mark and mark.get("format", fmt) != fmt:
+        raise ValueError(f"Restaurant {rp.id} was exported as {mark['format']}; use that or a full re-export.")
+    qs = TicketLink.objects.filter(restaurant=rp, status="closed", closed_at__isnull=False)
+    recent = {}
+    if mark:
+        # re-read the overlap window so tickets committed slightly out of closed_at order aren't lost
+        edge = parse_datetime(mark["closed_at"])
+        recent = {int(k): v for k, v in mark.get("recent", {}).items()}
+        qs = qs.filter(closed_at__gte=edge - WATERMARK_OVERLAP).exclude(id__in=list(recent))
+
+    writers: dict[str, _PartWriter] = {}
+    finished: list[_PartWriter] = []
+    month = None
+    stats = {"tickets": 0, "line_items": 0, "files": 0, "months": 0}
+    top = None
+
+    def close_month():
+        for w in writers.values():
+            w.close()
+            finished.append(w)
+        writers.clear()
+
+    def flush(rows):
+        """Write one chunk of (month, ticket columns) rows plus their line items."""
+        nonlocal month
+        by_month: dict[str, list] = {}
+        for m, row in rows:
+            by_month.setdefault(m, []).append(row)
+        items_by_ticket: dict[int, list] = {}
+        for row in TicketLineItem.objects.filter(ticket_link_id__in=[r[0] for _, r in rows]) \
+                .order_by("ticket_link_id", "id").values_list(*_ITEM_FIELDS):
+            items_by_ticket.setdefault(row[0], []).append(row)
+
+        for m, tickets in by_month.items():   # chunks are in closed_at order, so months only move forward
+            if m != month:
+                close_month()
+                month = m
+                stats["months"] += 1
+                for table in schemas:
+                    path = _partition(root, table, rp.id) / f"month={m}" / f"part-{run}.{ext}"
+                    writers[table] = _PartWriter(path, staging / table / f"{m}.{ext}", schemas[table], fmt)
+            t_cols, i_cols = _columns(schemas["tickets"]), _columns(schemas["line_items"])
+            for values in tickets:
+                for name, v in zip(schemas["tickets"].names, values):
+                    t_cols[name].append(v)
+                tl_id, closed = values[0], values[6]
+                for _tl, menu_item_id, name, name_norm, qty, unit, line in items_by_ticket.get(tl_id, ()):
+                    for col, v in (("ticket_link_id", tl_id), ("closed_at", closed),
+                                   ("menu_item_id", menu_item_id), ("name", name), ("name_norm", name_norm),
+                                   ("qty", qty), ("unit_cents", unit), ("line_cents", line)):
+                        i_cols[col].append(v)
+            writers["tickets"].write(t_cols)
+            if i_cols["ticket_link_id"]:
+                writers["line_items"].write(i_cols)
+            stats["tickets"] += len(tickets)
+            stats["line_items"] += len(i_cols["ticket_link_id"])
+
+    chunk = []
+    try:
+        for (tl_id, ticket_id, number, member, server, staff_key, closed,
+             total_c, tax_c, tip_c, paid_c, pos_ref) in (
+            qs.order_by("closed_at", "id").values_list(*_TICKET_FIELDS).iterator(chunk_size=batch)
+        ):
+            subtotal, tax, tip = int(total_c or 0), int(tax_c or 0), int(tip_c or 0)   # total_cents is pre-tip
+            chunk.append((local_day(closed, tz).strftime("%Y-%m"), (
+                tl_id, ticket_id, number or "", member or "", server or "", staff_key, closed,
+                subtotal, tax, tip, int(paid_c or (subtotal + tax + tip)), pos_ref or "",
+            )))
+            recent[tl_id] = closed.isoformat()
+            top = closed
+            if len(chunk) >= batch:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+        close_month()
+    except BaseException:
+        for w in writers.values():
+            try:
+                w.close()
+            except Exception:
+                pass
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    if full:
+        for table in schemas:
+            shutil.rmtree(_partition(root, table, rp.id), ignore_errors=True)
+    for w in finished:
+        w.path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(w.tmp, w.path)
+    shutil.rmtree(staging, ignore_errors=True)
+    stats["files"] = len(finished)
+
+    if top is not None or full:
+        if top is None:
+            manifest.pop(str(rp.id), None)
+        else:
+            if mark and parse_datetime(mark["closed_at"]) > top:
+                top = parse_datetime(mark["closed_at"])
+            edge = top - WATERMARK_OVERLAP
+            manifest[str(rp.id)] = {
+                "closed_at": top.isoformat(),
+                "recent": {str(k): v for k, v in recent.items() if parse_datetime(v) >= edge},
+                "format": fmt,
+                "exported_at": timezone.now().isoformat(),
+            }
+        _save_manifest(root, manifest)
+    return stats
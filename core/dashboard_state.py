@@ -0,0 +1,261 @@
+# core/dashboard_state.py
+"""
+Owner dashboard state, in sections the page loads and refreshes separately (the
+manager dashboard shares the open section):
+
+  people   owners / managers / staff of the restaurant
+  open     open tickets with the amount due: live POS totals fetched concurrently
+           (core/pos_fanout.py), stored totals for tickets the POS didn't return in time
+  recent   closed tickets for the range / search, newest first, one keyset page at a time
+           (?cursor= from the previous page's next_cursor, ?limit= up to RECENT_PAGE_MAX);
+           q is matched in SQL on ticket and member number, so it reaches all of history
+
+Each section is cached per restaurant. people carries its own generation, bumped by
+invalidate_people() whenever an Ownership, ManagerProfile or StaffProfile changes
+(core/signals.py). open and recent are keyed on the restaurant's analytics generation
+(core/analytics_cache.py), which every close and review write bumps; recent also keys
+on the newest closed_at. Open tabs and POS totals are at most DASHBOARD_OPEN_TTL
+seconds old; refresh=True (the panel's Refresh button) recomputes a section.
+Removing a staff member only drops the people section; the POS isn't called.
+
+  DASHBOARD_CACHE        cache alias (default "default")
+  DASHBOARD_CACHE_TTL    seconds for people / recent (default 120; 0 disables caching)
+  DASHBOARD_OPEN_TTL     seconds for open tickets (default 20)
+  RECENT_PAGE_SIZE       recent rows per page (default 50)
+  RECENT_PAGE_MAX        largest ?limit= accepted (default 200)
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+
+from decouple import config
+from django.core.cache import caches
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+
+from . import analytics_cache, pos_fanout
+from .dates import filter_days, parse_day, restaurant_tz
+from .models import ManagerProfile, Member, Ownership, StaffProfile, TicketLink
+
+CACHE_ALIAS = config("DASHBOARD_CACHE", default="default")
+CACHE_TTL   = int(config("DASHBOARD_CACHE_TTL", default="120"))
+OPEN_TTL    = int(config("DASHBOARD_OPEN_TTL", default="20"))
+RECENT_PAGE_SIZE = int(config("RECENT_PAGE_SIZE", default="50"))
+RECENT_PAGE_MAX  = int(config("RECENT_PAGE_MAX", default="200"))
+
+_PREFIX = "dash"
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _people_gen_key(restaurant_id) -> str:
+    return f"{_PREFIX}:people-gen:{restaurant_id}"
+
+
+def invalidate_people(restaurant_id) -> None:
+    if not restaurant_id:
+        return
+    cache, key = _cache(), _people_gen_key(restaurant_id)
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:  # not set yet (or evicted)
+            cache.set(key, 1, timeout=None)
+    except Exception:
+        pass   # best effort: the entry still ages out after CACHE_TTL
+
+
+def _cached(key_parts, ttl: int, compute, refresh: bool = False):
+    if ttl <= 0 or CACHE_TTL <= 0:
+        return compute()
+    key = ":".join(str(p) for p in (_PREFIX, *key_parts))
+    cache = _cache()
+    if not refresh:
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+    value = compute()
+    cache.set(key, value, timeout=ttl)
+    return value
+
+
+# ---------- sections ----------
+
+def _display(u) -> str:
+    email = (u.email if u else "")
+    return (u.get_full_name() if u else "") or (email.split("@")[0] if email else "")
+
+
+def compute_people(rp) -> dict:
+    owners = []
+    for lk in Ownership.objects.select_related("owner", "owner__user").filter(restaurant=rp):
+        u = getattr(lk.owner, "user", None)
+        owners.append({"id": lk.owner_id, "email": u.email if u else ""})
+    managers = [
+        {"id": m.id, "name": _display(getattr(m, "user", None))}
+        for m in ManagerProfile.objects.select_related("user").filter(restaurant=rp).order_by("user__email")
+    ]
+    staff = [
+        {"id": s.id, "name": _display(getattr(s, "user", None))}
+        for s in StaffProfile.objects.select_related("user").filter(restaurant=rp).order_by("user__email")
+    ]
+    return {"owners": owners, "managers": managers, "staff": staff}
+
+
+def _pos_due(ticket, items) -> int:
+    """Items + tax from the POS (no tip)."""
+    subtotal = 0
+    for it in items:
+        qty = int(it.get("quantity", 1) or 1)
+        unit = int(it.get("price", 0) or 0)
+        subtotal += qty * unit
+    return subtotal + int((ticket.get("totals") or {}).get("tax", 0) or 0)
+
+
+def _stored_due(tl):
+    """Items + tax from the TicketLink's saved items_json, else its last known total."""
+    if tl.items_json:
+        try:
+            subtotal = 0
+            for it in (tl.items_json or []):
+                qty = int(it.get("qty") or it.get("quantity") or 1)
+                unit = int(it.get("price_cents") or it.get("unit_cents") or it.get("cents") or it.get("price") or 0)
+                line = int(it.get("total_cents") or it.get("line_total_cents") or (unit * qty))
+                subtotal += line
+            return subtotal + int(tl.tax_cents or 0)
+        except Exception:
+            pass
+    return int(tl.last_total_cents or tl.total_cents or 0)
+
+
+def compute_open(rp) -> dict:
+    """
+    {"open": [...], "pos": {"live": n, "stale": m}}. POS reads fan out concurrently
+    (core/pos_fanout.py); tickets not back by the deadline use the stored values.
+    """
+    open_qs = list(
+        TicketLink.objects.select_related("member")
+        .filter(restaurant=rp, status="open")
+        .order_by("-opened_at")[:400]
+    )
+    location_id = (rp.omnivore_location_id or "").strip()
+    live = pos_fanout.fetch_live(location_id, [tl.ticket_id for tl in open_qs]) if location_id else {}
+
+    open_map = {}
+    for tl in open_qs:
+        entry = open_map.setdefault(tl.ticket_id, {
+            "ticket_id": tl.ticket_id,
+            "ticket_number": tl.ticket_number or None,
+            "server": tl.server_name or "",
+            "members": [],
+            "due_cents": 0,
+            "live": tl.ticket_id in live,
+        })
+        entry["members"].append(tl.member.number if tl.member else "")
+
+        due = None
+        if tl.ticket_id in live:
+            try:
+                due = _pos_due(*live[tl.ticket_id])
+            except Exception:
+                entry["live"] = False
+        if due is None:
+            due = _stored_due(tl)
+        entry["due_cents"] = max(int(entry["due_cents"] or 0), int(due or 0))
+
+    n_live = sum(1 for e in open_map.values() if e["live"])
+    return {"open": list(open_map.values()), "pos": {"live": n_live, "stale": len(open_map) - n_live}}
+
+
+def encode_cursor(closed_at, pk) -> str:
+    return base64.urlsafe_b64encode(f"{closed_at.isoformat()}|{pk}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """(closed_at, id) from encode_cursor(); ValueError on anything else."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        closed_s, pk_s = raw.split("|", 1)
+        closed = parse_datetime(closed_s)
+        if closed is None:
+            raise ValueError
+        return closed, int(pk_s)
+    except Exception:
+        raise ValueError("Bad cursor.")
+
+
+def page_limit(value) -> int:
+    try:
+        n = int(value)
+    except (TypeError, ValueError):
+        return RECENT_PAGE_SIZE
+    return max(1, min(n, RECENT_PAGE_MAX))
+
+
+def search_filter(q: str) -> Q:
+    """q on ticket number or member number, as SQL (case-insensitive substring)."""
+    # members are matched first (one pass over Member, unique-indexed on number), then
+    # tickets by member id via tl_rest_member_closed; ticket numbers via tl_rest_ticket_number
+    return Q(ticket_number__icontains=q) | Q(member_id__in=Member.objects.filter(number__icontains=q).values("id"))
+
+
+def compute_recent(rp, q: str = "", start=None, end=None, cursor=None, limit=None) -> dict:
+    """
+    One page of closed tickets, newest first: {"recent": [...], "next_cursor": str | None}.
+    Keyset on (closed_at, id), so page N costs the same as page 1.
+    """
+    q = (q or "").strip().lower()
+    limit = page_limit(limit)
+    qs = TicketLink.objects.select_related("member").filter(restaurant=rp, status="closed", closed_at__isnull=False)
+    qs = filter_days(qs, start, end, restaurant_tz(rp))
+    if q:
+        qs = qs.filter(search_filter(q))
+    if cursor:
+        closed, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(closed_at__lt=closed) | Q(closed_at=closed, id__lt=pk))
+
+    page = list(qs.order_by("-closed_at", "-id")[:limit + 1])
+    more = len(page) > limit
+    page = page[:limit]
+    recent = [
+        {
+            "ticket_id": tl.ticket_id,
+            "ticket_number": tl.ticket_number or None,
+            "member": tl.member.number if tl.member else "",
+            "server": tl.server_name or "",
+            "closed_at": tl.closed_at.strftime("%Y-%m-%d %H:%M") if tl.closed_at else "",
+            "total_cents": (tl.paid_cents or tl.total_cents or tl.last_total_cents or 0),
+            "ticket_link_id": tl.id,
+        }
+        for tl in page
+    ]
+    return {"recent": recent, "next_cursor": encode_cursor(page[-1].closed_at, page[-1].id) if more else None}
+
+
+# ---------- cached ----------
+
+def people(rp, refresh: bool = False) -> dict:
+    gen = _cache().get(_people_gen_key(rp.id)) or 0
+    return _cached(("people", rp.id, gen), CACHE_TTL, lambda: compute_people(rp), refresh)
+
+
+def open_tickets(rp, refresh: bool = False) -> dict:
+    return _cached(("open", rp.id, analytics_cache.generation(rp.id)), OPEN_TTL, lambda: compute_open(rp), refresh)
+
+
+def recent(rp, q: str = "", start=None, end=None, cursor=None, limit=None, refresh: bool = False) -> dict:
+    """compute_recent(), cached. Raises ValueError on a bad cursor."""
+    q = (q or "").strip().lower()
+    start, end = parse_day(start), parse_day(end)
+    limit = page_limit(limit)
+    if cursor:
+        decode_cursor(cursor)   # reject junk before it becomes a cache key
+    # the newest close is read from the database, so a close on another worker moves the key too
+    last = TicketLink.objects.filter(restaurant=rp, status="closed").aggregate(m=Max("closed_at"))["m"]
+    key = ("recent", rp.id, analytics_cache.generation(rp.id), last.isoformat() if last else "",
+           start.isoformat() if start else "", end.isoformat() if end else "",
+           hashlib.sha1(q.encode()).hexdigest()[:16] if q else "", cursor or "", limit)
+    return _cached(key, CACHE_TTL, lambda: compute_recent(rp, q, start, end, cursor, limit), refresh)
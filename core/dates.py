@@ -0,0 +1,82 @@
+# core/dates.py
+"""
+Reporting date ranges.
+
+Report filters take calendar days (start/end, inclusive) in the restaurant's local
+zone and turn them into a half-open datetime range on closed_at:
+
+    local start 00:00  <=  closed_at  <  local (end + 1 day) 00:00
+
+so the database compares the raw column and can use the (restaurant, status,
+closed_at) index, instead of casting every row with closed_at__date.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+def restaurant_tz(rp):
+    """The restaurant's reporting zone; settings.TIME_ZONE when unset or unknown."""
+    name = (getattr(rp, "time_zone", "") or "").strip()
+    if name:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return timezone.get_default_timezone()
+
+
+def parse_day(s) -> date | None:
+    """'YYYY-MM-DD' (or a date) -> date; None for blank / junk."""
+    if isinstance(s, date):
+        return s
+    try:
+        return parse_date((s or "").strip()) if s else None
+    except Exception:
+        return None
+
+
+def day_start(d: date, tz) -> datetime:
+    return datetime.combine(d, time.min, tzinfo=tz)
+
+
+def day_bounds(start, end, tz) -> tuple[datetime | None, datetime | None]:
+    """[start 00:00, (end + 1) 00:00) in tz as aware datetimes; either side None when open."""
+    start, end = parse_day(start), parse_day(end)
+    return (
+        day_start(start, tz) if start else None,
+        day_start(end + timedelta(days=1), tz) if end else None,
+    )
+
+
+def local_day(dt, tz) -> date:
+    return timezone.localtime(dt, tz).date()
+
+
+def filter_days(qs, start, end, tz, field: str = "closed_at"):
+    """qs restricted to start <= local day(field) <= end, as a half-open range on the raw column."""
+    lo, hi = day_bounds(start, end, tz)
+    if lo:
+        qs = qs.filter(**{f"{field}__gte": lo})
+    if hi:
+        qs = qs.filter(**{f"{field}__lt": hi})
+    return qs
+
+
+def filter_day_field(qs, start, end, field: str = "day"):
+    """qs restricted to start <= field <= end for a DateField (the daily rollup rows)."""
+    start, end = parse_day(start), parse_day(end)
+    if start:
+        qs = qs.filter(**{f"{field}__gte": start})
+    if end:
+        qs = qs.filter(**{f"{field}__lte": end})
+    return qs
+
+
+def parse_range(params) -> tuple[date | None, date | None]:
+    """(start, end) from request params ?start=YYYY-MM-DD&end=YYYY-MM-DD; junk or blank = open."""
+    return parse_day(params.get("start")), parse_day(params.get("end"))
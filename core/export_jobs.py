@@ -0,0 +1,157 @@
+# core/export_jobs.py
+"""
+Background closed-ticket exports.
+
+The dashboards enqueue() a job (restaurant, scope, date range, q, format) and poll
+job_payload() until it is done, then fetch the file through the download view. The
+query-and-serialize cycle runs in `manage.py run_export_jobs`, which claims queued
+jobs one at a time and writes them with the same writers as the synchronous
+exports (core/exports.py) into MEDIA_ROOT/exports/.
+
+claim_next() takes a job with a conditional UPDATE (status queued -> running), so
+several workers can run side by side without picking the same job. cleanup()
+deletes finished files after EXPORT_JOB_TTL_HOURS and fails jobs whose worker
+died mid-run.
+
+  EXPORT_JOB_TTL_HOURS        how long a finished file stays downloadable (default 24)
+  EXPORT_JOB_STALE_MINUTES    running longer than this = worker gone (default 60)
+  EXPORT_JOB_MAX_ACTIVE       queued/running jobs allowed per user (default 3)
+"""
+from __future__ import annotations
+
+import tempfile
+import uuid
+from datetime import timedelta
+
+from decouple import config
+from django.core.files import File
+from django.urls import reverse
+from django.utils import timezone
+
+from .dates import parse_range
+from .exports import export_filename, export_rows, write_csv, write_xlsx
+from .models import ExportJob
+
+EXPORT_JOB_TTL_HOURS = int(config("EXPORT_JOB_TTL_HOURS", default="24"))
+EXPORT_JOB_STALE_MINUTES = int(config("EXPORT_JOB_STALE_MINUTES", default="60"))
+EXPORT_JOB_MAX_ACTIVE = int(config("EXPORT_JOB_MAX_ACTIVE", default="3"))
+
+WRITERS = {"csv": write_csv, "xlsx": write_xlsx}
+
+_ACTIVE = ("queued", "running")
+
+
+def enqueue(rp, user, scope: str, params) -> ExportJob:
+    """
+    Queue an export of rp's closed tickets from request-style params (start, end, q, format).
+    An identical job the user already has in flight is returned instead of a new one.
+    Raises ValueError on a bad format or when the user has too many jobs in flight.
+    """
+    fmt = (params.get("format") or "xlsx").strip().lower()
+    if fmt not in WRITERS:
+        raise ValueError("Unknown export format.")
+    start, end = parse_range(params)
+    q = (params.get("q") or "").strip().lower()[:120]
+
+    active = ExportJob.objects.filter(requested_by=user, status__in=_ACTIVE)
+    same = active.filter(restaurant=rp, scope=scope, format=fmt, start=start, end=end, q=q).first()
+    if same:
+        return same
+    if active.count() >= EXPORT_JOB_MAX_ACTIVE:
+        raise ValueError("Too many exports in progress; wait for one to finish.")
+    return ExportJob.objects.create(restaurant=rp, requested_by=user, scope=scope, format=fmt,
+                                    start=start, end=end, q=q)
+
+
+def claim_next() -> ExportJob | None:
+    """Oldest queued job, switched to running. None when the queue is empty."""
+    while True:
+        pk = (ExportJob.objects.filter(status="queued").order_by("created_at", "id")
+              .values_list("id", flat=True).first())
+        if pk is None:
+            return None
+        # another worker may claim it between the read and here; then try the next one
+        if ExportJob.objects.filter(pk=pk, status="queued").update(status="running", started_at=timezone.now()):
+            return ExportJob.objects.select_related("restaurant").get(pk=pk)
+
+
+def run_job(job: ExportJob) -> ExportJob:
+    """Write the export for a claimed job into MEDIA_ROOT and mark it done (or failed)."""
+    rp = job.restaurant
+    try:
+        with tempfile.TemporaryFile() as out:
+            rows = WRITERS[job.format](export_rows(rp, job.start, job.end, job.q), out)
+            out.seek(0)
+            # the random directory keeps names unguessable should MEDIA_ROOT ever be served directly
+            job.file.save(f"{uuid.uuid4().hex}/{export_filename(rp, job.format)}", File(out), save=False)
+    except Exception as e:
+        job.status, job.error = "failed", f"{type(e).__name__}: {e}"[:2000]
+        job.finished_at = timezone.now()
+        job.save(update_fields=["status", "error", "finished_at"])
+        return job
+
+    now = timezone.now()
+    job.status, job.error, job.rows = "done", "", rows
+    job.size_bytes = job.file.size
+    job.finished_at = now
+    job.expires_at = now + timedelta(hours=EXPORT_JOB_TTL_HOURS)
+    job.save(update_fields=["status", "error", "rows", "file", "size_bytes", "finished_at", "expires_at"])
+    return job
+
+
+def cleanup(now=None) -> tuple[int, int]:
+    """Delete expired jobs and their files; fail jobs stuck in running. Returns (deleted, failed)."""
+    now = now or timezone.now()
+    failed = ExportJob.objects.filter(
+        status="running", started_at__lt=now - timedelta(minutes=EXPORT_JOB_STALE_MINUTES),
+    ).update(status="failed", error="Export worker stopped before finishing.", finished_at=now)
+
+    deleted = 0
+    # finished jobs expire by expires_at; failed ones carry no file and go after the same TTL
+    expired = ExportJob.objects.filter(expires_at__lt=now) | ExportJob.objects.filter(
+        status="failed", finished_at__lt=now - timedelta(hours=EXPORT_JOB_TTL_HOURS))
+    for job in expired.only("id", "file"):
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        deleted += 1
+    return deleted, failed
+
+
+def _can_access(ctx, job: ExportJob) -> bool:
+    """Whether a role context may still read the job's restaurant: owned now, or managed now."""
+    if job.scope == "owner":
+        return ctx.owns(job.restaurant_id) is not None
+    restaurant = ctx.manager_restaurant
+    return job.scope == "manager" and restaurant is not None and restaurant.id == job.restaurant_id
+
+
+def job_for_user(request, pk, scope: str, **filters) -> ExportJob | None:
+    """
+    The requester's own job in this scope, only while they still have access to its
+    restaurant (request.role_ctx): a sold restaurant or a reassigned manager loses
+    the exports requested before.
+    """
+    job = (ExportJob.objects.filter(pk=pk, requested_by=request.user, scope=scope, **filters)
+           .select_related("restaurant").first())
+    if job is None or not _can_access(request.role_ctx, job):
+        return None
+    return job
+
+
+def job_payload(job: ExportJob, download_url_name: str) -> dict:
+    done = job.status == "done" and bool(job.file)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "format": job.format,
+        "start": job.start.isoformat() if job.start else None,
+        "end": job.end.isoformat() if job.end else None,
+        "q": job.q,
+        "rows": job.rows if done else None,
+        "size_bytes": job.size_bytes if done else None,
+        "error": job.error or None,
+        "created_at": job.created_at.isoformat(),
+        "expires_at": job.expires_at.isoformat() if job.expires_at else None,
+        "download_url": reverse(download_url_name, args=[job.id]) if done else None,
+    }
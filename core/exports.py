@@ -0,0 +1,349 @@
+# core/exports.py
+"""
+Closed-ticket exports behind owner_export / manager_export.
+
+export_rows() walks the restaurant's closed tickets for a date range as a narrow
+values_list projection in closed_at order, chunked with .iterator(), and yields one
+tuple per row (money in cents):
+
+    closed_at, ticket, member, server, subtotal, tax, tip, total, pos_ref
+
+csv_response() streams those rows with StreamingHttpResponse. Nothing is
+materialized, so memory stays flat and the header goes out before the first query
+page is read, whatever the range.
+
+xlsx_response() feeds the same rows into a write-only openpyxl workbook (rows go
+straight to the sheet XML on disk) and serves the finished file from a temporary
+file. The sheet layout is the dashboard's usual one: bold headers, currency
+columns, fixed widths and a Grand total SUM row. `manage.py bench_export` measures
+the memory ceiling of both writers; write_csv() / write_xlsx() are also what the
+background export jobs (core/export_jobs.py) use to write their files.
+
+The portfolio_* functions do the same for every restaurant an owner has, from one
+query ordered by (restaurant, closed_at): portfolio_sections() adds a subtotal row
+after each restaurant and a grand total in the same pass, and the summary endpoint
+reads the totals from that pass without the ticket rows.
+
+  EXPORT_CHUNK   rows fetched per database round trip (default 2000)
+"""
+from __future__ import annotations
+
+import csv
+import tempfile
+
+from decouple import config
+from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from .dates import day_bounds, filter_days, restaurant_tz
+from .models import TicketLink
+
+EXPORT_CHUNK = int(config("EXPORT_CHUNK", default="2000"))
+
+HEADERS = ["Closed", "Ticket", "Member", "Server", "Subtotal", "Tax", "Tip", "Total", "POS Ref"]
+
+_FIELDS = (
+    "closed_at", "ticket_number", "ticket_id", "member__number", "server_name",
+    "total_cents", "tax_cents", "tip_cents", "paid_cents", "pos_ref",
+)
+
+
+def _export_row(values, q: str):
+    """One export row from a _FIELDS tuple, or None when it doesn't match q."""
+    closed, number, ticket_id, member, server, total_c, tax_c, tip_c, paid_c, pos_ref = values
+    ticket = number or ticket_id
+    if q and q not in f"{ticket} {member or ''}".lower():
+        return None
+    subtotal = int(total_c or 0)   # total_cents is the pre-tip base
+    tax      = int(tax_c or 0)
+    tip      = int(tip_c or 0)
+    total    = int(paid_c or (subtotal + tax + tip))  # what was paid
+    return closed, ticket, member or "", server or "", subtotal, tax, tip, total, pos_ref or ""
+
+
+def export_rows(rp, start=None, end=None, q: str = ""):
+    """Closed tickets for [start, end] (local days, inclusive) matching q on ticket / member number."""
+    q = (q or "").strip().lower()
+    qs = filter_days(TicketLink.objects.filter(restaurant=rp, status="closed"), start, end, restaurant_tz(rp))
+    for values in qs.order_by("closed_at", "id").values_list(*_FIELDS).iterator(chunk_size=EXPORT_CHUNK):
+        row = _export_row(values, q)
+        if row is not None:
+            yield row
+
+
+def restaurant_name(rp) -> str:
+    return rp.dba_name or rp.legal_name or "restaurant"
+
+
+def export_filename(rp, ext: str) -> str:
+    return f"{restaurant_name(rp).replace(' ', '_')}_closed_{timezone.now().strftime('%Y%m%d')}.{ext}"
+
+
+def _fmt_closed(dt) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M") if dt else ""
+
+
+def _dollars(cents: int) -> str:
+    return f"{cents / 100:.2f}"
+
+
+class _Echo:
+    """csv.writer target that hands each formatted line back instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADERS)
+    grand = 0
+    for closed, ticket, member, server, subtotal, tax, tip, total, pos_ref in rows:
+        grand += total
+        yield writer.writerow([
+            _fmt_closed(closed), ticket, member, server,
+            _dollars(subtotal), _dollars(tax), _dollars(tip), _dollars(total), pos_ref,
+        ])
+    yield writer.writerow(["", "", "", "", "", "", "Grand total", _dollars(grand), ""])
+
+
+def write_csv(rows, fileobj) -> int:
+    """Write rows (export_rows() tuples) as UTF-8 CSV into a binary fileobj. Returns the number of data rows."""
+    n = 0
+
+    def counted():
+        nonlocal n
+        for row in rows:
+            n += 1
+            yield row
+
+    for line in _csv_lines(counted()):
+        fileobj.write(line.encode())
+    return n
+
+
+def csv_response(rp, start=None, end=None, q: str = "") -> StreamingHttpResponse:
+    resp = StreamingHttpResponse(_csv_lines(export_rows(rp, start, end, q)), content_type="text/csv; charset=utf-8")
+    resp["Content-Disposition"] = f'attachment; filename="{export_filename(rp, "csv")}"'
+    return resp
+
+
+# ---------- xlsx ----------
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CURRENCY_FMT = u'[$$-409]#,##0.00'
+WIDTHS = [18, 12, 14, 12, 12, 12, 12, 12, 16]
+
+
+def write_xlsx(rows, fileobj) -> int:
+    """
+    Write rows (export_rows() tuples) as the "Closed" sheet into fileobj with a write-only
+    workbook: constant memory whatever the row count. Returns the number of data rows.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Closed")
+    for i, w in enumerate(WIDTHS, start=1):   # write-only sheets take widths before any row
+        ws.column_dimensions[get_column_letter(i)].width = w
+
+    bold = Font(bold=True)
+
+    def styled(value, font=None, number_format=None):
+        cell = WriteOnlyCell(ws, value=value)
+        if font:
+            cell.font = font
+        if number_format:
+            cell.number_format = number_format
+        return cell
+
+    ws.append([styled(h, font=bold) for h in HEADERS])
+    # append() serializes a row immediately, so the four styled currency cells are reused
+    money = [styled(None, number_format=CURRENCY_FMT) for _ in range(4)]
+    n = 0
+    for closed, ticket, member, server, *cents, pos_ref in rows:
+        for cell, c in zip(money, cents):
+            cell.value = c / 100.0
+        ws.append([_fmt_closed(closed), ticket, member, server, *money, pos_ref])
+        n += 1
+
+    total_row = n + 2
+    ws.append([None] * 6 + [
+        styled("Grand total", font=bold),
+        styled(f"=SUM(H2:H{total_row - 1})", font=bold, number_format=CURRENCY_FMT),
+    ])
+    wb.save(fileobj)
+    return n
+
+
+def xlsx_response(rp, start=None, end=None, q: str = "") -> FileResponse:
+    # spooled: small exports never touch disk, big ones spill instead of growing in memory
+    out = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    write_xlsx(export_rows(rp, start, end, q), out)
+    out.seek(0)
+    return FileResponse(out, as_attachment=True, filename=export_filename(rp, "xlsx"), content_type=XLSX_CONTENT_TYPE)
+
+
+# ---------- portfolio (every restaurant an owner has) ----------
+
+PORTFOLIO_HEADERS = ["Restaurant", *HEADERS]
+PORTFOLIO_WIDTHS = [24, *WIDTHS]
+
+
+def portfolio_rows(restaurants, start=None, end=None, q: str = ""):
+    """
+    (restaurant_id, export row) for several restaurants from ONE query ordered by
+    (restaurant, closed_at). Each restaurant's [start, end] is in its own time zone.
+    """
+    q = (q or "").strip().lower()
+    ids_by_tz: dict = {}
+    for rp in restaurants:
+        ids_by_tz.setdefault(restaurant_tz(rp), []).append(rp.id)
+    if not ids_by_tz:
+        return
+    where = Q()
+    for tz, ids in ids_by_tz.items():
+        lo, hi = day_bounds(start, end, tz)
+        cond = Q(restaurant_id__in=ids)
+        if lo:
+            cond &= Q(closed_at__gte=lo)
+        if hi:
+            cond &= Q(closed_at__lt=hi)
+        where |= cond
+    qs = TicketLink.objects.filter(where, status="closed")
+    for rid, *values in (
+        qs.order_by("restaurant_id", "closed_at", "id").values_list("restaurant_id", *_FIELDS)
+        .iterator(chunk_size=EXPORT_CHUNK)
+    ):
+        row = _export_row(values, q)
+        if row is not None:
+            yield rid, row
+
+
+def portfolio_sections(restaurants, start=None, end=None, q: str = ""):
+    """
+    Single pass over portfolio_rows() with running subtotals. Yields, in restaurant id order:
+      ("row", rp, export row)            every ticket
+      ("subtotal", rp, sums)             after each restaurant (also ones with no tickets)
+      ("total", None, sums)              once at the end
+    where sums = [tickets, subtotal, tax, tip, total] in cents.
+    """
+    restaurants = sorted(restaurants, key=lambda rp: rp.id)
+    pending = iter(restaurants)
+    current, sums, grand = None, None, [0] * 5
+
+    def close():
+        for i, v in enumerate(sums):
+            grand[i] += v
+        return ("subtotal", current, sums)
+
+    for rid, row in portfolio_rows(restaurants, start, end, q):
+        while current is None or current.id != rid:
+            if current is not None:
+                yield close()
+            current, sums = next(pending), [0] * 5
+        sums[0] += 1
+        for i, c in enumerate(row[4:8], start=1):
+            sums[i] += c
+        yield ("row", current, row)
+    if current is not None:
+        yield close()
+    for current in pending:
+        sums = [0] * 5
+        yield close()
+    yield ("total", None, grand)
+
+
+def _section_label(kind, rp, sums) -> list:
+    """Restaurant / Ticket / Member / Server cells for a subtotal or grand-total row."""
+    name = restaurant_name(rp) if rp else "All restaurants"
+    return [name, "Subtotal" if kind == "subtotal" else "Grand total", f"{sums[0]} tickets", ""]
+
+
+def _portfolio_csv_lines(sections):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(PORTFOLIO_HEADERS)
+    for kind, rp, data in sections:
+        if kind == "row":
+            closed, ticket, member, server, subtotal, tax, tip, total, pos_ref = data
+            yield writer.writerow([
+                restaurant_name(rp), _fmt_closed(closed), ticket, member, server,
+                _dollars(subtotal), _dollars(tax), _dollars(tip), _dollars(total), pos_ref,
+            ])
+        else:
+            yield writer.writerow([*_section_label(kind, rp, data), "", *map(_dollars, data[1:]), ""])
+
+
+def portfolio_filename(ext: str) -> str:
+    return f"portfolio_closed_{timezone.now().strftime('%Y%m%d')}.{ext}"
+
+
+def portfolio_csv_response(restaurants, start=None, end=None, q: str = "") -> StreamingHttpResponse:
+    resp = StreamingHttpResponse(_portfolio_csv_lines(portfolio_sections(restaurants, start, end, q)),
+                                 content_type="text/csv; charset=utf-8")
+    resp["Content-Disposition"] = f'attachment; filename="{portfolio_filename("csv")}"'
+    return resp
+
+
+def write_portfolio_xlsx(sections, fileobj) -> int:
+    """Like write_xlsx() with a Restaurant column and bold subtotal / grand-total rows. Returns data rows."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Closed")
+    for i, w in enumerate(PORTFOLIO_WIDTHS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = w
+    bold = Font(bold=True)
+
+    def styled(value, font=None, number_format=None):
+        cell = WriteOnlyCell(ws, value=value)
+        if font:
+            cell.font = font
+        if number_format:
+            cell.number_format = number_format
+        return cell
+
+    ws.append([styled(h, font=bold) for h in PORTFOLIO_HEADERS])
+    money = [styled(None, number_format=CURRENCY_FMT) for _ in range(4)]
+    n = 0
+    for kind, rp, data in sections:
+        if kind == "row":
+            closed, ticket, member, server, *cents, pos_ref = data
+            for cell, c in zip(money, cents):
+                cell.value = c / 100.0
+            ws.append([restaurant_name(rp), _fmt_closed(closed), ticket, member, server, *money, pos_ref])
+            n += 1
+        else:
+            ws.append([styled(v, font=bold) for v in _section_label(kind, rp, data)] + [None] + [
+                styled(c / 100.0, font=bold, number_format=CURRENCY_FMT) for c in data[1:]
+            ])
+    wb.save(fileobj)
+    return n
+
+
+def portfolio_xlsx_response(restaurants, start=None, end=None, q: str = "") -> FileResponse:
+    out = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    write_portfolio_xlsx(portfolio_sections(restaurants, start, end, q), out)
+    out.seek(0)
+    return FileResponse(out, as_attachment=True, filename=portfolio_filename("xlsx"), content_type=XLSX_CONTENT_TYPE)
+
+
+def portfolio_summary(restaurants, start=None, end=None, q: str = "") -> dict:
+    """Per-restaurant and overall counts / money for the portfolio, from the same single pass as the files."""
+    out, totals = [], None
+    for kind, rp, sums in portfolio_sections(restaurants, start, end, q):
+        if kind == "row":
+            continue
+        entry = dict(zip(("tickets", "subtotal_cents", "tax_cents", "tip_cents", "total_cents"), sums))
+        if kind == "subtotal":
+            out.append({"restaurant_id": rp.id, "name": restaurant_name(rp), **entry})
+        else:
+            totals = entry
+    return {"restaurants": out, "totals": totals}
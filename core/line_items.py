@@ -0,0 +1,134 @@
+# core/line_items.py
+"""
+TicketLineItem: normalized item rows for closed tickets.
+
+  sync_line_items(links)        rewrite the rows for closed TicketLinks (called at close)
+
+Aggregation over these rows lives in core/rollups.py.
+"""
+from __future__ import annotations
+
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import TicketLineItem
+
+# plausible band in cents for menu items
+MIN_CENTS, MAX_CENTS = 50, 4000
+
+
+def norm_name(s: str) -> str:
+    s = (s or "").strip().lower()
+    return " ".join(s.replace("$", "").split())
+
+
+def row_qty(row: dict) -> int:
+    try:
+        return int(row.get("quantity") or row.get("qty") or 1)
+    except Exception:
+        return 1
+
+
+def unit_cents_from_row(row: dict) -> int | None:
+    """
+    Best-effort unit price in cents. Order:
+      1) total_cents or line_total_cents / qty
+      2) explicit *_cents fields
+      3) dollar-looking 'price' with decimal -> dollars * 100
+      4) bare integer 'price' treated as CENTS (legacy), not dollars
+    """
+    qty = max(row_qty(row), 1)
+
+    # (1) derive from totals
+    for k in ("total_cents", "line_total_cents"):
+        v = row.get(k)
+        if v is None:
+            continue
+        try:
+            tc = int(v)
+            if tc >= 0:
+                return int(round(tc / qty))
+        except Exception:
+            pass
+
+    # (2) explicit cents fields
+    for k in ("unit_cents", "price_cents", "cents", "unit_price_cents"):
+        v = row.get(k)
+        if v is None:
+            continue
+        try:
+            uc = int(v)
+            if uc >= 0:
+                return uc
+        except Exception:
+            pass
+
+    # (3) dollar-looking strings/floats with a decimal
+    for k in ("unit_price", "price"):
+        v = row.get(k)
+        if v is None:
+            continue
+        s = str(v).strip()
+        if "." in s:
+            try:
+                return int(Decimal(s) * 100)
+            except Exception:
+                continue
+
+    # (4) last resort: bare integer 'price' as CENTS (legacy exports)
+    for k in ("unit_price", "price"):
+        v = row.get(k)
+        if v is None:
+            continue
+        try:
+            return max(int(str(v).replace(",", "")), 0)
+        except Exception:
+            pass
+
+    return None
+
+
+def _line_cents(row: dict, qty: int, unit_cents: int | None) -> int:
+    for k in ("total_cents", "line_total_cents"):
+        try:
+            if row.get(k) is not None:
+                return int(row[k])
+        except Exception:
+            pass
+    return int(unit_cents or 0) * qty
+
+
+def build_line_items(tl) -> list[TicketLineItem]:
+    """Unsaved TicketLineItem rows for a closed TicketLink's items_json."""
+    out = []
+    for row in (tl.items_json or []):
+        if not isinstance(row, dict):
+            continue
+        name = (row.get("name") or row.get("label") or "").strip() or "Unknown item"
+        qty = row_qty(row)
+        unit = unit_cents_from_row(row)
+        out.append(TicketLineItem(
+            ticket_link_id=tl.id,
+            restaurant_id=tl.restaurant_id,
+            menu_item_id=str(row.get("menu_item_id") or row.get("id") or "").strip()[:64],
+            name=name[:160],
+            name_norm=norm_name(name)[:160],
+            qty=qty,
+            unit_cents=unit,
+            line_cents=_line_cents(row, qty, unit),
+            closed_at=tl.closed_at,
+        ))
+    return out
+
+
+def sync_line_items(links) -> int:
+    """Replace the line-item rows for the given closed TicketLinks. Returns rows written."""
+    links = [tl for tl in links if tl.status == "closed" and tl.closed_at]
+    if not links:
+        return 0
+    rows = [li for tl in links for li in build_line_items(tl)]
+    with transaction.atomic():
+        TicketLineItem.objects.filter(ticket_link_id__in=[tl.id for tl in links]).delete()
+        TicketLineItem.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,148 @@
+# core/locks.py
+"""
+Per-(restaurant, ticket) locks so two closes of the same check never both
+charge Stripe and post to POS. Different tickets never contend.
+
+Two backends, picked by env:
+
+  TICKET_LOCK_BACKEND   "db" (TicketLock rows, default) | "cache" (cache.add)
+  TICKET_LOCK_CACHE     cache alias for the cache backend (default "default");
+                        must be shared across workers (Redis/Memcached) in prod
+  TICKET_LOCK_WAIT      seconds to wait for the lock before giving up (default 10)
+  TICKET_LOCK_TTL       lease length in seconds; a crashed holder's lock is
+                        taken over after this (default 120)
+"""
+from __future__ import annotations
+
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import wraps
+
+from decouple import config
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import TicketLock
+
+LOCK_BACKEND = config("TICKET_LOCK_BACKEND", default="db").strip().lower()
+LOCK_CACHE   = config("TICKET_LOCK_CACHE", default="default")
+LOCK_WAIT    = float(config("TICKET_LOCK_WAIT", default="10"))
+LOCK_TTL     = float(config("TICKET_LOCK_TTL", default="120"))
+
+_POLL_SECONDS = 0.05
+
+
+class TicketLockTimeout(Exception):
+    def __init__(self, restaurant_id, ticket_id, waited: float):
+        super().__init__(f"ticket {restaurant_id}:{ticket_id} still locked after {waited:.1f}s")
+        self.restaurant_id = restaurant_id
+        self.ticket_id = ticket_id
+
+
+def _sleep():
+    # small jitter so waiters don't poll in lockstep
+    time.sleep(_POLL_SECONDS * (0.5 + random.random()))
+
+
+class DbTicketLock:
+    """Lease row in core_ticketlock; the unique constraint does the mutual exclusion."""
+
+    def try_acquire(self, restaurant_id, ticket_id, token: str, ttl: float) -> bool:
+        now = timezone.now()
+        expires = now + timedelta(seconds=ttl)
+        try:
+            with transaction.atomic():
+                TicketLock.objects.create(
+                    restaurant_id=restaurant_id, ticket_id=ticket_id, token=token, expires_at=expires
+                )
+            return True
+        except IntegrityError:
+            # Held. Take it over only if the holder's lease ran out.
+            return bool(
+                TicketLock.objects
+                .filter(restaurant_id=restaurant_id, ticket_id=ticket_id, expires_at__lte=now)
+                .update(token=token, expires_at=expires)
+            )
+
+    def release(self, restaurant_id, ticket_id, token: str) -> None:
+        TicketLock.objects.filter(restaurant_id=restaurant_id, ticket_id=ticket_id, token=token).delete()
+
+
+class CacheTicketLock:
+    """cache.add() is atomic on Redis/Memcached/DB caches; the key expires with the lease."""
+
+    def __init__(self, alias: str = LOCK_CACHE):
+        self.alias = alias
+
+    @staticmethod
+    def _key(restaurant_id, ticket_id) -> str:
+        return f"ticket-lock:{restaurant_id}:{ticket_id}"
+
+    def try_acquire(self, restaurant_id, ticket_id, token: str, ttl: float) -> bool:
+        return bool(caches[self.alias].add(self._key(restaurant_id, ticket_id), token, timeout=max(1, int(ttl))))
+
+    def release(self, restaurant_id, ticket_id, token: str) -> None:
+        cache = caches[self.alias]
+        key = self._key(restaurant_id, ticket_id)
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+_BACKENDS = {"db": DbTicketLock, "cache": CacheTicketLock}
+
+
+def get_lock_backend(name: str | None = None):
+    try:
+        return _BACKENDS[(name or LOCK_BACKEND)]()
+    except KeyError:
+        raise ValueError(f"Unknown TICKET_LOCK_BACKEND {name or LOCK_BACKEND!r} (expected 'db' or 'cache')")
+
+
+@contextmanager
+def ticket_lock(restaurant_id, ticket_id, *, wait: float | None = None, ttl: float | None = None, backend=None):
+    """
+    Hold the (restaurant, ticket) lock for the body of the with-block.
+    Raises TicketLockTimeout if it can't be had within `wait` seconds.
+    """
+    backend = backend or get_lock_backend()
+    wait = LOCK_WAIT if wait is None else wait
+    ttl = LOCK_TTL if ttl is None else ttl
+    token = uuid.uuid4().hex
+
+    started = time.monotonic()
+    while not backend.try_acquire(restaurant_id, ticket_id, token, ttl):
+        waited = time.monotonic() - started
+        if waited >= wait:
+            raise TicketLockTimeout(restaurant_id, ticket_id, waited)
+        _sleep()
+    try:
+        yield token
+    finally:
+        backend.release(restaurant_id, ticket_id, token)
+
+
+def serialize_ticket_close(resolve):
+    """
+    View decorator: `resolve(request, *args, **kwargs)` returns (restaurant_id, ticket_id)
+    for the ticket about to be closed, or None to run unlocked (the view will 4xx on its own).
+    The view body runs under ticket_lock, so a second close of the same ticket waits, then
+    sees the links already closed. Lock wait timeout -> 409 close_in_progress.
+    """
+    def decorator(view):
+        @wraps(view)
+        def _wrapped(request, *args, **kwargs):
+            key = resolve(request, *args, **kwargs)
+            if not key:
+                return view(request, *args, **kwargs)
+            try:
+                with ticket_lock(*key):
+                    return view(request, *args, **kwargs)
+            except TicketLockTimeout:
+                return JsonResponse({"ok": False, "error": "close_in_progress"}, status=409)
+        return _wrapped
+    return decorator
@@ -0,0 +1,36 @@
+# core/management/commands/backfill_line_items.py
+from django.core.management.base import BaseCommand
+
+from core.line_items import sync_line_items
+from core.models import TicketLink
+
+
+class Command(BaseCommand):
+    help = "Populate TicketLineItem from items_json of closed TicketLinks, in primary-key chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk", type=int, default=2000, help="TicketLinks per batch.")
+        parser.add_argument("--restaurant", type=int, help="Only this RestaurantProfile id.")
+        parser.add_argument("--rebuild", action="store_true",
+                            help="Rewrite tickets that already have line items too.")
+
+    def handle(self, *args, **opts):
+        chunk = max(1, opts["chunk"])
+        qs = TicketLink.objects.filter(status="closed", closed_at__isnull=False)
+        if opts.get("restaurant"):
+            qs = qs.filter(restaurant_id=opts["restaurant"])
+        if not opts.get("rebuild"):
+            qs = qs.filter(line_items__isnull=True)
+        qs = qs.only("id", "restaurant_id", "status", "closed_at", "items_json").order_by("id")
+
+        last_id, tickets, rows = 0, 0, 0
+        while True:
+            batch = list(qs.filter(id__gt=last_id)[:chunk])
+            if not batch:
+                break
+            rows += sync_line_items(batch)
+            tickets += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"… through TicketLink {last_id}: {tickets} tickets, {rows} line items")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {rows} line items across {tickets} closed tickets."))
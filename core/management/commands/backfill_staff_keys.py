@@ -0,0 +1,38 @@
+# core/management/commands/backfill_staff_keys.py
+from django.core.management.base import BaseCommand
+
+from core.models import TicketLink
+from core.rollups import stamp_staff_keys
+
+
+class Command(BaseCommand):
+    help = "Resolve TicketLink.staff_key / staff_name for closed tickets against staff_cache, in primary-key chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk", type=int, default=2000, help="TicketLinks per batch.")
+        parser.add_argument("--restaurant", type=int, help="Only this RestaurantProfile id.")
+        parser.add_argument("--rebuild", action="store_true",
+                            help="Re-resolve tickets that already have a staff_key too (e.g. after a staff sync); "
+                                 "run rebuild_daily_stats afterwards so the staff rollups follow.")
+
+    def handle(self, *args, **opts):
+        chunk = max(1, opts["chunk"])
+        qs = TicketLink.objects.filter(status="closed", closed_at__isnull=False)
+        if opts.get("restaurant"):
+            qs = qs.filter(restaurant_id=opts["restaurant"])
+        if not opts.get("rebuild"):
+            qs = qs.filter(staff_key__isnull=True)
+        qs = qs.only("id", "restaurant_id", "server_name", "raw_ticket_json").order_by("id")
+
+        last_id, tickets, resolved = 0, 0, 0
+        while True:
+            batch = list(qs.filter(id__gt=last_id)[:chunk])
+            if not batch:
+                break
+            stamp_staff_keys(batch)
+            tickets += len(batch)
+            resolved += sum(1 for tl in batch if tl.staff_key)
+            last_id = batch[-1].id
+            self.stdout.write(f"… through TicketLink {last_id}: {tickets} tickets, {resolved} with a server")
+
+        self.stdout.write(self.style.SUCCESS(f"Stamped staff keys on {tickets} closed tickets ({resolved} with a server)."))
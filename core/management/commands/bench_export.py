@@ -0,0 +1,104 @@
+# core/management/commands/bench_export.py
+"""
+Memory ceiling of the closed-ticket export writers (core/exports.py).
+
+Feeds synthetic export rows (no database) through the streaming CSV writer, the
+write-only XLSX writer and, for contrast, the old build-everything-in-memory
+workbook. Each writer runs in a forked child so its peak RSS is its own; prints
+wall time, peak RSS and growth over the child's starting RSS:
+
+  python manage.py bench_export --rows 1000000
+  python manage.py bench_export --rows 1000000 --legacy-rows 100000
+
+The streaming writers should report about the same growth at any row count. The
+in-memory workbook grows with the rows, so it runs on --legacy-rows (0 skips it).
+"""
+from __future__ import annotations
+
+import multiprocessing
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+
+from core import exports
+
+
+def _rows(n: int, seed: int):
+    rnd = random.Random(seed)
+    t = datetime(2022, 1, 1, tzinfo=dt_timezone.utc)
+    for i in range(n):
+        t += timedelta(seconds=rnd.randrange(30, 600))
+        subtotal = rnd.randrange(500, 20000)
+        tax, tip = subtotal * 8 // 100, rnd.randrange(0, subtotal // 4)
+        yield (t, f"T{i:07d}", f"M{rnd.randrange(1, 5000):05d}", rnd.choice(("Ann", "Bob", "Cy", "")),
+               subtotal, tax, tip, subtotal + tax + tip, f"ref-{i}")
+
+
+def _legacy_xlsx(rows, fileobj) -> None:
+    """The pre-streaming export: every row in a list, a normal workbook, saved via BytesIO."""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    rows = list(rows)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Closed"
+    ws.append(exports.HEADERS)
+    for c in ws[1]:
+        c.font = Font(bold=True)
+    for closed, ticket, member, server, subtotal, tax, tip, total, pos_ref in rows:
+        ws.append([exports._fmt_closed(closed), ticket, member, server,
+                   subtotal / 100.0, tax / 100.0, tip / 100.0, total / 100.0, pos_ref])
+    for row in ws.iter_rows(min_row=2, min_col=5, max_col=8):
+        for cell in row:
+            cell.number_format = exports.CURRENCY_FMT
+    for i, w in enumerate(exports.WIDTHS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = w
+    total_row = len(rows) + 2
+    ws.cell(row=total_row, column=7, value="Grand total").font = Font(bold=True)
+    ws.cell(row=total_row, column=8, value=f"=SUM(H2:H{total_row - 1})").number_format = exports.CURRENCY_FMT
+    bio = BytesIO()
+    wb.save(bio)
+    fileobj.write(bio.getvalue())
+
+
+def _measure(writer, n, seed, results) -> None:
+    """Child process: run one writer, report (seconds, start RSS, peak RSS, file bytes)."""
+    start_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryFile() as out:
+        t0 = time.perf_counter()
+        writer(_rows(n, seed), out)
+        elapsed = time.perf_counter() - t0
+        size = out.tell()
+    results.put((elapsed, start_kb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, size))
+
+
+class Command(BaseCommand):
+    help = "Measure time and peak RSS of the CSV / write-only XLSX exports vs the in-memory workbook"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="Rows for the streaming writers.")
+        parser.add_argument("--legacy-rows", type=int, default=100_000,
+                            help="Rows for the in-memory workbook (0 to skip).")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **opts):
+        runs = [("csv (streamed)", exports.write_csv, opts["rows"]), ("xlsx write-only", exports.write_xlsx, opts["rows"])]
+        if opts["legacy_rows"] > 0:
+            runs.append(("xlsx in-memory (old)", _legacy_xlsx, opts["legacy_rows"]))
+
+        ctx = multiprocessing.get_context("fork")
+        for label, writer, n in runs:
+            results = ctx.Queue()
+            child = ctx.Process(target=_measure, args=(writer, n, opts["seed"], results))
+            child.start()
+            elapsed, start_kb, peak_kb, size = results.get()
+            child.join()
+            self.stdout.write(f"{label:22} {n:>10,} rows  {elapsed:7.1f} s  peak RSS {peak_kb / 1024:7.1f} MiB"
+                              f" (+{(peak_kb - start_kb) / 1024:6.1f})  file {size / 2**20:6.1f} MiB")
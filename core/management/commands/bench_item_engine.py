@@ -0,0 +1,69 @@
+# core/management/commands/bench_item_engine.py
+"""
+Benchmark the menu-item aggregation engine (core/item_engine.py).
+
+Generates synthetic line-item columns (no database), runs the pure-Python and
+NumPy paths over the same data, checks that every output column is identical and
+prints the timings:
+
+  python manage.py bench_item_engine --rows 1000000 --groups 5000
+"""
+from __future__ import annotations
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import item_engine
+
+
+class Command(BaseCommand):
+    help = "Time the Python vs NumPy item aggregation on synthetic line items and verify identical output"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="Synthetic line items.")
+        parser.add_argument("--groups", type=int, default=5000, help="Distinct (day, item) groups.")
+        parser.add_argument("--rated", type=float, default=0.3, help="Share of rows on a reviewed ticket.")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per engine; best time is reported.")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **opts):
+        if not item_engine.HAS_NUMPY:
+            raise CommandError("NumPy is not installed (pip install numpy); only the Python path is available.")
+        n, n_groups = max(1, opts["rows"]), max(1, opts["groups"])
+        cols, n_groups = self._columns(n, n_groups, opts["rated"], opts["seed"])
+        self.stdout.write(f"{n:,} rows · {n_groups:,} groups")
+
+        py_s, py_out = self._time(item_engine.aggregate_python, cols, n_groups, opts["repeat"])
+        np_s, np_out = self._time(item_engine.aggregate_numpy, cols, n_groups, opts["repeat"])
+
+        mismatched = [k for k in py_out if py_out[k] != np_out[k]]
+        if mismatched:
+            raise CommandError(f"Engines disagree on: {', '.join(mismatched)}")
+
+        self.stdout.write(f"python  {py_s * 1000:9.1f} ms")
+        self.stdout.write(f"numpy   {np_s * 1000:9.1f} ms")
+        self.stdout.write(self.style.SUCCESS(f"Identical output · {py_s / np_s:.1f}x faster with NumPy"))
+
+    def _columns(self, n, n_groups, rated_share, seed):
+        rnd = random.Random(seed)
+        cols = item_engine.Columns()
+        for _ in range(n):
+            qty = rnd.choice((1, 1, 1, 2, 3))
+            # mostly plausible prices, some missing, some out-of-band (comps, cents-as-dollars)
+            r = rnd.random()
+            unit = (None if r < 0.05 else rnd.randrange(0, 40) if r < 0.08
+                    else rnd.randrange(5000, 200000) if r < 0.1 else rnd.randrange(50, 4001))
+            stars = rnd.randint(1, 5) if rnd.random() < rated_share else None
+            cols.add(rnd.randrange(n_groups), qty, unit, (unit or 0) * qty, stars)
+        return (cols.codes, cols.qty, cols.unit, cols.line, cols.stars), len(cols.keys)
+
+    def _time(self, fn, cols, n_groups, repeat):
+        best, out = None, None
+        for _ in range(max(1, repeat)):
+            t0 = time.perf_counter()
+            out = fn(*cols, n_groups)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        return best, out
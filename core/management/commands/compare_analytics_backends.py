@@ -0,0 +1,94 @@
+# core/management/commands/compare_analytics_backends.py
+"""
+Run every analytics backend (core/analytics.py) on one restaurant and compare.
+
+Computes the menu, staff and percentile results uncached with each backend, prints
+the timings and lists where a backend differs from `scan` (the exact reference):
+
+  python manage.py compare_analytics_backends --restaurant 3 --start 2025-01-01 --end 2025-03-31
+
+Counts and ratings should match exactly. Item prices and percentiles from `rollups`
+may differ slightly (median of daily medians, KLL sketches); those differences are
+reported but don't fail the command unless --strict is given.
+"""
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import analytics
+from core.dates import parse_day
+from core.line_items import norm_name
+from core.models import RestaurantProfile
+from core.sketches import METRICS, parse_percentiles
+
+_APPROX = {("rollups", "menu", "price_cents"), ("rollups", "pct", "value")}
+
+
+def _diff(ref: list[dict], got: list[dict], key: str) -> list[tuple]:
+    """[(row key, field, reference, got)] between two row lists matched on key."""
+    ref_by, got_by = {r[key]: r for r in ref}, {r[key]: r for r in got}
+    out = []
+    for k in sorted(set(ref_by) | set(got_by), key=str):
+        a, b = ref_by.get(k), got_by.get(k)
+        if a is None or b is None:
+            out.append((k, "<row>", a is not None, b is not None))
+            continue
+        out.extend((k, f, a[f], b.get(f)) for f in a if a[f] != b.get(f))
+    return out
+
+
+class Command(BaseCommand):
+    help = "Time the rollups / sql / scan analytics backends on one restaurant and diff them against scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restaurant", type=int, help="RestaurantProfile id (default: first).")
+        parser.add_argument("--start", help="YYYY-MM-DD (inclusive).")
+        parser.add_argument("--end", help="YYYY-MM-DD (inclusive).")
+        parser.add_argument("--p", default="50,90,99", help="Percentiles to compare.")
+        parser.add_argument("--strict", action="store_true", help="Fail on approximate differences too.")
+
+    def handle(self, *args, **opts):
+        rp = (RestaurantProfile.objects.filter(id=opts["restaurant"]).first() if opts.get("restaurant")
+              else RestaurantProfile.objects.order_by("id").first())
+        if not rp:
+            raise CommandError("No such restaurant.")
+        start, end = parse_day(opts.get("start")), parse_day(opts.get("end"))
+        qs = parse_percentiles(opts["p"])
+
+        results, failures = {}, []
+        for name in analytics.BACKENDS:
+            t0 = time.perf_counter()
+            menu = analytics.compute_menu_items(rp, start, end, backend=name)
+            t1 = time.perf_counter()
+            staff = analytics.compute_staff(rp, start, end, backend=name)
+            t2 = time.perf_counter()
+            pct = [dict(metric=m, **p) for m in METRICS
+                   for p in analytics.compute_percentiles(rp, m, qs, start, end, backend=name)["percentiles"]]
+            t3 = time.perf_counter()
+            results[name] = {"menu": menu, "staff": staff, "pct": pct}
+            self.stdout.write(f"{name:8} menu {(t1 - t0) * 1000:8.1f} ms · staff {(t2 - t1) * 1000:8.1f} ms"
+                              f" · percentiles {(t3 - t2) * 1000:8.1f} ms")
+
+        for res in results.values():
+            for r in res["menu"]:
+                r["key"] = r["menu_item_id"] or f"name:{norm_name(r['name'])}"
+            for r in res["pct"]:
+                r["key"] = (r["metric"], r["p"])
+
+        ref = results["scan"]
+        for name, res in results.items():
+            if name == "scan":
+                continue
+            for part, key in (("menu", "key"), ("staff", "staff_key"), ("pct", "key")):
+                for row, field, want, got in _diff(ref[part], res[part], key):
+                    approx = (name, part, field) in _APPROX
+                    if opts["strict"] or not approx:
+                        failures.append((name, part))
+                    style = self.style.WARNING if approx else self.style.ERROR
+                    self.stdout.write(style(f"  {name} {part} {row!r} {field}: scan={want!r} {name}={got!r}"))
+
+        if failures:
+            raise CommandError(f"Backends disagree with scan: {', '.join(sorted({f'{n}/{p}' for n, p in failures}))}")
+        self.stdout.write(self.style.SUCCESS("All backends agree with scan (apart from reported approximations)."))
@@ -0,0 +1,34 @@
+# core/management/commands/rebuild_daily_stats.py
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.models import RestaurantProfile
+from core.rollups import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute ItemDailyStats / StaffDailyStats from TicketLineItem, TicketLink and Review"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restaurant", type=int, help="Only this RestaurantProfile id.")
+        parser.add_argument("--start", help="First day to rebuild (YYYY-MM-DD). Default: all history.")
+        parser.add_argument("--end", help="Last day to rebuild (YYYY-MM-DD), inclusive.")
+
+    def handle(self, *args, **opts):
+        start = parse_date(opts["start"]) if opts.get("start") else None
+        end = parse_date(opts["end"]) if opts.get("end") else None
+        if (opts.get("start") and not start) or (opts.get("end") and not end):
+            raise CommandError("--start/--end must be YYYY-MM-DD")
+
+        qs = RestaurantProfile.objects.order_by("id")
+        if opts.get("restaurant"):
+            qs = qs.filter(id=opts["restaurant"])
+
+        total_items = total_staff = 0
+        for rp in qs:
+            items, staff = rebuild_daily_stats(rp, start=start, end=end)
+            total_items += items
+            total_staff += staff
+            self.stdout.write(f"[{rp.id}] {rp.display_name()}: {items} item rows · {staff} staff rows")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total_items} item rows and {total_staff} staff rows."))
@@ -0,0 +1,31 @@
+# core/management/commands/rebuild_ticket_search.py
+"""
+Rewrite the full-text ticket search index (core/ticket_search.py) from closed TicketLinks:
+
+  python manage.py rebuild_ticket_search
+  python manage.py rebuild_ticket_search --restaurant 12
+
+Tickets are indexed at close; run this after migrating and whenever the index
+may have missed closes (the close path never fails on indexing).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core import ticket_search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the FTS5 ticket search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restaurant", type=int, help="Only this RestaurantProfile id.")
+        parser.add_argument("--chunk", type=int, default=2000, help="TicketLinks per batch.")
+
+    def handle(self, *args, **opts):
+        if not ticket_search.available():
+            raise CommandError("No FTS5 search table (needs SQLite with FTS5 and migration 0040); "
+                               "search uses the icontains fallback.")
+        written = ticket_search.rebuild(
+            opts.get("restaurant"), chunk=max(1, opts["chunk"]),
+            progress=lambda last_id, n: self.stdout.write(f"… through TicketLink {last_id}: {n} tickets"),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Indexed {written} closed tickets."))
@@ -0,0 +1,61 @@
+# core/management/commands/run_export_jobs.py
+"""
+Worker for the background exports queued from the dashboards (core/export_jobs.py).
+
+Claims queued ExportJobs oldest first, writes each file under MEDIA_ROOT/exports/
+and, between jobs, deletes expired files and fails jobs whose worker died:
+
+  python manage.py run_export_jobs              # keep polling
+  python manage.py run_export_jobs --once       # drain the queue, then exit (cron)
+  python manage.py run_export_jobs --cleanup-only
+
+Several workers may run at once; each job is claimed by exactly one of them.
+"""
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import export_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued closed-ticket export jobs and clean up expired export files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+        parser.add_argument("--sleep", type=float, default=2.0, help="Seconds between polls of an empty queue.")
+        parser.add_argument("--cleanup-only", action="store_true", help="Only remove expired / stale jobs.")
+
+    def _cleanup(self):
+        deleted, failed = export_jobs.cleanup()
+        if deleted or failed:
+            self.stdout.write(f"cleanup: {deleted} expired export(s) deleted, {failed} stale job(s) failed")
+
+    def handle(self, *args, **opts):
+        self._cleanup()
+        if opts["cleanup_only"]:
+            return
+
+        last_cleanup = time.monotonic()
+        while True:
+            job = export_jobs.claim_next()
+            if job is None:
+                if opts["once"]:
+                    break
+                time.sleep(max(0.1, opts["sleep"]))
+                close_old_connections()
+            else:
+                t0 = time.perf_counter()
+                job = export_jobs.run_job(job)
+                took = time.perf_counter() - t0
+                if job.status == "done":
+                    self.stdout.write(self.style.SUCCESS(
+                        f"job {job.id}: {job.rows} rows · {job.size_bytes / 1024:.0f} KiB · {took:.1f} s"))
+                else:
+                    self.stdout.write(self.style.ERROR(f"job {job.id} failed: {job.error}"))
+            if time.monotonic() - last_cleanup > 300:
+                self._cleanup()
+                last_cleanup = time.monotonic()
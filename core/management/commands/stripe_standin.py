@@ -0,0 +1,36 @@
+# core/management/commands/stripe_standin.py
+from django.core.management.base import BaseCommand
+
+from core.stripe_standin import StripeStandIn
+
+
+class Command(BaseCommand):
+    help = "Run the local Stripe stand-in (set STRIPE_API_BASE to its URL for offline load tests)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=12111)
+        parser.add_argument("--latency-ms", type=float, default=0, help="Fixed delay added to every call.")
+        parser.add_argument("--jitter-ms", type=float, default=0, help="Extra uniform random delay, 0..N ms.")
+        parser.add_argument("--decline-rate", type=float, default=0.0,
+                            help="Fraction of confirms/increments declined with generic_decline (0..1).")
+        parser.add_argument("--seed", type=int, default=None, help="Seed latency jitter and declines.")
+
+    def handle(self, *args, **opts):
+        standin = StripeStandIn(
+            latency_ms=opts["latency_ms"],
+            jitter_ms=opts["jitter_ms"],
+            decline_rate=opts["decline_rate"],
+            seed=opts["seed"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Stripe stand-in on http://{opts['host']}:{opts['port']} "
+            f"(latency {opts['latency_ms']:.0f}+{opts['jitter_ms']:.0f}ms, decline rate {opts['decline_rate']:.2f})"
+        ))
+        try:
+            standin.serve_forever(opts["host"], opts["port"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            calls = ", ".join(f"{route}={n}" for route, n in sorted(standin.calls.items()))
+            self.stdout.write(f"Calls: {calls or 'none'}")
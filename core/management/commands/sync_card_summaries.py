@@ -0,0 +1,29 @@
+# core/management/commands/sync_card_summaries.py
+from django.core.management.base import BaseCommand
+
+from core.models import CustomerProfile
+from core.utils import cache_card_summary
+
+
+class Command(BaseCommand):
+    help = "Backfill CustomerProfile.card_brand/card_last4 from Stripe (one PaymentMethod call per customer)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true",
+                            help="Refresh every customer, not just ones missing a cached card.")
+
+    def handle(self, *args, **opts):
+        qs = CustomerProfile.objects.exclude(default_payment_method="")
+        if not opts.get("all"):
+            qs = qs.filter(card_last4="")
+
+        done, failed = 0, 0
+        for cp in qs.iterator():
+            try:
+                cache_card_summary(cp, cp.default_payment_method)
+                done += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(self.style.WARNING(f"[CustomerProfile {cp.pk}] card sync failed: {e}"))
+
+        self.stdout.write(self.style.SUCCESS(f"Card summaries synced: {done} · Failed: {failed}"))
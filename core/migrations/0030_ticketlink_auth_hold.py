@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_customerprofile_card_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketlink',
+            name='auth_amount_cents',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ticketlink',
+            name='auth_payment_intent_id',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_ticketlink_auth_hold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket_id', models.CharField(max_length=64)),
+                ('token', models.CharField(max_length=32)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticket_locks', to='core.restaurantprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('restaurant', 'ticket_id'), name='uniq_ticket_lock')],
+            },
+        ),
+    ]
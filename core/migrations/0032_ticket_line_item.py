@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_ticket_lock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketLineItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('menu_item_id', models.CharField(blank=True, max_length=64)),
+                ('name', models.CharField(max_length=160)),
+                ('name_norm', models.CharField(max_length=160)),
+                ('qty', models.IntegerField(default=1)),
+                ('unit_cents', models.IntegerField(blank=True, null=True)),
+                ('line_cents', models.IntegerField(default=0)),
+                ('closed_at', models.DateTimeField()),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='core.restaurantprofile')),
+                ('ticket_link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='core.ticketlink')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['restaurant', 'closed_at'], name='core_ticket_restaur_9a3a1b_idx'), models.Index(fields=['restaurant', 'menu_item_id', 'name_norm'], name='core_ticket_restaur_a3a2a9_idx')],
+            },
+        ),
+    ]
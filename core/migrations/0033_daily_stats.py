@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_ticket_line_item'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('menu_item_id', models.CharField(blank=True, max_length=64)),
+                ('name_norm', models.CharField(max_length=160)),
+                ('name', models.CharField(max_length=160)),
+                ('num_tickets', models.IntegerField(default=0)),
+                ('num_rated_tickets', models.IntegerField(default=0)),
+                ('qty', models.IntegerField(default=0)),
+                ('qty_rated', models.IntegerField(default=0)),
+                ('stars_sum', models.IntegerField(default=0)),
+                ('revenue_cents', models.BigIntegerField(default=0)),
+                ('price_median_cents', models.IntegerField(blank=True, null=True)),
+                ('price_obs', models.IntegerField(default=0)),
+                ('price_raw_median_cents', models.IntegerField(blank=True, null=True)),
+                ('price_raw_obs', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='item_daily_stats', to='core.restaurantprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('restaurant', 'day', 'menu_item_id', 'name_norm'), name='uniq_item_daily')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StaffDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('staff_key', models.CharField(blank=True, max_length=160)),
+                ('name', models.CharField(blank=True, max_length=160)),
+                ('is_active', models.BooleanField(default=True)),
+                ('num_tickets', models.IntegerField(default=0)),
+                ('num_rated_tickets', models.IntegerField(default=0)),
+                ('stars_sum', models.IntegerField(default=0)),
+                ('revenue_cents', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='staff_daily_stats', to='core.restaurantprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('restaurant', 'day', 'staff_key'), name='uniq_staff_daily')],
+            },
+        ),
+    ]
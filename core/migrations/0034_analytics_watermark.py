@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_daily_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupRating',
+            fields=[
+                ('ticket_link', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup_rating', serialize=False, to='core.ticketlink')),
+                ('stars', models.PositiveSmallIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnalyticsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('ticket_link_id', models.BigIntegerField(default=0)),
+                ('review_updated_at', models.DateTimeField(blank=True, null=True)),
+                ('recent_ticket_ids', models.JSONField(blank=True, default=list)),
+                ('recent_reviews', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('restaurant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_watermark', to='core.restaurantprofile')),
+            ],
+        ),
+    ]
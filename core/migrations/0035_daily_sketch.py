@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_analytics_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('metric', models.CharField(choices=[('ticket_total', 'Ticket total'), ('tip_pct', 'Tip %'), ('item_price', 'Item unit price')], max_length=16)),
+                ('key', models.CharField(blank=True, max_length=160)),
+                ('n', models.IntegerField(default=0)),
+                ('sketch', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sketches', to='core.restaurantprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('restaurant', 'metric', 'key', 'day'), name='uniq_daily_sketch')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_daily_sketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurantprofile',
+            name='time_zone',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='ticketlink',
+            index=models.Index(fields=['restaurant', 'status', 'closed_at'], name='tl_rest_status_closed'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_report_time_zone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketlink',
+            name='staff_key',
+            field=models.CharField(blank=True, max_length=160, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticketlink',
+            name='staff_name',
+            field=models.CharField(blank=True, max_length=160),
+        ),
+    ]
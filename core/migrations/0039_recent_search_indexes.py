@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0038_export_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticketlink',
+            index=models.Index(fields=['restaurant', 'member', 'closed_at'], name='tl_rest_member_closed'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketlink',
+            index=models.Index(fields=['restaurant', 'ticket_number'], name='tl_rest_ticket_number'),
+        ),
+    ]
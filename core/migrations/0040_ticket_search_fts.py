@@ -0,0 +1,38 @@
+# core/migrations/0040_ticket_search_fts.py
+# FTS5 table behind core/ticket_search.py. SQLite only; other backends (or SQLite
+# without FTS5) skip it and search falls back to icontains. Fill it with
+# `manage.py rebuild_ticket_search`.
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_ticketsearch USING fts5("
+    "restaurant_id UNINDEXED, ticket_number, member, last_name, server, items, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+
+def create(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    try:
+        schema_editor.execute(CREATE)
+    except OperationalError:   # no such module: fts5
+        pass
+
+
+def drop(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS core_ticketsearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0039_recent_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create, drop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:18
+# Per-day price medians -> per-day price counts. Existing rows have no counts, so the
+# watermarks are dropped: run `manage.py rebuild_daily_stats` after migrating to rebuild
+# the rollups in full (analytics are answered from the SQL backend until then).
+
+from django.db import migrations, models
+
+
+def reset_watermarks(apps, schema_editor):
+    apps.get_model("core", "AnalyticsWatermark").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0040_ticket_search_fts'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='itemdailystats',
+            name='price_median_cents',
+        ),
+        migrations.RemoveField(
+            model_name='itemdailystats',
+            name='price_obs',
+        ),
+        migrations.RemoveField(
+            model_name='itemdailystats',
+            name='price_raw_median_cents',
+        ),
+        migrations.RemoveField(
+            model_name='itemdailystats',
+            name='price_raw_obs',
+        ),
+        migrations.AddField(
+            model_name='itemdailystats',
+            name='price_counts',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(reset_watermarks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:47
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0041_item_price_counts'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='analyticswatermark',
+            name='recent_reviews',
+        ),
+    ]
@@ -26,6 +26,10 @@ class CustomerProfile(models.Model):
     default_payment_method = models.CharField(max_length=64, blank=True)
     pin_hash = models.CharField(max_length=128, blank=True, null=True) 
 
+    # Cached summary of default_payment_method (so the profile page renders without Stripe)
+    card_brand = models.CharField(max_length=32, blank=True)
+    card_last4 = models.CharField(max_length=8,  blank=True)
+
     def __str__(self):
         return force_str(getattr(self, "label", None) or f"CustomerProfile {self.pk}")
 
@@ -45,6 +49,8 @@ class RestaurantProfile(models.Model):
     postal     = models.CharField(max_length=32,  blank=True)
 
     omnivore_location_id = models.CharField(max_length=64, blank=True)
+    # IANA zone for reporting days ("America/New_York"); blank = settings.TIME_ZONE
+    time_zone = models.CharField(max_length=64, blank=True)
 
     # ✅ New: the only Stripe id you truly need for restaurants
     stripe_account_id = models.CharField(max_length=64, blank=True)   # acct_*
@@ -172,6 +178,10 @@ class TicketLink(models.Model):
     ticket_number = models.CharField(max_length=32, blank=True)
     table         = models.CharField(max_length=64, blank=True)
     server_name   = models.CharField(max_length=120, blank=True)
+    # server resolved against staff_cache at close (core/rollups.stamp_staff);
+    # None = not resolved yet (backfill_staff_keys), "" = nothing matched
+    staff_key     = models.CharField(max_length=160, null=True, blank=True)
+    staff_name    = models.CharField(max_length=160, blank=True)
 
     status            = models.CharField(max_length=12, choices=STATUS, default="pending", db_index=True)
     last_total_cents  = models.IntegerField(default=0)
@@ -207,6 +217,10 @@ class TicketLink(models.Model):
     pos_payment_id = models.CharField(max_length=64,  blank=True)
     pos_ref        = models.CharField(max_length=128, blank=True)
 
+    # auth-at-verify mode: manual-capture hold placed when the link opens
+    auth_payment_intent_id = models.CharField(max_length=64, blank=True)
+    auth_amount_cents      = models.IntegerField(default=0)
+
     raw_ticket_json   = models.JSONField(default=dict, blank=True)
     raw_payments_json = models.JSONField(default=list,  blank=True)
 
@@ -218,6 +232,9 @@ class TicketLink(models.Model):
         indexes = [
             models.Index(fields=["status","opened_at"]),
             models.Index(fields=["status","closed_at"]),
+            models.Index(fields=["restaurant","status","closed_at"], name="tl_rest_status_closed"),
+            models.Index(fields=["restaurant","member","closed_at"], name="tl_rest_member_closed"),
+            models.Index(fields=["restaurant","ticket_number"], name="tl_rest_ticket_number"),
             models.Index(fields=["ticket_id","status"]),
             models.Index(fields=["member","status"]),
         ]
@@ -231,6 +248,138 @@ class TicketLink(models.Model):
     def __str__(self):
         return f"{self.member_id} · {self.restaurant.display_name()} · {self.ticket_number or self.ticket_id} · {self.status}"
 
+class TicketLineItem(models.Model):
+    """
+    One row per item on a closed TicketLink, normalized from items_json at close
+    (see core/line_items.py). Lets item analytics GROUP BY instead of parsing JSON.
+    """
+    ticket_link  = models.ForeignKey("TicketLink", on_delete=models.CASCADE, related_name="line_items")
+    restaurant   = models.ForeignKey("RestaurantProfile", on_delete=models.CASCADE, related_name="line_items")
+    menu_item_id = models.CharField(max_length=64, blank=True)
+    name         = models.CharField(max_length=160)                 # as printed on the ticket
+    name_norm    = models.CharField(max_length=160)                 # lowercased, "$" stripped, spaces collapsed
+    qty          = models.IntegerField(default=1)
+    unit_cents   = models.IntegerField(null=True, blank=True)       # None when the POS row had no usable price
+    line_cents   = models.IntegerField(default=0)
+    closed_at    = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["restaurant", "closed_at"]),
+            models.Index(fields=["restaurant", "menu_item_id", "name_norm"]),
+        ]
+
+    def __str__(self):
+        return f"{self.qty}× {self.name} · TicketLink {self.ticket_link_id}"
+
+class ItemDailyStats(models.Model):
+    """
+    Per restaurant, day and item rollup of TicketLineItem + Review. Days are local to
+    RestaurantProfile.time_zone (core/dates.restaurant_tz).
+    Folded forward by core/rollups.catch_up() past AnalyticsWatermark; `rebuild_daily_stats` recomputes.
+    """
+    restaurant   = models.ForeignKey("RestaurantProfile", on_delete=models.CASCADE, related_name="item_daily_stats")
+    day          = models.DateField()
+    menu_item_id = models.CharField(max_length=64, blank=True)
+    name_norm    = models.CharField(max_length=160)
+    name         = models.CharField(max_length=160)
+
+    num_tickets       = models.IntegerField(default=0)   # line rows (one per item per ticket)
+    num_rated_tickets = models.IntegerField(default=0)
+    qty               = models.IntegerField(default=0)
+    qty_rated         = models.IntegerField(default=0)
+    stars_sum         = models.IntegerField(default=0)
+    revenue_cents     = models.BigIntegerField(default=0)
+
+    # that day's unit prices as {cents: observations}; summed over a range they give the
+    # exact median, which per-day medians can't
+    price_counts = models.JSONField(default=dict, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["restaurant", "day", "menu_item_id", "name_norm"], name="uniq_item_daily"),
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant_id} · {self.day} · {self.name} ×{self.qty}"
+
+
+class StaffDailyStats(models.Model):
+    """Per restaurant, day and server rollup of closed tickets; staff_key "" = no server resolved."""
+    restaurant = models.ForeignKey("RestaurantProfile", on_delete=models.CASCADE, related_name="staff_daily_stats")
+    day        = models.DateField()
+    staff_key  = models.CharField(max_length=160, blank=True)
+    name       = models.CharField(max_length=160, blank=True)
+    is_active  = models.BooleanField(default=True)
+
+    num_tickets       = models.IntegerField(default=0)
+    num_rated_tickets = models.IntegerField(default=0)
+    stars_sum         = models.IntegerField(default=0)
+    revenue_cents     = models.BigIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["restaurant", "day", "staff_key"], name="uniq_staff_daily"),
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant_id} · {self.day} · {self.name or self.staff_key or '-'} ({self.num_tickets})"
+
+
+class AnalyticsWatermark(models.Model):
+    """
+    How far a restaurant's daily rollups have been folded forward (core/rollups.catch_up):
+    the last closed ticket by (closed_at, id) and the newest review updated_at seen.
+    recent_ticket_ids remembers what was already folded inside the overlap window,
+    so rows committed slightly out of timestamp order are neither missed nor counted twice.
+    """
+    restaurant        = models.OneToOneField("RestaurantProfile", on_delete=models.CASCADE, related_name="analytics_watermark")
+    closed_at         = models.DateTimeField(null=True, blank=True)
+    ticket_link_id    = models.BigIntegerField(default=0)
+    review_updated_at = models.DateTimeField(null=True, blank=True)
+
+    recent_ticket_ids = models.JSONField(default=list, blank=True)  # [ticket_link_id, ...]
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.restaurant_id} · tickets ≤ {self.closed_at} · reviews ≤ {self.review_updated_at}"
+
+
+class RollupRating(models.Model):
+    """Stars a closed ticket currently contributes to the daily rollups (late review = delta against this)."""
+    ticket_link = models.OneToOneField("TicketLink", on_delete=models.CASCADE, primary_key=True, related_name="rollup_rating")
+    stars       = models.PositiveSmallIntegerField()
+
+    def __str__(self):
+        return f"TicketLink {self.ticket_link_id} · {self.stars}★"
+
+
+class DailySketch(models.Model):
+    """Per restaurant, day, metric (and item) KLL quantile sketch; see core/sketches.py."""
+    METRICS = (("ticket_total", "Ticket total"), ("tip_pct", "Tip %"), ("item_price", "Item unit price"))
+
+    restaurant = models.ForeignKey("RestaurantProfile", on_delete=models.CASCADE, related_name="daily_sketches")
+    day        = models.DateField()
+    metric     = models.CharField(max_length=16, choices=METRICS)
+    key        = models.CharField(max_length=160, blank=True)  # "" = whole restaurant; item_price: per item
+    n          = models.IntegerField(default=0)
+    sketch     = models.JSONField(default=dict, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["restaurant", "metric", "key", "day"], name="uniq_daily_sketch"),
+        ]
+
+    def __str__(self):
+        return f"{self.restaurant_id} · {self.day} · {self.metric}{':' + self.key if self.key else ''} (n={self.n})"
+
 class Review(models.Model):
     restaurant   = models.ForeignKey(RestaurantProfile, on_delete=models.CASCADE, related_name="reviews")
     ticket_link  = models.ForeignKey("TicketLink", null=True, blank=True, on_delete=models.SET_NULL, related_name="reviews")
@@ -276,3 +425,59 @@ class PinResetToken(models.Model):
 
 
 
+
+class TicketLock(models.Model):
+    """
+    Short lease on one (restaurant, ticket) so only one close runs at a time.
+    Rows live only while a close is in flight; expired leases can be taken over.
+    """
+    restaurant = models.ForeignKey(RestaurantProfile, on_delete=models.CASCADE, related_name="ticket_locks")
+    ticket_id  = models.CharField(max_length=64)
+    token      = models.CharField(max_length=32)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["restaurant", "ticket_id"], name="uniq_ticket_lock"),
+        ]
+
+    def __str__(self):
+        return f"TicketLock({self.restaurant_id}:{self.ticket_id} until {self.expires_at:%H:%M:%S})"
+
+
+class ExportJob(models.Model):
+    """
+    A closed-ticket export built off the request path (core/export_jobs.py, `manage.py run_export_jobs`).
+    The finished file lives under MEDIA_ROOT/exports/ until expires_at, then cleanup removes file and row.
+    """
+    STATUS_CHOICES = [("queued", "Queued"), ("running", "Running"), ("done", "Done"), ("failed", "Failed")]
+    FORMAT_CHOICES = [("xlsx", "Excel"), ("csv", "CSV")]
+    SCOPE_CHOICES  = [("owner", "Owner"), ("manager", "Manager")]
+
+    restaurant   = models.ForeignKey(RestaurantProfile, on_delete=models.CASCADE, related_name="export_jobs")
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="export_jobs")
+    scope        = models.CharField(max_length=16, choices=SCOPE_CHOICES)
+    format       = models.CharField(max_length=8, choices=FORMAT_CHOICES, default="xlsx")
+    start        = models.DateField(null=True, blank=True)
+    end          = models.DateField(null=True, blank=True)
+    q            = models.CharField(max_length=120, blank=True, default="")
+
+    status      = models.CharField(max_length=16, choices=STATUS_CHOICES, default="queued")
+    error       = models.TextField(blank=True, default="")
+    rows        = models.PositiveIntegerField(default=0)
+    file        = models.FileField(upload_to="exports/", blank=True)
+    size_bytes  = models.BigIntegerField(default=0)
+
+    created_at  = models.DateTimeField(auto_now_add=True)
+    started_at  = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at  = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="exportjob_status_created"),
+        ]
+
+    def __str__(self):
+        return f"ExportJob({self.pk} {self.restaurant_id} {self.format} {self.status})"
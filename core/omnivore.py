@@ -4,6 +4,7 @@ import os
 import time
 import json
 import random
+import threading
 from pathlib import Path
 from datetime import datetime, timedelta
 
@@ -47,10 +48,14 @@ if _FAKE_MODE:
                 pass
         return {"locations": {}}
 
+    # serialize snapshots so threaded callers (runserver, CloseRaceTests) don't clobber the tmp file
+    _STORE_LOCK = threading.Lock()
+
     def _save_store(db: dict) -> None:
-        tmp = _FAKE_STORE_PATH.with_suffix(".tmp")
-        tmp.write_text(json.dumps(db, indent=2, sort_keys=True), encoding="utf-8")
-        tmp.replace(_FAKE_STORE_PATH)
+        with _STORE_LOCK:
+            tmp = _FAKE_STORE_PATH.with_suffix(".tmp")
+            tmp.write_text(json.dumps(db, indent=2, sort_keys=True), encoding="utf-8")
+            tmp.replace(_FAKE_STORE_PATH)
 
     # In-memory "DB" (loaded from disk at import)
     # locations: { location_id: { "seq": int, "tender_types": [...], "tickets": { id: ticket_dict } } }
@@ -0,0 +1,86 @@
+# core/pos_fanout.py
+"""
+Concurrent POS reads for the dashboards' open tickets and the ticket-detail views.
+
+Omnivore has no bulk endpoint, so every open ticket costs a get_ticket plus a
+get_ticket_items call. fetch_live() submits all of them to one shared, bounded
+thread pool and collects whatever has finished when the request's deadline
+passes. A request then takes about as long as its slowest call, capped at the
+deadline, instead of the sum of all of them. Calls still queued at the deadline
+are cancelled. Tickets that aren't back in time, or whose calls failed, are
+simply missing from the result; callers fall back to the stored items_json /
+last_total_cents and report them as stale.
+
+The pool is shared by all requests in the process, so POS_FANOUT_WORKERS is also
+the most POS calls this process has in flight at once.
+
+  POS_FANOUT_WORKERS    threads in the shared pool (default 16)
+  POS_FANOUT_DEADLINE   seconds a request waits for live values (default 2.5)
+"""
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+
+from decouple import config
+
+from .omnivore import get_ticket, get_ticket_items
+
+POS_FANOUT_WORKERS = int(config("POS_FANOUT_WORKERS", default="16"))
+POS_FANOUT_DEADLINE = float(config("POS_FANOUT_DEADLINE", default="2.5"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    # created on first use so management commands and forked workers don't start threads at import
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, POS_FANOUT_WORKERS), thread_name_prefix="pos-fanout")
+    return _pool
+
+
+def fetch_live(location_id, ticket_ids, deadline: float | None = None) -> dict:
+    """
+    {ticket_id: (ticket json, items list)} for the tickets whose two POS calls both
+    succeeded within `deadline` seconds (POS_FANOUT_DEADLINE by default).
+    """
+    ids = list(dict.fromkeys(str(t) for t in ticket_ids if t))
+    if not location_id or not ids:
+        return {}
+    deadline = POS_FANOUT_DEADLINE if deadline is None else deadline
+
+    pool = _executor()
+    futures = {}
+    for tid in ids:
+        futures[pool.submit(get_ticket, location_id, tid)] = (tid, 0)
+        futures[pool.submit(get_ticket_items, location_id, tid)] = (tid, 1)
+
+    parts: dict[str, list] = {}
+    failed = set()
+    try:
+        for fut in as_completed(futures, timeout=deadline):
+            tid, i = futures[fut]
+            try:
+                parts.setdefault(tid, [None, None, 0])[i] = fut.result()
+                parts[tid][2] += 1
+            except Exception:
+                failed.add(tid)
+    except FuturesTimeout:
+        pass
+    finally:
+        for fut in futures:
+            fut.cancel()   # no-op for calls already running; their results are dropped
+
+    return {
+        tid: (ticket or {}, items or [])
+        for tid, (ticket, items, done) in parts.items()
+        if done == 2 and tid not in failed
+    }
+
+
+def fetch_one(location_id, ticket_id, deadline: float | None = None):
+    """(ticket json, items list) for one ticket, or None when the POS didn't answer in time."""
+    return fetch_live(location_id, [ticket_id], deadline).get(str(ticket_id))
@@ -0,0 +1,205 @@
+# core/role_context.py
+"""
+request.role_ctx: who the signed-in user is to us (owner / manager / staff), their
+profiles and their restaurants, resolved once and reused across requests.
+
+RoleContextMiddleware (after AuthenticationMiddleware) sets request.role_ctx
+lazily, so requests that never look at it cost nothing. The first access
+resolves the user with one select_related query, plus one for an owner's
+restaurants, and caches the result per session. After that the permission
+checks in the owner / manager / staff views are a cache read, with no queries.
+
+A user's cached contexts are keyed on a generation that invalidate_user() bumps
+whenever their OwnerProfile, Ownerships, ManagerProfile or StaffProfile change, and
+invalidate_restaurant() bumps for every member of a restaurant whose row was edited,
+since the contexts hold restaurant rows (core/signals.py). The owner's selected
+restaurant (session["current_restaurant_id"]) is part of the key, so switching
+restaurants resolves a fresh context.
+
+The contexts carry authorization, so the generations must be seen by every worker:
+ROLE_CTX_CACHE has to be a shared cache (Redis, Memcached, database or file). On a
+process-local one (LocMemCache, the default without CACHES, or DummyCache) a bump
+would only reach the worker that handled the write, so caching is switched off and
+each request resolves its own context (still once, lazily).
+
+  ROLE_CTX_CACHE   cache alias, shared across workers (default "default")
+  ROLE_CTX_TTL     seconds a context is reused (default 300; 0 disables caching)
+"""
+from __future__ import annotations
+
+import logging
+
+from decouple import config
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Q
+from django.utils.functional import SimpleLazyObject
+
+from .models import RestaurantProfile
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = config("ROLE_CTX_CACHE", default="default")
+CACHE_TTL   = int(config("ROLE_CTX_TTL", default="300"))
+
+_PREFIX = "rolectx"
+
+# a generation bump in one of these is invisible to the other workers
+_LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+_warned_local = False
+
+
+class RoleContext:
+    """
+    Resolved roles of one user. owner_profile / manager_profile / staff_profile are
+    None when the user doesn't hold that role; restaurants are the owner's
+    (lowest id first) and restaurant is the owner's current one.
+    """
+
+    def __init__(self, user_id=None, owner_profile=None, restaurants=(), restaurant=None,
+                 manager_profile=None, staff_profile=None):
+        self.user_id = user_id
+        self.owner_profile = owner_profile
+        self.restaurants = list(restaurants)
+        self.restaurant = restaurant
+        self.manager_profile = manager_profile
+        self.staff_profile = staff_profile
+
+    @property
+    def role(self) -> str | None:
+        """Primary role: owner, then manager, then staff."""
+        if self.owner_profile:
+            return "owner"
+        if self.manager_profile:
+            return "manager"
+        if self.staff_profile:
+            return "staff"
+        return None
+
+    @property
+    def manager_restaurant(self):
+        return getattr(self.manager_profile, "restaurant", None) if self.manager_profile else None
+
+    @property
+    def staff_restaurant(self):
+        return getattr(self.staff_profile, "restaurant", None) if self.staff_profile else None
+
+    def owns(self, restaurant_id) -> RestaurantProfile | None:
+        """The owner's restaurant with this id, or None."""
+        try:
+            rid = int(restaurant_id)
+        except (TypeError, ValueError):
+            return None
+        return next((r for r in self.restaurants if r.id == rid), None)
+
+
+def _cache():
+    """The context cache, or None when caching is off or ROLE_CTX_CACHE is process-local."""
+    global _warned_local
+    if CACHE_TTL <= 0:
+        return None
+    cache = caches[CACHE_ALIAS]
+    if isinstance(cache, _LOCAL_BACKENDS):
+        if not _warned_local:
+            _warned_local = True
+            logger.warning("ROLE_CTX_CACHE %r is process-local (%s); role contexts are not cached",
+                           CACHE_ALIAS, type(cache).__name__)
+        return None
+    return cache
+
+
+def _user_gen_key(user_id) -> str:
+    return f"{_PREFIX}:gen:user:{user_id}"
+
+
+def _bump(key) -> None:
+    cache = _cache()
+    if cache is None:
+        return
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:  # not set yet (or evicted)
+            cache.set(key, 1, timeout=None)
+    except Exception:
+        logger.exception("role context invalidation failed for %s", key)
+
+
+def invalidate_user(user_id) -> None:
+    if user_id:
+        _bump(_user_gen_key(user_id))
+
+
+def invalidate_restaurant(restaurant_id) -> None:
+    """Drop the contexts of the restaurant's owners, managers and staff (they hold its row)."""
+    if not restaurant_id:
+        return
+    members = get_user_model().objects.filter(
+        Q(owner_profile__ownerships__restaurant_id=restaurant_id)
+        | Q(manager_profile__restaurant_id=restaurant_id)
+        | Q(staff_profile__restaurant_id=restaurant_id)
+    ).values_list("pk", flat=True).distinct()
+    for user_id in members:
+        invalidate_user(user_id)
+
+
+def resolve(user, current_restaurant_id=None) -> RoleContext:
+    """Uncached: the user's profiles and, for an owner, restaurants + current restaurant."""
+    if not getattr(user, "is_authenticated", False):
+        return RoleContext()
+    u = (get_user_model().objects
+         .select_related("owner_profile", "manager_profile__restaurant", "staff_profile__restaurant")
+         .filter(pk=user.pk).first())
+    if u is None:
+        return RoleContext()
+    op = getattr(u, "owner_profile", None)
+    restaurants = list(RestaurantProfile.objects.filter(ownerships__owner=op).distinct().order_by("id")) if op else []
+    ctx = RoleContext(
+        user_id=u.pk,
+        owner_profile=op,
+        restaurants=restaurants,
+        manager_profile=getattr(u, "manager_profile", None),
+        staff_profile=getattr(u, "staff_profile", None),
+    )
+    ctx.restaurant = (ctx.owns(current_restaurant_id) or (restaurants[0] if restaurants else None))
+    return ctx
+
+
+def for_request(request) -> RoleContext:
+    """request.role_ctx: cached per session + user generation + selected restaurant."""
+    user = getattr(request, "user", None)
+    if not getattr(user, "is_authenticated", False):
+        return RoleContext()
+    session = getattr(request, "session", None)
+    rid = session.get("current_restaurant_id") if session is not None else None
+    cache = _cache()
+    if cache is None:
+        return resolve(user, rid)
+
+    gen = cache.get(_user_gen_key(user.pk), 0)
+    sid = (session.session_key if session is not None else None) or f"user-{user.pk}"
+
+    def key(restaurant_id):
+        return ":".join(str(p) for p in (_PREFIX, sid, user.pk, gen, restaurant_id or ""))
+
+    ctx = cache.get(key(rid))
+    if ctx is None:
+        ctx = resolve(user, rid)
+        entries = {key(rid): ctx}
+        if ctx.restaurant and ctx.restaurant.id != rid:
+            # the owner views save the fallback restaurant into the session; don't resolve again for it
+            entries[key(ctx.restaurant.id)] = ctx
+        cache.set_many(entries, timeout=CACHE_TTL)
+    return ctx
+
+
+class RoleContextMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.role_ctx = SimpleLazyObject(lambda: for_request(request))
+        return self.get_response(request)
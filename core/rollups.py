@@ -0,0 +1,479 @@
+# core/rollups.py
+"""
+Daily rollups behind the item / staff ratings analytics.
+
+ItemDailyStats and StaffDailyStats hold one row per (restaurant, day, item | server).
+They are folded forward by catch_up(): each restaurant's AnalyticsWatermark records
+the last closed ticket (closed_at, id) and review updated_at already counted, so a
+close, a read or a rebuild only processes what is newer.
+The full pass that first sets a mark never runs inside a request: new restaurants get
+an empty mark when they are created (core/signals.py), and restaurants that already
+have closed tickets but no mark (before rollups, or after a migration that resets
+them) get theirs from `manage.py rebuild_daily_stats`. Until then catch_up() returns
+None and core/analytics.py answers from the SQL backend. Late reviews (new or
+re-starred on an already counted ticket) are applied as deltas against RollupRating;
+deleted reviews are taken back out by review_removed() (core/signals.py).
+Folding also feeds the per-day quantile sketches (core/sketches.py).
+Servers come from TicketLink.staff_key, resolved against staff_cache once at close
+(stamp_staff; `manage.py backfill_staff_keys` for older tickets), so no pass reads raw POS JSON.
+rebuild_daily_stats() / `manage.py rebuild_daily_stats` recompute from source.
+Each of these drops the restaurant's cached analytics results (core/analytics_cache.py).
+
+The ratings endpoints read them through core/analytics.py (its default "rollups"
+backend), so any start/end range sums at most one row per item (or server) per day.
+Days are calendar days in the restaurant's reporting zone (core/dates.restaurant_tz), the
+same days the report filters use; changing RestaurantProfile.time_zone needs a rebuild.
+"""
+from __future__ import annotations
+
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from decouple import config
+from django.db import transaction
+from django.db.models import F, Min, Q
+from django.db.models.functions import TruncDate
+
+from . import analytics_cache, item_engine, sketches
+from .dates import filter_day_field, filter_days, local_day, restaurant_tz
+from .line_items import sync_line_items
+from .models import (
+    AnalyticsWatermark, DailySketch, ItemDailyStats, RestaurantProfile, Review, RollupRating, StaffDailyStats,
+    TicketLineItem, TicketLink,
+)
+
+logger = logging.getLogger(__name__)
+
+# how far back catch-up re-checks for rows committed out of timestamp order
+WATERMARK_OVERLAP = timedelta(seconds=int(config("ANALYTICS_WATERMARK_OVERLAP", default="300")))
+
+
+def _day(dt, tz):
+    return local_day(dt, tz)
+
+
+def _price_counts(units) -> dict:
+    """{cents: observations} with str keys, as the JSONField stores them."""
+    return {str(u): n for u, n in sorted(Counter(units).items())}
+
+
+# ---------- staff key resolution ----------
+
+def staff_maps(rp):
+    staff_cache = getattr(rp, "staff_cache", None) or []
+    by_ck_lower = {(s.get("check_name") or "").strip().lower(): s for s in staff_cache if (s.get("check_name") or "").strip()}
+    by_nm_lower = {(s.get("name") or "").strip().lower(): s for s in staff_cache if (s.get("name") or "").strip()}
+    return by_ck_lower, by_nm_lower
+
+
+def resolve_staff(tl, by_ck_lower, by_nm_lower):
+    """
+    (staff_key, display, is_active) for a ticket: server_name first, then the POS
+    employee on raw_ticket_json, matched against staff_cache by check_name, then name.
+    staff_key is "" when nothing resolves.
+    """
+    candidates = [(tl.server_name or "").strip()]
+    try:
+        raw = tl.raw_ticket_json or {}
+        emb = (raw.get("_embedded") or {})
+        emp = emb.get("employee") or raw.get("employee") or {}
+        candidates.append((emp.get("check_name") or emp.get("name") or "").strip())
+    except Exception:
+        pass
+
+    for resolved in candidates:
+        if not resolved:
+            continue
+        low = resolved.lower()
+        if low in by_ck_lower:
+            s = by_ck_lower[low]
+            return (str(s.get("id") or s.get("check_name") or resolved),
+                    (s.get("check_name") or s.get("name") or resolved), bool(s.get("is_active", True)))
+        if low in by_nm_lower:
+            s = by_nm_lower[low]
+            return (str(s.get("id") or s.get("name") or resolved),
+                    (s.get("check_name") or s.get("name") or resolved), bool(s.get("is_active", True)))
+        return resolved, resolved, True
+    return "", "", True
+
+
+def staff_active(rp) -> dict:
+    """{staff_key: is_active} for the keys resolve_staff() gives cached staffers; unknown keys are active."""
+    out = {}
+    for s in getattr(rp, "staff_cache", None) or []:
+        active = bool(s.get("is_active", True))
+        for key in (s.get("id") or s.get("check_name"), s.get("id") or s.get("name")):
+            if key:
+                out[str(key)[:160]] = active
+    return out
+
+
+def stamp_staff(tl, maps) -> None:
+    """Set tl.staff_key / tl.staff_name from staff_maps(); the caller saves."""
+    key, display, _active = resolve_staff(tl, *maps)
+    tl.staff_key, tl.staff_name = key[:160], display[:160]
+
+
+def stamp_staff_keys(links) -> int:
+    """Resolve and store staff_key / staff_name for TicketLinks (updated in place). Returns rows written."""
+    links = list(links)
+    if not links:
+        return 0
+    maps = {rp.id: staff_maps(rp) for rp in RestaurantProfile.objects.filter(id__in={tl.restaurant_id for tl in links})}
+    for tl in links:
+        stamp_staff(tl, maps[tl.restaurant_id])
+    TicketLink.objects.bulk_update(links, ["staff_key", "staff_name"], batch_size=1000)
+    return len(links)
+
+
+def stamp_missing(links) -> int:
+    """Stamp the TicketLinks in a queryset that closed before staff_key existed (or whose close skipped it)."""
+    return stamp_staff_keys(links.filter(staff_key__isnull=True)
+                            .only("id", "restaurant_id", "server_name", "raw_ticket_json"))
+
+
+# ---------- incremental maintenance ----------
+
+def _bump(model, lookup: dict, defaults: dict, deltas: dict) -> None:
+    obj, _ = model.objects.get_or_create(**lookup, defaults=defaults)
+    updates = {f: F(f) + v for f, v in deltas.items() if v}
+    if updates:
+        model.objects.filter(pk=obj.pk).update(**updates)
+
+
+def _item_groups(line_items):
+    groups = {}
+    for li in line_items:
+        g = groups.setdefault((li.menu_item_id, li.name_norm), {"name": li.name, "rows": 0, "qty": 0, "revenue": 0})
+        g["rows"] += 1
+        g["qty"] += li.qty
+        g["revenue"] += li.line_cents
+    return groups
+
+
+def _refresh_prices(restaurant_id, day, tz, keys) -> None:
+    day_items = filter_days(TicketLineItem.objects.filter(restaurant_id=restaurant_id), day, day, tz)
+    for mid, nname in keys:
+        units = list(
+            day_items
+            .filter(menu_item_id=mid, name_norm=nname)
+            .exclude(unit_cents=None)
+            .values_list("unit_cents", flat=True)
+        )
+        (ItemDailyStats.objects
+         .filter(restaurant_id=restaurant_id, day=day, menu_item_id=mid, name_norm=nname)
+         .update(price_counts=_price_counts(units)))
+
+
+def _fold_tickets(links) -> None:
+    """Add closed TicketLinks (line items already synced) and their current ratings to the rollups."""
+    if not links:
+        return
+    ids = [tl.id for tl in links]
+    stars = dict(Review.objects.filter(ticket_link_id__in=ids).order_by("ticket_link_id", "id")
+                 .values_list("ticket_link_id", "stars"))
+    items_by_tl = defaultdict(list)
+    for li in TicketLineItem.objects.filter(ticket_link_id__in=ids):
+        items_by_tl[li.ticket_link_id].append(li)
+    stamp_staff_keys([tl for tl in links if tl.staff_key is None])
+    restaurants = RestaurantProfile.objects.filter(id__in={tl.restaurant_id for tl in links})
+    active = {rp.id: staff_active(rp) for rp in restaurants}
+    tzs = {rp.id: restaurant_tz(rp) for rp in restaurants}
+
+    touched = defaultdict(set)
+    observations = defaultdict(list)
+    for tl in links:
+        day, s = _day(tl.closed_at, tzs[tl.restaurant_id]), stars.get(tl.id)
+        rated = 1 if s is not None else 0
+        obs = observations[tl.restaurant_id]
+        obs.extend((day, *o) for o in sketches.ticket_observations(tl.total_cents, tl.tip_cents))
+        for li in items_by_tl[tl.id]:
+            obs.extend((day, *o) for o in sketches.item_observations(li.menu_item_id, li.name_norm, li.unit_cents))
+
+        _bump(StaffDailyStats,
+              {"restaurant_id": tl.restaurant_id, "day": day, "staff_key": tl.staff_key},
+              {"name": tl.staff_name, "is_active": active[tl.restaurant_id].get(tl.staff_key, True)},
+              {"num_tickets": 1, "num_rated_tickets": rated, "stars_sum": s or 0,
+               "revenue_cents": int(tl.total_cents or 0)})
+
+        for (mid, nname), g in _item_groups(items_by_tl[tl.id]).items():
+            _bump(ItemDailyStats,
+                  {"restaurant_id": tl.restaurant_id, "day": day, "menu_item_id": mid, "name_norm": nname},
+                  {"name": g["name"]},
+                  {"num_tickets": g["rows"], "qty": g["qty"], "revenue_cents": g["revenue"],
+                   "num_rated_tickets": g["rows"] * rated, "qty_rated": g["qty"] * rated,
+                   "stars_sum": g["rows"] * (s or 0)})
+            touched[(tl.restaurant_id, day)].add((mid, nname))
+
+    for (rid, day), keys in touched.items():
+        _refresh_prices(rid, day, tzs[rid], keys)
+    for rid, obs in observations.items():
+        sketches.add_observations(rid, obs)
+
+    RollupRating.objects.filter(ticket_link_id__in=ids).delete()
+    RollupRating.objects.bulk_create([RollupRating(ticket_link_id=tl_id, stars=s) for tl_id, s in stars.items()])
+
+
+def apply_rating_change(ticket_link_id, rated_delta: int, stars_delta: int) -> None:
+    """A folded ticket's rating was added (+1, +stars), removed (-1, -stars) or re-starred (0, diff)."""
+    if not ticket_link_id or not (rated_delta or stars_delta):
+        return
+    tl = (TicketLink.objects.select_related("restaurant").defer("raw_ticket_json")
+          .filter(pk=ticket_link_id, status="closed", closed_at__isnull=False).first())
+    if not tl:
+        return
+    if tl.staff_key is None:
+        stamp_staff_keys([tl])
+    day = _day(tl.closed_at, restaurant_tz(tl.restaurant))
+    (StaffDailyStats.objects
+     .filter(restaurant_id=tl.restaurant_id, day=day, staff_key=tl.staff_key)
+     .update(num_rated_tickets=F("num_rated_tickets") + rated_delta, stars_sum=F("stars_sum") + stars_delta))
+
+    for (mid, nname), g in _item_groups(TicketLineItem.objects.filter(ticket_link_id=tl.id)).items():
+        (ItemDailyStats.objects
+         .filter(restaurant_id=tl.restaurant_id, day=day, menu_item_id=mid, name_norm=nname)
+         .update(num_rated_tickets=F("num_rated_tickets") + g["rows"] * rated_delta,
+                 qty_rated=F("qty_rated") + g["qty"] * rated_delta,
+                 stars_sum=F("stars_sum") + g["rows"] * stars_delta))
+
+
+# ---------- watermark catch-up ----------
+
+def _lock_mark(restaurant_id):
+    """(AnalyticsWatermark locked for this transaction, created?)"""
+    mark, created = AnalyticsWatermark.objects.get_or_create(restaurant_id=restaurant_id)
+    return AnalyticsWatermark.objects.select_for_update().get(pk=mark.pk), created
+
+
+def start_mark(restaurant_id) -> None:
+    """Empty watermark for a restaurant with nothing closed yet: catch_up() folds from its first close."""
+    AnalyticsWatermark.objects.get_or_create(restaurant_id=restaurant_id)
+
+
+def _folded_q(mark, id_field="id") -> Q:
+    """Rows whose ticket is already in the rollups: older than the overlap window, or remembered in it."""
+    if not mark.closed_at:
+        return Q(pk__in=[])
+    return Q(closed_at__lt=mark.closed_at - WATERMARK_OVERLAP) | Q(**{f"{id_field}__in": mark.recent_ticket_ids})
+
+
+def _fold_new(restaurant_id, mark) -> int:
+    """Fold tickets closed / reviews changed since the mark; advances it. Returns tickets folded."""
+    before = (mark.closed_at, mark.ticket_link_id, mark.recent_ticket_ids, mark.review_updated_at)
+    # tickets: everything from the overlap window on that isn't remembered as folded
+    window_qs = TicketLink.objects.filter(restaurant_id=restaurant_id, status="closed", closed_at__isnull=False)
+    if mark.closed_at:
+        window_qs = window_qs.filter(closed_at__gte=mark.closed_at - WATERMARK_OVERLAP)
+    window = list(window_qs.values_list("id", "closed_at"))
+    recent = set(mark.recent_ticket_ids)
+    fresh_ids = [tl_id for tl_id, _closed in window if tl_id not in recent]
+
+    if fresh_ids:
+        fresh = list(TicketLink.objects.filter(id__in=fresh_ids).defer("raw_ticket_json").order_by("closed_at", "id"))
+        # the close path writes line items; anything it missed is written here
+        have = set(TicketLineItem.objects.filter(ticket_link_id__in=fresh_ids).values_list("ticket_link_id", flat=True))
+        sync_line_items([tl for tl in fresh if tl.id not in have])
+        _fold_tickets(fresh)
+
+    if window:
+        top_id, top_closed = max(window, key=lambda r: (r[1], r[0]))
+        if not mark.closed_at or (top_closed, top_id) > (mark.closed_at, mark.ticket_link_id):
+            mark.closed_at, mark.ticket_link_id = top_closed, top_id
+        mark.recent_ticket_ids = sorted(
+            tl_id for tl_id, closed in window if closed >= mark.closed_at - WATERMARK_OVERLAP
+        )
+
+    # reviews: new or re-starred since the mark, on tickets folded before this pass
+    rv_qs = Review.objects.filter(restaurant_id=restaurant_id, ticket_link__isnull=False)
+    if mark.review_updated_at:
+        rv_qs = rv_qs.filter(updated_at__gte=mark.review_updated_at - WATERMARK_OVERLAP)
+    folded_now, recent = set(fresh_ids), set(mark.recent_ticket_ids)
+    old_edge = mark.closed_at - WATERMARK_OVERLAP if mark.closed_at else None
+    rows = list(rv_qs.values_list("ticket_link_id", "stars", "updated_at", "ticket_link__status", "ticket_link__closed_at"))
+    applied = dict(RollupRating.objects.filter(ticket_link_id__in=[r[0] for r in rows]).values_list("ticket_link_id", "stars"))
+    for tl_id, stars, updated, status, closed in rows:
+        mark.review_updated_at = max(filter(None, (mark.review_updated_at, updated)))
+        if tl_id in folded_now or status != "closed" or not closed:
+            continue
+        if not (tl_id in recent or (old_edge and closed < old_edge)):
+            continue  # ticket not folded yet; its current rating goes in when it is
+        prev = applied.get(tl_id)
+        if prev == stars:
+            continue
+        apply_rating_change(tl_id, 0 if prev is not None else 1, stars - (prev or 0))
+        RollupRating.objects.update_or_create(ticket_link_id=tl_id, defaults={"stars": stars})
+
+    if (mark.closed_at, mark.ticket_link_id, mark.recent_ticket_ids, mark.review_updated_at) != before:
+        mark.save()
+    return len(fresh_ids)
+
+
+def catch_up(restaurant_id) -> int | None:
+    """
+    Bring one restaurant's rollups up to date by folding in only what is newer than its
+    AnalyticsWatermark: O(new tickets + changed reviews). Returns the number of tickets
+    folded, or None when the restaurant has closed tickets but no mark yet: its history
+    needs `manage.py rebuild_daily_stats` first, which this never runs itself.
+    """
+    with transaction.atomic():
+        mark = AnalyticsWatermark.objects.select_for_update().filter(restaurant_id=restaurant_id).first()
+        if mark is None:
+            if TicketLink.objects.filter(restaurant_id=restaurant_id, status="closed").exists():
+                return None
+            start_mark(restaurant_id)
+            return 0
+        folded = _fold_new(restaurant_id, mark)
+    if folded:
+        analytics_cache.invalidate(restaurant_id)
+    return folded
+
+
+def record_close(links) -> None:
+    """Fold freshly closed TicketLinks (line items already synced) into the daily rollups."""
+    for restaurant_id in {tl.restaurant_id for tl in links if tl.status == "closed" and tl.closed_at}:
+        if catch_up(restaurant_id) is None:
+            logger.warning("restaurant %s has no rollups yet; run manage.py rebuild_daily_stats", restaurant_id)
+        # even when catch-up folded nothing (closed_at behind the mark's overlap window, or no mark): the
+        # scan / sql backends and the recent lists still see the new ticket
+        analytics_cache.invalidate(restaurant_id)
+
+
+def review_removed(ticket_link_id) -> None:
+    """Post-delete hook: take a deleted review's stars back out of the rollups."""
+    if not ticket_link_id:
+        return
+    with transaction.atomic():
+        applied = RollupRating.objects.select_for_update().filter(ticket_link_id=ticket_link_id).first()
+        if applied:
+            apply_rating_change(ticket_link_id, -1, -applied.stars)
+            applied.delete()
+
+
+# ---------- full rebuild ----------
+
+def sync_missing_line_items(tl_qs, chunk: int = 2000) -> int:
+    """Write TicketLineItem rows for the closed tickets in tl_qs that have none. Returns rows written."""
+    missing = (tl_qs.filter(line_items__isnull=True)
+               .only("id", "restaurant_id", "status", "closed_at", "items_json").order_by("id"))
+    last_id, rows = 0, 0
+    while True:
+        batch = list(missing.filter(id__gt=last_id)[:chunk])
+        if not batch:
+            return rows
+        rows += sync_line_items(batch)
+        last_id = batch[-1].id
+
+
+def _rebuild(rp, start, end, mark, initial: bool) -> tuple[int, int, int]:
+    """
+    Recompute rollups (and RollupRating) for [start, end] from source. With initial=True
+    everything closed is taken and the mark is set from what was scanned; otherwise only
+    tickets the mark already covers are, so catch-up never counts a ticket twice.
+    """
+    tl_qs = TicketLink.objects.filter(restaurant=rp, status="closed", closed_at__isnull=False)
+    li_qs = TicketLineItem.objects.filter(restaurant=rp)
+    item_rows = ItemDailyStats.objects.filter(restaurant=rp)
+    staff_rows = StaffDailyStats.objects.filter(restaurant=rp)
+    sketch_rows = DailySketch.objects.filter(restaurant=rp)
+    if not initial:
+        tl_qs, li_qs = tl_qs.filter(_folded_q(mark)), li_qs.filter(_folded_q(mark, "ticket_link_id"))
+    tz = restaurant_tz(rp)
+    tl_qs, li_qs = filter_days(tl_qs, start, end, tz), filter_days(li_qs, start, end, tz)
+    item_rows, staff_rows, sketch_rows = (filter_day_field(qs, start, end) for qs in (item_rows, staff_rows, sketch_rows))
+    # tickets closed before TicketLineItem existed (or whose close skipped it) get their rows
+    # now, as in _fold_new(); otherwise they'd be behind the mark without ever reaching the items
+    sync_missing_line_items(tl_qs)
+
+    scanned = list(tl_qs.values_list("id", "closed_at"))
+    ids = [tl_id for tl_id, _closed in scanned]
+    stars, review_mark = {}, None
+    for tl_id, s, updated in (Review.objects.filter(ticket_link_id__in=ids).order_by("ticket_link_id", "id")
+                              .values_list("ticket_link_id", "stars", "updated_at")):
+        stars.setdefault(tl_id, s)
+        review_mark = max(filter(None, (review_mark, updated)))
+
+    # items: one narrow scan into columns, aggregated by core/item_engine.py
+    li_day = li_qs.filter(ticket_link_id__in=ids).annotate(day=TruncDate("closed_at", tzinfo=tz))
+    cols = item_engine.Columns()
+    units = defaultdict(list)
+    observations = []
+    for day, mid, nname, tl_id, q, u, ln in li_day.values_list(
+        "day", "menu_item_id", "name_norm", "ticket_link_id", "qty", "unit_cents", "line_cents"
+    ).iterator(chunk_size=5000):
+        cols.add((day, mid, nname), q, u, ln, stars.get(tl_id))
+        if u is not None:
+            units[(day, mid, nname)].append(u)
+        observations.extend((day, *o) for o in sketches.item_observations(mid, nname, u))
+    names = {
+        (g["day"], g["menu_item_id"], g["name_norm"]): g["display"]
+        for g in li_day.values("day", "menu_item_id", "name_norm").annotate(display=Min("name")).order_by()
+    }
+    agg = cols.aggregate()
+    items = [
+        ItemDailyStats(
+            restaurant=rp, day=day, menu_item_id=mid, name_norm=nname, name=names.get((day, mid, nname), ""),
+            num_tickets=agg["rows"][i], num_rated_tickets=agg["rated_rows"][i], qty=agg["qty"][i],
+            qty_rated=agg["qty_rated"][i], stars_sum=agg["stars_sum"][i], revenue_cents=agg["revenue"][i],
+            price_counts=_price_counts(units[(day, mid, nname)]),
+        )
+        for (day, mid, nname), i in cols.keys.items()
+    ]
+
+    # staff: the key stored on each ticket at close (no raw POS JSON read)
+    stamp_missing(TicketLink.objects.filter(id__in=ids))
+    active = staff_active(rp)
+    acc = {}
+    for tl_id, closed, key, display, total, tip in (
+        TicketLink.objects.filter(id__in=ids)
+        .values_list("id", "closed_at", "staff_key", "staff_name", "total_cents", "tip_cents").iterator(chunk_size=5000)
+    ):
+        day = _day(closed, tz)
+        observations.extend((day, *o) for o in sketches.ticket_observations(total, tip))
+        row = acc.setdefault((day, key), StaffDailyStats(
+            restaurant=rp, day=day, staff_key=key, name=display, is_active=active.get(key, True),
+        ))
+        s = stars.get(tl_id)
+        row.num_tickets += 1
+        row.revenue_cents += int(total or 0)
+        if s is not None:
+            row.num_rated_tickets += 1
+            row.stars_sum += s
+
+    item_rows.delete()
+    staff_rows.delete()
+    sketch_rows.delete()
+    ItemDailyStats.objects.bulk_create(items, batch_size=1000)
+    StaffDailyStats.objects.bulk_create(list(acc.values()), batch_size=1000)
+    DailySketch.objects.bulk_create(sketches.build_sketches(rp.id, observations), batch_size=500)
+    RollupRating.objects.filter(ticket_link_id__in=ids).delete()
+    RollupRating.objects.bulk_create([RollupRating(ticket_link_id=k, stars=v) for k, v in stars.items()], batch_size=1000)
+
+    if initial:
+        if scanned:
+            top_id, top_closed = max(scanned, key=lambda r: (r[1], r[0]))
+            mark.closed_at, mark.ticket_link_id = top_closed, top_id
+            mark.recent_ticket_ids = sorted(
+                tl_id for tl_id, closed in scanned if closed >= top_closed - WATERMARK_OVERLAP
+            )
+        mark.review_updated_at = review_mark
+        mark.save()
+    return len(items), len(acc), len(ids)
+
+
+def rebuild_daily_stats(rp, start=None, end=None) -> tuple[int, int]:
+    """
+    Recompute one restaurant's rollups for [start, end] (dates, inclusive; None = open).
+    Catches up first, so the range reflects everything closed so far. A restaurant
+    without a watermark is rebuilt in full. Returns (item rows, staff rows).
+    """
+    with transaction.atomic():
+        mark, created = _lock_mark(rp.id)
+        if created:
+            start = end = None
+        else:
+            _fold_new(rp.id, mark)
+        n_items, n_staff, _tickets = _rebuild(rp, start, end, mark, initial=created)
+    analytics_cache.invalidate(rp.id)
+    return n_items, n_staff
+
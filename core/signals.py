@@ -0,0 +1,77 @@
+# core/signals.py
+"""
+Keep the daily rating rollups (core/rollups.py) and cached analytics in step with Review writes,
+the owner dashboard's cached people section (core/dashboard_state.py) with staffing changes,
+and the cached request.role_ctx (core/role_context.py) with ownership / assignment changes.
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import analytics_cache, dashboard_state, role_context
+from .models import ManagerProfile, OwnerProfile, Ownership, RestaurantProfile, Review, StaffProfile
+from .rollups import review_removed, start_mark
+
+
+@receiver(post_save, sender=Review)
+def _review_saved(sender, instance: Review, **kwargs):
+    # New / re-starred reviews are past the restaurant's review watermark; the next
+    # catch_up() (close or analytics read) folds them in, so only drop cached results here.
+    analytics_cache.invalidate(instance.restaurant_id)
+
+
+@receiver(post_delete, sender=Review)
+def _review_deleted(sender, instance: Review, **kwargs):
+    # Rollups are derived data (rebuild_daily_stats repairs them): never fail a review delete.
+    try:
+        review_removed(instance.ticket_link_id)
+    except Exception:
+        pass
+    analytics_cache.invalidate(instance.restaurant_id)
+
+
+@receiver(pre_save, sender=ManagerProfile)
+@receiver(pre_save, sender=StaffProfile)
+def _remember_restaurant(sender, instance, **kwargs):
+    # removals unlink the profile (restaurant = None): the old restaurant's list changes too
+    instance._dashboard_old_restaurant_id = (
+        sender.objects.filter(pk=instance.pk).values_list("restaurant_id", flat=True).first() if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=ManagerProfile)
+@receiver(post_save, sender=StaffProfile)
+@receiver(post_save, sender=Ownership)
+@receiver(post_delete, sender=ManagerProfile)
+@receiver(post_delete, sender=StaffProfile)
+@receiver(post_delete, sender=Ownership)
+def _people_changed(sender, instance, **kwargs):
+    dashboard_state.invalidate_people(instance.restaurant_id)
+    dashboard_state.invalidate_people(getattr(instance, "_dashboard_old_restaurant_id", None))
+
+
+@receiver(post_save, sender=OwnerProfile)
+@receiver(post_save, sender=ManagerProfile)
+@receiver(post_save, sender=StaffProfile)
+@receiver(post_delete, sender=OwnerProfile)
+@receiver(post_delete, sender=ManagerProfile)
+@receiver(post_delete, sender=StaffProfile)
+def _profile_changed(sender, instance, **kwargs):
+    role_context.invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Ownership)
+@receiver(post_delete, sender=Ownership)
+def _ownership_changed(sender, instance, **kwargs):
+    role_context.invalidate_user(
+        OwnerProfile.objects.filter(pk=instance.owner_id).values_list("user_id", flat=True).first()
+    )
+
+
+@receiver(post_save, sender=RestaurantProfile)
+def _restaurant_changed(sender, instance, created=False, **kwargs):
+    if created:
+        # nothing closed yet: the rollups start empty and catch_up() folds from the first close
+        start_mark(instance.pk)
+    # members' contexts hold the restaurant row (names, POS location); deletes cascade to
+    # the Ownerships / ManagerProfiles / StaffProfiles, whose own signals drop the contexts
+    role_context.invalidate_restaurant(instance.pk)
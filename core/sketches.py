@@ -0,0 +1,212 @@
+# core/sketches.py
+"""
+Mergeable quantile sketches (KLL) behind the percentile analytics.
+
+One DailySketch row per (restaurant, day, metric, key):
+
+  ticket_total   closed ticket total_cents                         key ""
+  tip_pct        tip as basis points of total_cents (1250 = 12.5%)  key ""
+  item_price     line-item unit_cents                              key "" (all items)
+                                                                    or item_key(id, name)
+
+Rows are written by core/rollups.py when tickets are folded into the rollups and
+by rebuild_daily_stats(). percentiles() merges the daily sketches of a date range.
+Each sketch keeps O(k log(n/k)) values whatever the volume (k=200: a few hundred
+numbers); below capacity it keeps every value and answers exactly.
+"""
+from __future__ import annotations
+
+import math
+from collections import defaultdict
+
+from .models import DailySketch
+
+SKETCH_K = 200
+
+METRICS = ("ticket_total", "tip_pct", "item_price")
+
+
+class KLLSketch:
+    """
+    KLL sketch (Karnin, Lang, Liberty 2016). Level h holds items of weight 2**h; a full
+    level is sorted and every other item promoted. The alternating offset is kept in
+    the sketch so rebuilding from the same stream gives the same state.
+    """
+
+    def __init__(self, k: int = SKETCH_K):
+        self.k = k
+        self.n = 0
+        self.flip = 0
+        self.levels: list[list] = []
+        self._grow()
+
+    # ---------- sizing ----------
+
+    def _grow(self) -> None:
+        self.levels.append([])
+        depth = len(self.levels)
+        self._caps = [int(math.ceil(self.k * (2 / 3) ** (depth - h - 1))) + 1 for h in range(depth)]
+        self._max_size = sum(self._caps)
+
+    def _size(self) -> int:
+        return sum(len(lv) for lv in self.levels)
+
+    def _compress(self) -> None:
+        size = self._size()
+        while size >= self._max_size:
+            for h, lv in enumerate(self.levels):
+                if len(lv) < self._caps[h]:
+                    continue
+                if h + 1 == len(self.levels):
+                    self._grow()
+                lv.sort()
+                keep = [lv.pop()] if len(lv) % 2 else []
+                promoted = lv[self.flip::2]
+                self.levels[h + 1].extend(promoted)
+                self.levels[h] = keep
+                self.flip ^= 1
+                size -= len(lv) - len(promoted)
+                break
+
+    # ---------- updates ----------
+
+    def update(self, value) -> None:
+        self.levels[0].append(value)
+        self.n += 1
+        if len(self.levels[0]) >= self._caps[0]:
+            self._compress()
+
+    def extend(self, values) -> None:
+        for v in values:
+            self.update(v)
+
+    def merge(self, other: "KLLSketch") -> None:
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for h, lv in enumerate(other.levels):
+            self.levels[h].extend(lv)
+        self.n += other.n
+        self._compress()
+
+    # ---------- queries ----------
+
+    def quantiles(self, qs) -> list:
+        """Value at each fraction in qs (0..1); None when empty."""
+        weighted = sorted((v, 1 << h) for h, lv in enumerate(self.levels) for v in lv)
+        total = sum(w for _, w in weighted)
+        out = []
+        for q in qs:
+            if not total:
+                out.append(None)
+                continue
+            target, seen = max(q, 0.0) * total, 0
+            val = weighted[-1][0]
+            for v, w in weighted:
+                seen += w
+                if seen >= target:
+                    val = v
+                    break
+            out.append(val)
+        return out
+
+    # ---------- storage ----------
+
+    def to_dict(self) -> dict:
+        return {"k": self.k, "n": self.n, "flip": self.flip, "levels": self.levels}
+
+    @classmethod
+    def from_dict(cls, d: dict | None) -> "KLLSketch":
+        sk = cls(int((d or {}).get("k") or SKETCH_K))
+        if d:
+            levels = d.get("levels") or [[]]
+            while len(sk.levels) < len(levels):
+                sk._grow()
+            sk.levels = [list(lv) for lv in levels]
+            sk.n = int(d.get("n") or 0)
+            sk.flip = int(d.get("flip") or 0)
+        return sk
+
+
+# ---------- observations ----------
+
+def item_key(menu_item_id: str, name_norm: str) -> str:
+    """Per-item sketch key: the POS id when there is one, else the normalized name."""
+    return menu_item_id or f"name:{name_norm}"
+
+
+def ticket_observations(total_cents, tip_cents):
+    """[(metric, key, value)] for one closed ticket."""
+    total = int(total_cents or 0)
+    out = [("ticket_total", "", total)]
+    if total > 0:
+        out.append(("tip_pct", "", int(round(int(tip_cents or 0) * 10000 / total))))
+    return out
+
+
+def item_observations(menu_item_id, name_norm, unit_cents):
+    if unit_cents is None:
+        return []
+    return [("item_price", "", int(unit_cents)), ("item_price", item_key(menu_item_id, name_norm), int(unit_cents))]
+
+
+def add_observations(restaurant_id, observations) -> int:
+    """
+    Fold [(day, metric, key, value)] into the stored daily sketches (one read-modify-write
+    per touched row; callers hold the restaurant's watermark lock). Returns rows written.
+    """
+    grouped = defaultdict(list)
+    for day, metric, key, value in observations:
+        grouped[(day, metric, key[:160])].append(value)
+    for (day, metric, key), values in grouped.items():
+        row, _ = DailySketch.objects.select_for_update().get_or_create(
+            restaurant_id=restaurant_id, day=day, metric=metric, key=key, defaults={"sketch": {}},
+        )
+        sk = KLLSketch.from_dict(row.sketch)
+        sk.extend(values)
+        row.sketch, row.n = sk.to_dict(), sk.n
+        row.save(update_fields=["sketch", "n", "updated_at"])
+    return len(grouped)
+
+
+def build_sketches(restaurant_id, observations) -> list[DailySketch]:
+    """Unsaved DailySketch rows for [(day, metric, key, value)] (full rebuild)."""
+    sketches = defaultdict(KLLSketch)
+    for day, metric, key, value in observations:
+        sketches[(day, metric, key[:160])].update(value)
+    return [
+        DailySketch(restaurant_id=restaurant_id, day=day, metric=metric, key=key, n=sk.n, sketch=sk.to_dict())
+        for (day, metric, key), sk in sketches.items()
+    ]
+
+
+# ---------- reads ----------
+
+def parse_percentiles(raw: str, default: str = "50,90,99", limit: int = 20) -> list[float]:
+    """"50,90,99.9" -> [0.5, 0.9, 0.999]. ValueError on junk or anything outside 0..100."""
+    parts = [p.strip() for p in (raw or default).split(",") if p.strip()]
+    if not parts or len(parts) > limit:
+        raise ValueError(f"give 1-{limit} percentiles")
+    out = []
+    for p in parts:
+        v = float(p)
+        if not 0 <= v <= 100:
+            raise ValueError(f"percentile {p} is outside 0..100")
+        out.append(v / 100)
+    return out
+
+
+def percentiles(rp, metric: str, qs, start=None, end=None, key: str = "") -> dict:
+    """
+    {"n": observations, "values": [value per q]} over [start, end] (dates, inclusive),
+    merging the daily sketches. qs are fractions 0..1.
+    """
+    rows = DailySketch.objects.filter(restaurant=rp, metric=metric, key=key)
+    if start:
+        rows = rows.filter(day__gte=start)
+    if end:
+        rows = rows.filter(day__lte=end)
+    merged = KLLSketch()
+    for d in rows.values_list("sketch", flat=True).iterator():
+        merged.merge(KLLSketch.from_dict(d))
+    return {"n": merged.n, "values": merged.quantiles(qs)}
+
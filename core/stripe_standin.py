@@ -0,0 +1,487 @@
+# core/stripe_standin.py
+"""
+Local Stripe stand-in for offline close-flow load tests.
+
+A small in-memory HTTP server speaking the slice of the Stripe REST API this
+app uses (customers, payment methods, setup intents, payment intents incl.
+capture / increment_authorization / cancel, refunds, accounts, account and
+login links). Point the SDK at it with `stripe.api_base = standin.base_url`.
+
+Behaviour knobs:
+  latency_ms / jitter_ms   fixed + uniform random delay added to every call
+  decline_rate             fraction (0..1) of confirms declined with generic_decline
+
+Test payment methods decline deterministically, like Stripe's own test tokens:
+  pm_card_chargeDeclined                      -> card_declined / generic_decline
+  pm_card_chargeDeclinedInsufficientFunds     -> card_declined / insufficient_funds
+  pm_card_chargeDeclinedLostCard              -> card_declined / lost_card
+Any other pm_* id is treated as a Visa ending 4242.
+
+SetupIntents have no browser to confirm them, so they succeed on first
+retrieve with a fresh card attached to the customer.
+
+Idempotency-Key is honoured: replays return the stored response, a reused key
+with different params gets Stripe's idempotency_error.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+_DECLINING_PMS = {
+    "pm_card_chargeDeclined": "generic_decline",
+    "pm_card_chargeDeclinedInsufficientFunds": "insufficient_funds",
+    "pm_card_chargeDeclinedLostCard": "lost_card",
+}
+
+_IDEMPOTENCY_MISMATCH = (
+    "Keys for idempotent requests can only be used with the same parameters they were first used with."
+)
+
+
+class StripeError(Exception):
+    def __init__(self, status: int, type_: str, message: str, **extra):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": {"type": type_, "message": message, **extra}}
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{secrets.token_hex(12)}"
+
+
+def _parse_form(pairs) -> dict:
+    """Decode Stripe's bracketed form encoding (a[b][0]=x) into dicts/lists."""
+    root: dict = {}
+    for raw_key, value in pairs:
+        parts = re.findall(r"[^\[\]]+|\[\]", raw_key)
+        node = root
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            if part == "[]":
+                part = str(len(node))
+            if last:
+                node[part] = value
+            else:
+                node = node.setdefault(part, {})
+    return _listify(root)
+
+
+def _listify(node):
+    if isinstance(node, dict):
+        out = {k: _listify(v) for k, v in node.items()}
+        if out and all(k.isdigit() for k in out):
+            return [out[k] for k in sorted(out, key=int)]
+        return out
+    return node
+
+
+def _int(v, default=None):
+    if v in (None, ""):
+        return default
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        raise StripeError(400, "invalid_request_error", f"Invalid integer: {v}")
+
+
+def _bool(v) -> bool:
+    return str(v).lower() in ("true", "1")
+
+
+class StripeStandIn:
+    def __init__(self, *, latency_ms: float = 0, jitter_ms: float = 0, decline_rate: float = 0.0, seed=None):
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.decline_rate = float(decline_rate)
+        self._rnd = random.Random(seed)
+        self._lock = threading.RLock()
+        self.objects: dict[str, dict] = {}
+        self.idempotent: dict[str, tuple[str, int, dict]] = {}
+        self.calls: dict[str, int] = {}
+        self._server: ThreadingHTTPServer | None = None
+
+    # ---------- server lifecycle ----------
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve on a daemon thread (port 0 = any free port); returns the API base URL."""
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="stripe-standin", daemon=True).start()
+        return self.base_url
+
+    def serve_forever(self, host: str = "127.0.0.1", port: int = 12111) -> None:
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # ---------- request entry ----------
+
+    def handle(self, method: str, path: str, params: dict, idem_key: str | None) -> tuple[int, dict]:
+        delay = self.latency_ms + (self._rnd.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        route, handler, args = self._route(method, path)
+        with self._lock:
+            self.calls[route] = self.calls.get(route, 0) + 1
+
+        if method == "POST" and idem_key:
+            fingerprint = hashlib.sha256(f"{method} {path} {json.dumps(params, sort_keys=True)}".encode()).hexdigest()
+            with self._lock:
+                seen = self.idempotent.get(idem_key)
+                if seen is None:
+                    self.idempotent[idem_key] = (fingerprint, 0, {})  # in flight
+            if seen:
+                if seen[0] != fingerprint:
+                    return 400, {"error": {"type": "idempotency_error", "message": _IDEMPOTENCY_MISMATCH}}
+                if seen[1] == 0:
+                    return 409, {"error": {
+                        "type": "invalid_request_error", "code": "idempotency_key_in_use",
+                        "message": "There is currently another in-progress request using this Stripe token.",
+                    }}
+                return seen[1], seen[2]
+            status, body = self._dispatch(handler, args, params)
+            with self._lock:
+                self.idempotent[idem_key] = (fingerprint, status, body)
+            return status, body
+        return self._dispatch(handler, args, params)
+
+    def _dispatch(self, handler, args, params) -> tuple[int, dict]:
+        try:
+            with self._lock:
+                obj = handler(*args, params)
+                return 200, self._expand(obj, params.get("expand") or [])
+        except StripeError as e:
+            return e.status, e.body
+
+    _ROUTES = [
+        ("POST", r"/v1/customers", "create_customer"),
+        ("GET",  r"/v1/customers/([^/]+)", "get_customer"),
+        ("POST", r"/v1/customers/([^/]+)", "update_customer"),
+        ("GET",  r"/v1/payment_methods/([^/]+)", "get_payment_method"),
+        ("POST", r"/v1/payment_methods/([^/]+)/attach", "attach_payment_method"),
+        ("POST", r"/v1/setup_intents", "create_setup_intent"),
+        ("GET",  r"/v1/setup_intents/([^/]+)", "get_setup_intent"),
+        ("POST", r"/v1/payment_intents", "create_payment_intent"),
+        ("GET",  r"/v1/payment_intents/([^/]+)", "get_payment_intent"),
+        ("POST", r"/v1/payment_intents/([^/]+)/confirm", "confirm_payment_intent"),
+        ("POST", r"/v1/payment_intents/([^/]+)/capture", "capture_payment_intent"),
+        ("POST", r"/v1/payment_intents/([^/]+)/increment_authorization", "increment_payment_intent"),
+        ("POST", r"/v1/payment_intents/([^/]+)/cancel", "cancel_payment_intent"),
+        ("POST", r"/v1/refunds", "create_refund"),
+        ("GET",  r"/v1/refunds/([^/]+)", "get_refund"),
+        ("POST", r"/v1/accounts", "create_account"),
+        ("GET",  r"/v1/accounts/([^/]+)", "get_account"),
+        ("POST", r"/v1/accounts/([^/]+)/login_links", "create_login_link"),
+        ("POST", r"/v1/account_links", "create_account_link"),
+    ]
+
+    def _route(self, method: str, path: str):
+        for verb, pattern, name in self._ROUTES:
+            m = re.fullmatch(pattern, path)
+            if verb == method and m:
+                return name, getattr(self, name), m.groups()
+        return "unknown", self._not_found, (path,)
+
+    def _not_found(self, path, params):
+        raise StripeError(404, "invalid_request_error", f"Unrecognized request URL ({path}).")
+
+    # ---------- store helpers ----------
+
+    def _get(self, obj_id: str, kind: str) -> dict:
+        obj = self.objects.get(obj_id)
+        if not obj or obj["object"] != kind:
+            raise StripeError(404, "invalid_request_error", f"No such {kind}: '{obj_id}'",
+                              code="resource_missing", param="id")
+        return obj
+
+    def _put(self, obj: dict) -> dict:
+        self.objects[obj["id"]] = obj
+        return obj
+
+    def _expand(self, obj: dict, fields) -> dict:
+        out = dict(obj)
+        for field in fields:
+            ref = out.get(field)
+            if isinstance(ref, str) and ref in self.objects:
+                out[field] = dict(self.objects[ref])
+        return out
+
+    def payment_intents(self, **metadata) -> list[dict]:
+        """PaymentIntents whose metadata contains all given key/values (for harness assertions)."""
+        with self._lock:
+            return [
+                dict(o) for o in self.objects.values()
+                if o["object"] == "payment_intent"
+                and all((o.get("metadata") or {}).get(k) == v for k, v in metadata.items())
+            ]
+
+    # ---------- customers / payment methods ----------
+
+    def create_customer(self, params):
+        return self._put({
+            "id": _new_id("cus"), "object": "customer", "created": int(time.time()),
+            "email": params.get("email"), "metadata": params.get("metadata") or {},
+            "invoice_settings": {"default_payment_method": None},
+        })
+
+    def _customer(self, customer_id: str) -> dict:
+        # Fixtures reference customers that were never created here; materialize them.
+        if customer_id not in self.objects and customer_id.startswith("cus_"):
+            self._put({"id": customer_id, "object": "customer", "created": int(time.time()),
+                       "email": None, "metadata": {}, "invoice_settings": {"default_payment_method": None}})
+        return self._get(customer_id, "customer")
+
+    def get_customer(self, customer_id, params):
+        return self._customer(customer_id)
+
+    def update_customer(self, customer_id, params):
+        cus = self._customer(customer_id)
+        for key in ("email", "description", "name"):
+            if key in params:
+                cus[key] = params[key]
+        if "metadata" in params:
+            cus["metadata"] = {**cus.get("metadata", {}), **params["metadata"]}
+        if "invoice_settings" in params:
+            cus["invoice_settings"] = {**cus["invoice_settings"], **params["invoice_settings"]}
+        return cus
+
+    def _payment_method(self, pm_id: str) -> dict:
+        if pm_id not in self.objects and pm_id.startswith("pm_"):
+            self._put({
+                "id": pm_id, "object": "payment_method", "type": "card", "customer": None,
+                "created": int(time.time()),
+                "card": {"brand": "visa", "last4": "0002" if pm_id in _DECLINING_PMS else "4242",
+                         "exp_month": 12, "exp_year": time.gmtime().tm_year + 3, "funding": "credit"},
+            })
+        return self._get(pm_id, "payment_method")
+
+    def get_payment_method(self, pm_id, params):
+        return self._payment_method(pm_id)
+
+    def attach_payment_method(self, pm_id, params):
+        pm = self._payment_method(pm_id)
+        pm["customer"] = self._customer(params.get("customer") or "")["id"]
+        return pm
+
+    # ---------- setup intents ----------
+
+    def create_setup_intent(self, params):
+        si_id = _new_id("seti")
+        return self._put({
+            "id": si_id, "object": "setup_intent", "status": "requires_payment_method",
+            "client_secret": f"{si_id}_secret_{secrets.token_hex(8)}",
+            "customer": params.get("customer"), "usage": params.get("usage") or "off_session",
+            "payment_method": None, "payment_method_types": params.get("payment_method_types") or ["card"],
+        })
+
+    def get_setup_intent(self, si_id, params):
+        si = self._get(si_id, "setup_intent")
+        if si["status"] != "succeeded":
+            pm = self._payment_method(_new_id("pm"))
+            if si.get("customer"):
+                pm["customer"] = self._customer(si["customer"])["id"]
+            si.update(status="succeeded", payment_method=pm["id"])
+        return si
+
+    # ---------- payment intents ----------
+
+    def _decline_code(self, pm_id: str | None) -> str | None:
+        if pm_id in _DECLINING_PMS:
+            return _DECLINING_PMS[pm_id]
+        if self.decline_rate and self._rnd.random() < self.decline_rate:
+            return "generic_decline"
+        return None
+
+    def create_payment_intent(self, params):
+        amount = _int(params.get("amount"))
+        if not amount or amount <= 0:
+            raise StripeError(400, "invalid_request_error", "Missing required param: amount.", param="amount")
+        if params.get("customer"):
+            self._customer(params["customer"])
+        pi = self._put({
+            "id": _new_id("pi"), "object": "payment_intent", "created": int(time.time()),
+            "amount": amount, "amount_capturable": 0, "amount_received": 0,
+            "currency": params.get("currency") or "usd",
+            "customer": params.get("customer"), "payment_method": params.get("payment_method"),
+            "capture_method": params.get("capture_method") or "automatic",
+            "description": params.get("description"), "metadata": params.get("metadata") or {},
+            "transfer_data": params.get("transfer_data"), "on_behalf_of": params.get("on_behalf_of"),
+            "application_fee_amount": _int(params.get("application_fee_amount")),
+            "status": "requires_confirmation" if params.get("payment_method") else "requires_payment_method",
+            "last_payment_error": None,
+        })
+        if _bool(params.get("confirm")):
+            return self._confirm(pi)
+        return pi
+
+    def _confirm(self, pi: dict) -> dict:
+        if not pi.get("payment_method"):
+            raise StripeError(400, "invalid_request_error", "You must provide a payment_method.")
+        self._payment_method(pi["payment_method"])
+        decline = self._decline_code(pi["payment_method"])
+        if decline:
+            pi["status"] = "requires_payment_method"
+            pi["last_payment_error"] = {"type": "card_error", "code": "card_declined", "decline_code": decline}
+            raise StripeError(402, "card_error", "Your card was declined.",
+                              code="card_declined", decline_code=decline, payment_intent=dict(pi))
+        if pi["capture_method"] == "manual":
+            pi.update(status="requires_capture", amount_capturable=pi["amount"])
+        else:
+            pi.update(status="succeeded", amount_received=pi["amount"])
+        return pi
+
+    def get_payment_intent(self, pi_id, params):
+        return self._get(pi_id, "payment_intent")
+
+    def confirm_payment_intent(self, pi_id, params):
+        pi = self._get(pi_id, "payment_intent")
+        if params.get("payment_method"):
+            pi["payment_method"] = params["payment_method"]
+        return self._confirm(pi)
+
+    def _require_status(self, pi: dict, status: str, action: str):
+        if pi["status"] != status:
+            raise StripeError(400, "invalid_request_error",
+                              f"This PaymentIntent could not be {action} because it has a status of {pi['status']}.",
+                              code="payment_intent_unexpected_state", payment_intent=dict(pi))
+
+    def capture_payment_intent(self, pi_id, params):
+        pi = self._get(pi_id, "payment_intent")
+        self._require_status(pi, "requires_capture", "captured")
+        amount = _int(params.get("amount_to_capture"), pi["amount_capturable"])
+        if amount > pi["amount_capturable"]:
+            raise StripeError(400, "invalid_request_error",
+                              "The amount_to_capture is greater than the amount capturable.",
+                              param="amount_to_capture")
+        if "application_fee_amount" in params:
+            pi["application_fee_amount"] = _int(params["application_fee_amount"])
+        pi.update(status="succeeded", amount_received=amount, amount_capturable=0)
+        return pi
+
+    def increment_payment_intent(self, pi_id, params):
+        pi = self._get(pi_id, "payment_intent")
+        self._require_status(pi, "requires_capture", "incremented")
+        amount = _int(params.get("amount"))
+        if not amount or amount < pi["amount"]:
+            raise StripeError(400, "invalid_request_error", "amount must be greater than the current amount.",
+                              param="amount")
+        decline = self._decline_code(pi.get("payment_method"))
+        if decline:
+            raise StripeError(402, "card_error", "Your card was declined.",
+                              code="card_declined", decline_code=decline, payment_intent=dict(pi))
+        pi.update(amount=amount, amount_capturable=amount)
+        return pi
+
+    def cancel_payment_intent(self, pi_id, params):
+        pi = self._get(pi_id, "payment_intent")
+        if pi["status"] in ("succeeded", "canceled"):
+            self._require_status(pi, "requires_capture", "canceled")
+        pi.update(status="canceled", amount_capturable=0,
+                  cancellation_reason=params.get("cancellation_reason") or "requested_by_customer")
+        return pi
+
+    # ---------- refunds ----------
+
+    def create_refund(self, params):
+        pi = self._get(params.get("payment_intent") or "", "payment_intent")
+        self._require_status(pi, "succeeded", "refunded")
+        refunded = sum(o["amount"] for o in self.objects.values()
+                       if o["object"] == "refund" and o["payment_intent"] == pi["id"])
+        amount = _int(params.get("amount"), pi["amount_received"] - refunded)
+        if amount <= 0 or refunded + amount > pi["amount_received"]:
+            raise StripeError(400, "invalid_request_error",
+                              f"Charge for {pi['id']} has already been refunded.", code="charge_already_refunded")
+        return self._put({
+            "id": _new_id("re"), "object": "refund", "created": int(time.time()),
+            "amount": amount, "currency": pi["currency"], "payment_intent": pi["id"],
+            "reason": params.get("reason"), "metadata": params.get("metadata") or {}, "status": "succeeded",
+        })
+
+    def get_refund(self, re_id, params):
+        return self._get(re_id, "refund")
+
+    # ---------- connect accounts ----------
+
+    def create_account(self, params):
+        return self._put({
+            "id": _new_id("acct"), "object": "account", "type": params.get("type") or "express",
+            "country": params.get("country") or "US", "email": params.get("email"),
+            "business_type": params.get("business_type"),
+            "business_profile": params.get("business_profile") or {},
+            "company": {"name": (params.get("business_profile") or {}).get("name"), "address": {}},
+            "metadata": params.get("metadata") or {},
+            "details_submitted": True, "charges_enabled": True, "payouts_enabled": True,
+        })
+
+    def get_account(self, acct_id, params):
+        if acct_id not in self.objects and acct_id.startswith("acct_"):
+            self._put({
+                "id": acct_id, "object": "account", "type": "express", "country": "US", "email": None,
+                "business_profile": {"name": f"Stand-in {acct_id[-6:]}"},
+                "company": {"name": f"Stand-in {acct_id[-6:]} LLC", "address": {}},
+                "metadata": {}, "details_submitted": True, "charges_enabled": True, "payouts_enabled": True,
+            })
+        return self._get(acct_id, "account")
+
+    def create_login_link(self, acct_id, params):
+        self.get_account(acct_id, params)
+        return {"object": "login_link", "created": int(time.time()),
+                "url": f"{self.base_url}/express/{acct_id}"}
+
+    def create_account_link(self, params):
+        self.get_account(params.get("account") or "", params)
+        return {"object": "account_link", "created": int(time.time()),
+                "expires_at": int(time.time()) + 300, "url": params.get("return_url") or ""}
+
+
+def _handler_for(standin: StripeStandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+        def _respond(self, method: str):
+            url = urlsplit(self.path)
+            pairs = parse_qsl(url.query, keep_blank_values=True)
+            if method == "POST":
+                length = int(self.headers.get("Content-Length") or 0)
+                pairs += parse_qsl(self.rfile.read(length).decode(), keep_blank_values=True)
+            status, body = standin.handle(method, url.path, _parse_form(pairs), self.headers.get("Idempotency-Key"))
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("Request-Id", _new_id("req"))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._respond("GET")
+
+        def do_POST(self):
+            self._respond("POST")
+
+        def do_DELETE(self):
+            self._respond("DELETE")
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
@@ -1,3 +1,1442 @@
-from django.test import TestCase
+import hashlib
+import csv
+import hmac
+import importlib.util
+import io
+import itertools
+from collections import Counter
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from datetime import datetime, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+import stripe
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from unittest import mock, skipUnless
+from urllib3.util.retry import Retry
+
+from . import (
+    analytics, analytics_cache, clients, columnar, dashboard_state, export_jobs, exports, omnivore, pos_fanout, role_context,
+    sketches, ticket_search, utils, views_home, views_payments, views_staff,
+)
+from .dates import filter_days, local_day, restaurant_tz
+from .item_engine import median_counts, median_int
+from .line_items import build_line_items, sync_line_items
+from .locks import TicketLockTimeout, get_lock_backend, ticket_lock
+from .rollups import catch_up, record_close, resolve_staff, staff_maps
+from .clients import stripe_client
+from .constants import CUSTOMER_SSR
+from .stripe_standin import StripeStandIn
+from .views_processing import PaymentError, charge_customer_off_session, settle_authorization
+from .models import (
+    AnalyticsWatermark, CustomerProfile, DailySketch, ItemDailyStats, ManagerProfile, Member, OwnerProfile, Ownership, RestaurantProfile,
+    Review, StaffDailyStats, StaffProfile, TicketLineItem, TicketLink,
+)
+
+User = get_user_model()
+
+BASE = datetime(2026, 3, 1, 12, 0, tzinfo=dt_timezone.utc)
+
+ITEMS = [
+    [{"menu_item_id": "m1", "name": "Burger", "quantity": 2, "total_cents": 2400}],
+    [{"id": "m2", "name": "Fries", "qty": 1, "unit_cents": 450}, {"name": "Soda", "quantity": 1, "price": "1.99"}],
+    [{"name": "Wine Bottle", "quantity": 1, "price_cents": 6000}],
+    [{"name": "Wine Bottle", "quantity": 1, "price_cents": 6500}, {"menu_item_id": "m1", "name": "Burger", "quantity": 1, "total_cents": 1200}],
+]
+SERVERS = ["Alice", "bob", "Carol", ""]
+
+_phones = itertools.count(1000000)
+
+
+def make_restaurant(name="R", time_zone="", owner=None, **fields):
+    rp = RestaurantProfile.objects.create(
+        dba_name=name, legal_name=name, email=f"{name.lower()}@example.com", time_zone=time_zone,
+        staff_cache=[{"id": "e1", "name": "Alice Smith", "check_name": "Alice", "is_active": True},
+                     {"id": "e2", "name": "Bob Jones", "check_name": "Bob", "is_active": False}],
+        menu_cache=[{"id": "m1", "name": "Burger", "price_cents": 1200, "category": "Mains"}],
+        **fields,
+    )
+    if owner:
+        Ownership.objects.create(owner=owner, restaurant=rp)
+    return rp
+
+
+def make_owner(username="owner"):
+    u = User.objects.create_user(username=username, email=f"{username}@example.com", password="pw")
+    return u, OwnerProfile.objects.create(user=u, phone=f"+1555{next(_phones)}")
+
+
+def make_customer(username="cust"):
+    u = User.objects.create_user(username=username, email=f"{username}@example.com")
+    return CustomerProfile.objects.create(user=u, phone=f"+1666{next(_phones)}")
+
+
+def make_closed(rp, n, start=0, customer=None, every=timedelta(hours=7), rate=True):
+    """n closed TicketLinks without line items (as if closed before TicketLineItem), some reviewed."""
+    customer = customer or make_customer(f"cust-{rp.id}-{start}")
+    links = []
+    for i in range(start, start + n):
+        m = Member.objects.create(number=f"M{rp.id}-{i}", last_name=["Lee", "Ng", "Ortiz"][i % 3], customer=customer)
+        closed = BASE + every * i
+        total = 1000 + 37 * i
+        tl = TicketLink.objects.create(
+            member=m, restaurant=rp, ticket_id=f"t{rp.id}-{i}", ticket_number=str(1000 + i),
+            server_name=SERVERS[i % len(SERVERS)], status="closed", closed_at=closed,
+            opened_at=closed - timedelta(hours=1), items_json=ITEMS[i % len(ITEMS)],
+            total_cents=total, tip_cents=total * 18 // 100,
+        )
+        if rate and i % 2 == 0:
+            Review.objects.create(restaurant=rp, ticket_link=tl, member=m, stars=1 + i % 5)
+        links.append(tl)
+    return links
+
+
+class FreshCacheMixin:
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+
+
+def _menu_key(row):
+    return row.get("menu_item_id") or row["name"]
+
+
+class RollupCatchUpTests(FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rp = make_restaurant()
+        make_closed(self.rp, 24)
+
+    def test_first_catch_up_writes_missing_line_items(self):
+        # a read before backfill_line_items has run must not leave old tickets out for good
+        self.assertFalse(TicketLineItem.objects.exists())
+        rolled = analytics.compute_menu_items(self.rp, backend="rollups")
+        scanned = analytics.compute_menu_items(self.rp, backend="scan")
+        self.assertTrue(rolled)
+        self.assertEqual(sorted(rolled, key=_menu_key), sorted(scanned, key=_menu_key))
+        self.assertEqual(set(TicketLineItem.objects.values_list("ticket_link_id", flat=True)),
+                         set(TicketLink.objects.values_list("id", flat=True)))
+
+    def assertBackendsAgree(self, start=None, end=None):
+        menus = {b: analytics.compute_menu_items(self.rp, start, end, backend=b) for b in ("rollups", "sql", "scan")}
+        staff = {b: analytics.compute_staff(self.rp, start, end, backend=b) for b in ("rollups", "sql", "scan")}
+        self.assertEqual(menus["rollups"], menus["scan"])
+        self.assertEqual(menus["sql"], menus["scan"])
+        self.assertEqual(staff["rollups"], staff["scan"])
+        self.assertEqual(staff["sql"], staff["scan"])
+
+    def test_rollups_match_scan_and_sql(self):
+        # Wine Bottle sells at 6000 and 6500 on different days: the range median is exact,
+        # not a median of daily medians
+        for start, end in ((None, None), (BASE.date() + timedelta(days=2), BASE.date() + timedelta(days=5))):
+            with self.subTest(start=start, end=end):
+                self.assertBackendsAgree(start, end)
+
+    def test_incremental_folds_match_scan(self):
+        analytics.compute_menu_items(self.rp, backend="rollups")   # first catch-up folds the history so far
+        record_close(make_closed(self.rp, 9, start=24))   # later closes, folded incrementally
+        self.assertBackendsAgree()
+
+    def test_new_restaurant_starts_with_an_empty_mark(self):
+        mark = AnalyticsWatermark.objects.get(restaurant=make_restaurant("New"))
+        self.assertEqual((mark.closed_at, mark.recent_ticket_ids), (None, []))
+
+    def test_history_without_a_mark_is_never_rebuilt_in_a_request(self):
+        AnalyticsWatermark.objects.filter(restaurant=self.rp).delete()   # e.g. reset by a migration
+        self.assertIsNone(catch_up(self.rp.id))
+        with self.assertLogs("core.rollups", "WARNING"):
+            record_close(make_closed(self.rp, 2, start=24))
+        sync_line_items(TicketLink.objects.filter(restaurant=self.rp))
+        for start, end in ((None, None), (BASE.date() + timedelta(days=2), BASE.date() + timedelta(days=5))):
+            self.assertEqual(analytics.compute_menu_items(self.rp, start, end, backend="rollups"),
+                             analytics.compute_menu_items(self.rp, start, end, backend="sql"))
+        self.assertFalse(AnalyticsWatermark.objects.filter(restaurant=self.rp).exists())
+        self.assertFalse(ItemDailyStats.objects.filter(restaurant=self.rp).exists())
+
+        call_command("rebuild_daily_stats", restaurant=self.rp.id, stdout=StringIO())
+        self.assertTrue(ItemDailyStats.objects.filter(restaurant=self.rp).exists())
+        record_close(make_closed(self.rp, 3, start=26))
+        self.assertBackendsAgree()
+
+
+class LineItemTests(TestCase):
+    def setUp(self):
+        self.rp = make_restaurant()
+
+    def test_rows_normalize_the_pos_field_variants(self):
+        tl = make_closed(self.rp, 1, rate=False)[0]
+        tl.items_json = [
+            {"menu_item_id": "m1", "name": "Burger", "quantity": 2, "total_cents": 2400},
+            {"id": "m2", "name": "Fries", "qty": 1, "unit_cents": 450},
+            {"name": "  Fish $ Tacos ", "quantity": "3", "price": "4.50"},
+            {"label": "Coffee", "price": "350"},   # bare integer price: legacy cents
+            {"quantity": 1},
+            "not an item",
+        ]
+        rows = [(li.menu_item_id, li.name_norm, li.qty, li.unit_cents, li.line_cents) for li in build_line_items(tl)]
+        self.assertEqual(rows, [
+            ("m1", "burger", 2, 1200, 2400),
+            ("m2", "fries", 1, 450, 450),
+            ("", "fish tacos", 3, 450, 1350),
+            ("", "coffee", 1, 350, 350),
+            ("", "unknown item", 1, None, 0),
+        ])
+
+    def test_sync_replaces_rows_and_skips_open_tickets(self):
+        closed = make_closed(self.rp, 4, rate=False)
+        open_tl = TicketLink.objects.create(member=closed[0].member, restaurant=self.rp, ticket_id="open-1",
+                                            status="open", items_json=ITEMS[0])
+        self.assertEqual(sync_line_items(closed + [open_tl]), 6)
+        self.assertEqual(sync_line_items(closed), 6)   # a second close of the same tickets rewrites, not appends
+        self.assertEqual(TicketLineItem.objects.count(), 6)
+        self.assertFalse(TicketLineItem.objects.filter(ticket_link=open_tl).exists())
+
+    def test_backfill_fills_only_tickets_without_rows(self):
+        links = make_closed(self.rp, 8, rate=False)
+        sync_line_items(links[:2])
+        call_command("backfill_line_items", chunk=3, stdout=StringIO())
+        counts = Counter(TicketLineItem.objects.values_list("ticket_link_id", flat=True))
+        self.assertEqual(counts, {tl.id: len(tl.items_json) for tl in links})
+
+
+class StaffKeyTests(FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rp = make_restaurant()
+
+    def test_resolution_order(self):
+        maps = staff_maps(self.rp)
+        cases = [
+            (TicketLink(server_name=" alice "), ("e1", "Alice", True)),                   # check_name
+            (TicketLink(server_name="Bob Jones"), ("e2", "Bob", False)),                  # full name
+            (TicketLink(raw_ticket_json={"_embedded": {"employee": {"check_name": "BOB"}}}), ("e2", "Bob", False)),
+            (TicketLink(server_name="Dan"), ("Dan", "Dan", True)),                         # not in staff_cache
+            (TicketLink(raw_ticket_json={"employee": {}}), ("", "", True)),
+        ]
+        for tl, expected in cases:
+            with self.subTest(server=tl.server_name, raw=tl.raw_ticket_json):
+                self.assertEqual(resolve_staff(tl, *maps), expected)
+
+    def test_backfill_then_staff_analytics_skip_the_raw_json(self):
+        links = make_closed(self.rp, 12)
+        call_command("backfill_staff_keys", chunk=5, stdout=StringIO())
+        maps = staff_maps(self.rp)
+        self.assertEqual(dict(TicketLink.objects.values_list("id", "staff_key")),
+                         {tl.id: resolve_staff(tl, *maps)[0] for tl in links})
+        with CaptureQueriesContext(connection) as queries:
+            staff = analytics.compute_staff(self.rp, backend="sql")
+        # only the stamp_missing() probe for unstamped tickets names the raw JSON, and it matches nothing now
+        self.assertFalse([q["sql"] for q in queries
+                          if "raw_ticket_json" in q["sql"] and '"staff_key" IS NULL' not in q["sql"]])
+        self.assertEqual(staff, analytics.compute_staff(self.rp, backend="scan"))
+
+
+class SharedAnalyticsTests(FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner, op = make_owner()
+        self.rp = make_restaurant(owner=op)
+        sync_line_items(make_closed(self.rp, 12))
+        self.manager = User.objects.create_user(username="mgr", email="mgr@example.com")
+        ManagerProfile.objects.create(user=self.manager, phone=f"+1777{next(_phones)}", restaurant=self.rp)
+        analytics.compute_menu_items(self.rp, backend="rollups")   # first catch-up folds and bumps the generation
+
+    def get(self, user, name, **params):
+        client = Client()
+        client.force_login(user)
+        resp = client.get(reverse(f"core:{name}"), params)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_owner_and_manager_share_one_computation(self):
+        rng = {"start": (BASE.date() + timedelta(days=1)).isoformat(), "end": (BASE.date() + timedelta(days=3)).isoformat()}
+        for kind, compute in (("menu_item_ratings", "compute_menu_items"), ("staff_ratings", "compute_staff")):
+            with self.subTest(kind), mock.patch.object(analytics, compute, wraps=getattr(analytics, compute)) as spy:
+                owner = self.get(self.owner, f"owner_api_{kind}", **rng)
+                manager = self.get(self.manager, f"manager_api_{kind}", **rng)
+                owner.pop("synced_at", None), manager.pop("synced_at", None)
+                self.assertEqual(owner, manager)
+                self.assertEqual(spy.call_count, 1)
+
+
+class MedianCountsTests(SimpleTestCase):
+    def test_matches_median_int(self):
+        rnd = random.Random(7)
+        for n in range(1, 40):
+            vals = [rnd.choice((450, 1200, 1624, 1626, 6000, 6500)) for _ in range(n)]
+            self.assertEqual(median_counts(Counter(vals)), median_int(vals), vals)
+        self.assertIsNone(median_counts({}))
+
+
+class KLLSketchTests(SimpleTestCase):
+    QS = (0.01, 0.1, 0.5, 0.9, 0.99)
+
+    def rank_error(self, sk, values):
+        values = sorted(values)
+        worst = 0.0
+        for q, v in zip(self.QS, sk.quantiles(self.QS)):
+            lo, hi = values.index(v), len(values) - values[::-1].index(v)   # ranks holding v
+            worst = max(worst, max(lo / len(values) - q, q - hi / len(values), 0.0))
+        return worst
+
+    def test_exact_below_capacity(self):
+        values = random.Random(1).sample(range(10_000), 150)
+        sk = sketches.KLLSketch()
+        sk.extend(values)
+        ordered = sorted(values)
+        self.assertEqual(sk.quantiles(self.QS), [ordered[analytics._rank(150, q)] for q in self.QS])
+
+    def test_memory_stays_bounded_and_ranks_close(self):
+        rnd = random.Random(2)
+        values = [int(rnd.lognormvariate(7, 0.6)) for _ in range(60_000)]
+        sk = sketches.KLLSketch()
+        sk.extend(values)
+        self.assertEqual(sk.n, len(values))
+        self.assertLess(sk._size(), 4 * sketches.SKETCH_K)
+        self.assertLess(self.rank_error(sk, values), 0.02)
+
+    def test_merged_daily_sketches_match_one_stream(self):
+        rnd = random.Random(3)
+        days = [[rnd.randrange(500, 9000) for _ in range(rnd.randrange(50, 3000))] for _ in range(30)]
+        merged = sketches.KLLSketch()
+        for values in days:
+            sk = sketches.KLLSketch()
+            sk.extend(values)
+            merged.merge(sketches.KLLSketch.from_dict(json.loads(json.dumps(sk.to_dict()))))   # stored as JSON
+        everything = [v for values in days for v in values]
+        self.assertEqual(merged.n, len(everything))
+        self.assertLess(self.rank_error(merged, everything), 0.02)
+
+
+class PercentileTests(FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, op = make_owner()
+        self.rp = make_restaurant(time_zone="America/New_York", owner=op)
+        links = make_closed(self.rp, 30, rate=False)
+        sync_line_items(links)
+
+    def test_sketches_answer_like_a_full_scan_on_local_days(self):
+        # tickets 7h apart straddle local midnight, so UTC days would put some on the wrong side
+        qs = [0.25, 0.5, 0.9]
+        for metric, item in (("ticket_total", ""), ("tip_pct", ""), ("item_price", ""), ("item_price", "Wine Bottle")):
+            for start, end in ((None, None), (BASE.date() + timedelta(days=2), BASE.date() + timedelta(days=5))):
+                with self.subTest(metric=metric, item=item, start=start, end=end):
+                    rolled = analytics.compute_percentiles(self.rp, metric, qs, start, end, item=item, backend="rollups")
+                    self.assertTrue(rolled["n"])
+                    self.assertEqual(rolled, analytics.compute_percentiles(self.rp, metric, qs, start, end, item=item,
+                                                                           backend="scan"))
+
+    def test_endpoint(self):
+        self.client.force_login(self.user)
+        url = reverse("core:owner_api_percentiles")
+        resp = self.client.get(url, {"metric": "ticket_total", "p": "50,99"}).json()
+        self.assertEqual([p["p"] for p in resp["percentiles"]], [50, 99])
+        self.assertEqual(resp["n"], 30)
+        self.assertEqual(self.client.get(url, {"p": "150"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"metric": "bogus"}).status_code, 400)
+
+
+class StandInMixin:
+    """A fresh StripeStandIn per test, with the SDK pointed at it."""
+
+    def setUp(self):
+        super().setUp()
+        stripe_client()
+        saved = (stripe.api_base, stripe.api_key, stripe.max_network_retries)
+        self.stripe = StripeStandIn()
+        stripe.api_base, stripe.api_key, stripe.max_network_retries = self.stripe.start(), "sk_test_standin", 0
+        self.addCleanup(self.stripe.stop)
+        self.addCleanup(lambda: setattr(stripe, "api_base", saved[0]) or setattr(stripe, "api_key", saved[1])
+                        or setattr(stripe, "max_network_retries", saved[2]))
+
+    def hold(self, amount_cents=5000, pm="pm_card_visa"):
+        customer = stripe.Customer.create(email="diner@example.com")
+        return charge_customer_off_session(
+            customer_id=customer.id, payment_method_id=pm, amount_cents=amount_cents,
+            capture_method="manual", metadata={"ticket_id": "t1"},
+        )
+
+
+class SettleAuthorizationTests(StandInMixin, SimpleTestCase):
+    def test_retried_capture_replays_instead_of_capturing_again(self):
+        pi = self.hold()
+        first = settle_authorization(pi.id, authorized_cents=5000, amount_cents=4200, idempotency_key="close:t1")
+        with self.assertNoLogs("core.views_processing"):   # Stripe replayed the capture: no error, no fallback
+            again = settle_authorization(pi.id, authorized_cents=5000, amount_cents=4200, idempotency_key="close:t1")
+        self.assertEqual((first.status, again.id, again.amount_received), ("succeeded", pi.id, 4200))
+
+    def test_hold_captured_elsewhere_is_used_not_charged_again(self):
+        # first close attempt captured, then the client timed out; the retry computes another amount
+        pi = self.hold()
+        stripe.PaymentIntent.capture(pi.id, amount_to_capture=4200)
+        with self.assertLogs("core.views_processing", "WARNING"):
+            intent = settle_authorization(pi.id, authorized_cents=5000, amount_cents=4300, idempotency_key="close:t1")
+        self.assertEqual((intent.id, intent.status, intent.amount_received), (pi.id, "succeeded", 4200))
+        self.assertEqual(len(self.stripe.payment_intents(ticket_id="t1")), 1)
+
+    def test_declined_increment_releases_the_hold(self):
+        pi = self.hold()
+        self.stripe.decline_rate = 1.0   # the increment is declined
+        with self.assertLogs("core.views_processing", "WARNING"):
+            self.assertIsNone(settle_authorization(pi.id, authorized_cents=5000, amount_cents=9000))
+        self.assertEqual(stripe.PaymentIntent.retrieve(pi.id).status, "canceled")
+
+    def test_unreadable_state_raises(self):
+        with self.assertRaises(PaymentError), self.assertLogs("core.views_processing", "WARNING"):
+            settle_authorization("pi_missing", authorized_cents=5000, amount_cents=4200)
+
+
+class StripeStandInTests(StandInMixin, SimpleTestCase):
+    def charge(self, amount_cents=2500, pm="pm_card_visa", **kw):
+        return charge_customer_off_session(customer_id="cus_diner", payment_method_id=pm, amount_cents=amount_cents,
+                                           metadata={"ticket_id": "t1"}, **kw)
+
+    def test_retried_charge_replays_the_first_intent(self):
+        first, again = self.charge(), self.charge()
+        self.assertEqual((again.id, again.status), (first.id, "succeeded"))
+        self.assertEqual(len(self.stripe.payment_intents(ticket_id="t1")), 1)
+
+    def test_reused_key_with_other_params_is_refused(self):
+        stripe.PaymentIntent.create(idempotency_key="k1", amount=100, currency="usd")
+        with self.assertRaises(stripe.error.IdempotencyError):
+            stripe.PaymentIntent.create(idempotency_key="k1", amount=200, currency="usd")
+
+    def test_declining_test_card_raises_with_the_intent(self):
+        with self.assertRaises(PaymentError) as caught:
+            self.charge(pm="pm_card_chargeDeclinedInsufficientFunds")
+        err = caught.exception
+        self.assertEqual((err.code, err.decline_code), ("card_declined", "insufficient_funds"))
+        self.assertEqual(self.stripe.objects[err.payment_intent_id]["status"], "requires_payment_method")
+
+    def test_decline_rate_declines_confirms(self):
+        self.stripe.decline_rate = 1.0
+        with self.assertRaises(PaymentError) as caught:
+            self.charge()
+        self.assertEqual(caught.exception.decline_code, "generic_decline")
+
+
+def stripe_signature(payload: bytes, secret: str) -> str:
+    t = int(time.time())
+    v1 = hmac.new(secret.encode(), f"{t}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={t},v1={v1}"
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    """Answers each POST with the next status from server.statuses (the last one repeats)."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.posts += 1
+        status = self.server.statuses[min(self.server.posts, len(self.server.statuses)) - 1]
+        body = json.dumps({"errors": []} if status >= 400 else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboundClientTests(SimpleTestCase):
+    """core/clients: one pooled client per process, retry budgets from OUTBOUND_HTTP_*."""
+
+    def setUp(self):
+        super().setUp()
+        saved = {k: getattr(stripe, k) for k in ("api_key", "api_base", "default_http_client", "max_network_retries")}
+        self.addCleanup(lambda: [setattr(stripe, k, v) for k, v in saved.items()])
+        for name in ("_stripe_ready", "_twilio", "_sendgrid_session"):
+            patcher = mock.patch.object(clients, name, False if name == "_stripe_ready" else None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stripe_is_configured_once(self):
+        with mock.patch.object(stripe, "RequestsClient", wraps=stripe.RequestsClient) as built:
+            threads = [threading.Thread(target=stripe_client) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertIs(stripe_client(), stripe)
+        self.assertEqual(built.call_count, 1)
+        http = stripe.default_http_client
+        self.assertEqual(http._timeout, clients.HTTP_TIMEOUT)
+        self.assertEqual(http._session.get_adapter("https://api.stripe.com")._pool_maxsize, clients.HTTP_POOL_SIZE)
+        self.assertEqual(stripe.max_network_retries, clients.HTTP_RETRIES)
+
+    def test_twilio_client_is_shared(self):
+        with mock.patch.dict(os.environ, {"TWILIO_ACCOUNT_SID": "AC123", "TWILIO_AUTH_TOKEN": "token"}):
+            tw = clients.twilio_client()
+            self.assertIs(clients.twilio_client(), tw)
+        self.assertEqual(tw.http_client.timeout, clients.HTTP_TIMEOUT)
+        self.assertEqual(tw.http_client.session.get_adapter("https://api.twilio.com").max_retries.total, clients.HTTP_RETRIES)
+
+    def sendgrid(self, *statuses):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StatusHandler)
+        server.statuses, server.posts = list(statuses), 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_port}/v3/mail/send"
+        for patcher in (mock.patch.object(clients, "SENDGRID_SEND_URL", url),
+                        mock.patch.object(Retry, "get_backoff_time", return_value=0),
+                        mock.patch.dict(os.environ, {"API_SENDGRID": "SG.test"})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return server
+
+    def message(self):
+        return mock.Mock(get=mock.Mock(return_value={"subject": "hi"}))
+
+    def test_sendgrid_retries_gateway_errors(self):
+        server = self.sendgrid(503, 502, 202)
+        self.assertEqual(clients.sendgrid_send(self.message()).status_code, 202)
+        self.assertEqual(server.posts, 3)
+
+    def test_sendgrid_final_failure_raises_in_the_sender(self):
+        server = self.sendgrid(503)
+        self.assertEqual(clients.sendgrid_send(self.message()).status_code, 503)
+        self.assertEqual(server.posts, 1 + clients.HTTP_RETRIES)
+        with self.assertRaisesRegex(RuntimeError, "SendGrid failed: 503"):
+            utils.send_owner_invite_email("new@example.com", "https://example.com/i/1", "R", BASE)
+        self.assertEqual(server.posts, 2 * (1 + clients.HTTP_RETRIES))
+
+    def test_sendgrid_does_not_retry_rejections(self):
+        server = self.sendgrid(400, 202)
+        self.assertEqual(clients.sendgrid_send(self.message()).status_code, 400)
+        self.assertEqual(server.posts, 1)
+
+
+@mock.patch.object(views_payments, "STRIPE_WH_CUSTOMER", "whsec_test")
+class CustomerWebhookTests(StandInMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cp = make_customer()
+        self.cp.stripe_customer_id, self.cp.default_payment_method = "cus_1", "pm_old"
+        self.cp.save()
+        self.url = reverse("core:stripe_customer_webhook")
+
+    def post(self, pm_id, signature=None):
+        body = json.dumps({"id": "evt_1", "object": "event", "type": "customer.updated", "data": {"object": {
+            "id": "cus_1", "object": "customer", "invoice_settings": {"default_payment_method": pm_id},
+        }}}).encode()
+        headers = {"HTTP_STRIPE_SIGNATURE": signature(body) if signature else ""}
+        return self.client.post(self.url, body, content_type="application/json", **headers)
+
+    def test_signed_event_updates_default_card(self):
+        self.assertEqual(self.post("pm_new", lambda b: stripe_signature(b, "whsec_test")).status_code, 200)
+        self.cp.refresh_from_db()
+        self.assertEqual((self.cp.default_payment_method, self.cp.card_last4), ("pm_new", "4242"))
+
+    def test_unsigned_or_forged_event_is_rejected(self):
+        self.assertEqual(self.post("pm_evil").status_code, 400)
+        self.assertEqual(self.post("pm_evil", lambda b: stripe_signature(b, "whsec_other")).status_code, 400)
+        self.cp.refresh_from_db()
+        self.assertEqual(self.cp.default_payment_method, "pm_old")
+
+    def test_no_secret_configured_refuses_events(self):
+        with mock.patch.object(views_payments, "STRIPE_WH_CUSTOMER", ""), \
+                self.assertLogs("core.views_payments", "ERROR"):
+            self.assertEqual(self.post("pm_evil").status_code, 500)
+        self.cp.refresh_from_db()
+        self.assertEqual(self.cp.default_payment_method, "pm_old")
+
+
+class CardUpdateTests(StandInMixin, TestCase):
+    """finalize_card_update reads the expanded SetupIntent (StripeObjects, not dicts)."""
+
+    def setUp(self):
+        super().setUp()
+        self.cp = make_customer()
+        self.cp.stripe_customer_id = stripe.Customer.create(email="diner@example.com").id
+        self.cp.default_payment_method, self.cp.pin_hash = "pm_old", make_password("1234")
+        self.cp.save()
+        self.client.force_login(self.cp.user)
+        session = self.client.session
+        session[CUSTOMER_SSR] = {"pending_update_setup_intent_id":
+                                 stripe.SetupIntent.create(customer=self.cp.stripe_customer_id).id}
+        session.save()
+
+    def test_saved_card_becomes_the_default(self):
+        resp = self.client.post(reverse("core:finalize_card_update"), {"pin": "1234"}, content_type="application/json")
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.cp.refresh_from_db()
+        self.assertTrue(self.cp.default_payment_method.startswith("pm_"))
+        self.assertNotEqual(self.cp.default_payment_method, "pm_old")
+        self.assertEqual(self.cp.card_last4, "4242")
+        self.assertNotIn("pending_update_setup_intent_id", self.client.session[CUSTOMER_SSR])
+
+
+def _index_pattern(model, fields) -> str:
+    """Plan regex for the index on fields; unique constraints show up as SQLite autoindexes."""
+    for idx in model._meta.indexes:
+        if list(idx.fields) == list(fields):
+            return re.escape(idx.name)
+    return r"sqlite_autoindex_\w+"
+
+
+class ReportPlanTests(FreshCacheMixin, TestCase):
+    """The reporting range queries must range-scan their (restaurant, ..., closed_at/day) indexes."""
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor != "sqlite":
+            self.skipTest("plan text is SQLite's")
+        self.rp = make_restaurant(time_zone="America/Los_Angeles")
+        make_closed(self.rp, 12)
+        analytics.compute_menu_items(self.rp, backend="rollups")   # line items + rollup rows to plan against
+        self.tz = restaurant_tz(self.rp)
+        self.end = timezone.localdate()
+        self.start = self.end - timedelta(days=30)
+
+    def assertRangeScan(self, qs, index_pattern, column):
+        plan = qs.explain()
+        self.assertRegex(plan, rf"USING (COVERING )?INDEX {index_pattern} \(.*\b{column}[<>]", plan)
+
+    def test_closed_ticket_ranges_use_restaurant_status_closed_index(self):
+        closed = TicketLink.objects.filter(restaurant=self.rp, status="closed")
+        in_range = filter_days(closed, self.start, self.end, self.tz)
+        for label, qs in [
+            ("recent closed (state views)", in_range.order_by("-closed_at")[:500]),
+            ("export rows", in_range.order_by("closed_at")),
+            ("catch-up window", closed.filter(closed_at__isnull=False, closed_at__gte=timezone.now() - timedelta(minutes=5))
+             .values_list("id", "closed_at")),
+        ]:
+            with self.subTest(label):
+                self.assertRangeScan(qs, "tl_rest_status_closed", "closed_at")
+
+    def test_day_cast_filter_cannot_range_scan(self):
+        # the closed_at__date form filter_days replaced: the index can only match restaurant/status
+        qs = TicketLink.objects.filter(restaurant=self.rp, status="closed",
+                                       closed_at__date__gte=self.start, closed_at__date__lte=self.end)
+        self.assertNotRegex(qs.explain(), r"closed_at[<>]")
+
+    def test_rollup_and_sketch_reads_range_scan_day(self):
+        rp, start, end = self.rp, self.start, self.end
+        for label, qs, model, fields, column in [
+            ("line items (rebuild)", filter_days(TicketLineItem.objects.filter(restaurant=rp), start, end, self.tz),
+             TicketLineItem, ["restaurant", "closed_at"], "closed_at"),
+            ("menu ratings", ItemDailyStats.objects.filter(restaurant=rp, day__gte=start, day__lte=end),
+             ItemDailyStats, ["restaurant", "day", "menu_item_id", "name_norm"], "day"),
+            ("staff ratings", StaffDailyStats.objects.filter(restaurant=rp, day__gte=start, day__lte=end),
+             StaffDailyStats, ["restaurant", "day", "staff_key"], "day"),
+            ("percentiles", DailySketch.objects.filter(restaurant=rp, metric="ticket_total", key="",
+                                                       day__gte=start, day__lte=end),
+             DailySketch, ["restaurant", "metric", "key", "day"], "day"),
+        ]:
+            with self.subTest(label):
+                self.assertRangeScan(qs, _index_pattern(model, fields), column)
+
+
+class TicketLockTests(TransactionTestCase):
+    def setUp(self):
+        self.rp = make_restaurant()
+
+    def test_same_ticket_is_held_by_one_caller_at_a_time(self):
+        for backend in ("db", "cache"):
+            with self.subTest(backend):
+                inside, peak, guard = [0], [0], threading.Lock()
+                barrier = threading.Barrier(6)
+
+                def worker():
+                    try:
+                        barrier.wait(timeout=10)
+                        with ticket_lock(self.rp.id, "t1", wait=10, backend=get_lock_backend(backend)):
+                            with guard:
+                                inside[0] += 1
+                                peak[0] = max(peak[0], inside[0])
+                            time.sleep(0.02)
+                            with guard:
+                                inside[0] -= 1
+                    finally:
+                        connection.close()
+
+                threads = [threading.Thread(target=worker) for _ in range(6)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                self.assertEqual(peak[0], 1)
+
+    def test_other_tickets_do_not_wait(self):
+        with ticket_lock(self.rp.id, "t1", wait=0):
+            with ticket_lock(self.rp.id, "t2", wait=0):
+                pass
+        with ticket_lock(self.rp.id, "t1", wait=0), self.assertRaises(TicketLockTimeout):
+            with ticket_lock(self.rp.id, "t1", wait=0.1):
+                pass
+
+    def test_expired_lease_is_taken_over(self):
+        with ticket_lock(self.rp.id, "t1", ttl=0):
+            with ticket_lock(self.rp.id, "t1", wait=1):   # the holder "crashed": its lease already ran out
+                pass
+
+
+class CloseRaceTests(StandInMixin, TransactionTestCase):
+    """Parallel staff + member closes of the same tickets: each is charged and posted to POS once."""
+
+    TICKETS, RACERS = 3, 4
+    LOCATION = "close-race"
+
+    def setUp(self):
+        super().setUp()
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        # the fake POS is only defined when core.omnivore is imported in fake mode, so load a
+        # fake-mode copy on its own store and point the close views at it
+        with mock.patch.dict(os.environ, {"OMNIVORE_FAKE": "1", "OMNIVORE_FAKE_STORE": str(Path(store.name) / "pos.json")}):
+            spec = importlib.util.spec_from_file_location("core._omnivore_fake", omnivore.__file__)
+            self.pos = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self.pos)
+        patches = [(omnivore, "IS_FAKE", True)]
+        for view in (views_home, views_staff):
+            patches += [(view, name, getattr(self.pos, name)) for name in dir(view)
+                        if getattr(getattr(view, name), "__module__", None) == omnivore.__name__]
+        for target, name, value in patches:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.rp = make_restaurant(omnivore_location_id=self.LOCATION, stripe_account_id="acct_race", is_active=True)
+        self.staff_user = User.objects.create_user(username="race-staff")
+        self.fixtures = []
+        for i in range(self.TICKETS):
+            cp = make_customer(f"race-{i}")
+            cp.stripe_customer_id, cp.default_payment_method = f"cus_race{i}", "pm_card_visa"
+            cp.save()
+            member = Member.objects.create(number=f"R{i}", last_name="Race", customer=cp)
+            ticket = self.pos.create_ticket(self.LOCATION, employee="100", revenue_center="1", order_type="2")
+            self.pos.add_items(self.LOCATION, ticket["id"], items=[{"menu_item": "101", "quantity": 1},
+                                                                   {"menu_item": "200", "quantity": 2}])
+            TicketLink.objects.create(member=member, restaurant=self.rp, ticket_id=ticket["id"],
+                                      ticket_number=str(ticket["ticket_number"]), status="open")
+            self.fixtures.append((ticket["id"], member.number, cp.user))
+
+    def test_parallel_closes_charge_and_post_once(self):
+        jobs = [(ticket_id, number, user, "staff" if (i + r) % 2 == 0 else "member")
+                for i, (ticket_id, number, user) in enumerate(self.fixtures) for r in range(self.RACERS)]
+        barrier = threading.Barrier(len(jobs))
+        results = []
+
+        def fire(ticket_id, number, user, kind):
+            client = Client(raise_request_exception=False)
+            client.force_login(self.staff_user if kind == "staff" else user)
+            if kind == "staff":
+                url, body = reverse("core:staff_close_ticket"), {"ticket_id": ticket_id, "reference": "race"}
+            else:
+                url, body = reverse("core:member_close_tab", args=[number]), {"tip_cents": 0, "reference": "race"}
+            try:
+                barrier.wait(timeout=30)
+                results.append((ticket_id, client.post(url, body, content_type="application/json").status_code))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=fire, args=job) for job in jobs]
+        # the close steps after the charge (line items, rollups, search index) only log their
+        # failures, e.g. "database is locked" between the racing writers
+        with self.assertNoLogs(level="ERROR"):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(len(results), len(jobs))
+        for ticket_id, _number, _user in self.fixtures:
+            with self.subTest(ticket_id):
+                wins = [status for tid, status in results if tid == ticket_id and status == 200]
+                charges = [pi for pi in self.stripe.payment_intents(ticket_id=ticket_id) if pi["status"] == "succeeded"]
+                self.assertEqual(len(wins), 1)
+                self.assertEqual(len(charges), 1)
+                self.assertEqual(len(self.pos.get_ticket_payments(self.LOCATION, ticket_id)), 1)
+                self.assertFalse(TicketLink.objects.filter(ticket_id=ticket_id, status="open").exists())
+
+
+class AnalyticsCacheTests(FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.rp = make_restaurant()
+        self.links = make_closed(self.rp, 8)
+        sync_line_items(self.links)
+
+    def _tickets(self, rows):
+        return sum(r["num_all_tickets"] for r in rows)
+
+    def test_late_commit_with_earlier_closed_at_is_seen(self):
+        before = analytics.menu_item_ratings(self.rp, backend="scan")
+        # another worker's close commits now with a closed_at under the current max, and its
+        # generation bump went to that worker's own cache
+        last = self.links[-1]
+        sync_line_items([TicketLink.objects.create(
+            member=last.member, restaurant=self.rp, ticket_id="late", status="closed",
+            closed_at=last.closed_at - timedelta(minutes=1), items_json=ITEMS[0],
+        )])
+        after = analytics.menu_item_ratings(self.rp, backend="scan")
+        self.assertEqual(self._tickets(after), self._tickets(before) + 1)
+
+    def test_review_change_and_close_invalidate(self):
+        before = analytics.staff_ratings(self.rp, backend="scan")
+        self.assertEqual(analytics.staff_ratings(self.rp, backend="scan"), before)   # served from cache
+        Review.objects.filter(ticket_link=self.links[0]).update(stars=5)   # no signal, no updated_at bump
+        self.assertEqual(analytics.staff_ratings(self.rp, backend="scan"), before)
+        Review.objects.get(ticket_link=self.links[0]).save()
+        changed = analytics.staff_ratings(self.rp, backend="scan")
+        self.assertNotEqual(changed, before)
+
+        analytics.compute_menu_items(self.rp, backend="rollups")   # rollups caught up
+        gen = analytics_cache.generation(self.rp.id)
+        record_close(self.links[:1])   # nothing new to fold, still a new generation
+        self.assertEqual(analytics_cache.generation(self.rp.id), gen + 1)
+
+    def test_invalidate_is_per_restaurant(self):
+        other = make_restaurant("Other")
+        gens = analytics_cache.generation(self.rp.id), analytics_cache.generation(other.id)
+        analytics_cache.invalidate(self.rp.id)
+        self.assertEqual((analytics_cache.generation(self.rp.id), analytics_cache.generation(other.id)),
+                         (gens[0] + 1, gens[1]))
+
+
+class TempMediaMixin:
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class ExportJobAccessTests(TempMediaMixin, FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, op = make_owner()
+        self.rp = make_restaurant(owner=op)
+        make_closed(self.rp, 4)
+        self.client.force_login(self.user)
+
+    def finished(self, user, scope):
+        return export_jobs.run_job(export_jobs.enqueue(self.rp, user, scope, {"format": "csv"}))
+
+    def fetch(self, scope, job):
+        resp = self.client.get(reverse(f"core:{scope}_export_download", args=[job.id]))
+        if resp.status_code == 200:
+            self.assertTrue(b"".join(resp.streaming_content))  # the test client closes the file once consumed
+        status = self.client.get(reverse(f"core:{scope}_api_export_status", args=[job.id])).status_code
+        return resp.status_code, status
+
+    def test_owner_loses_exports_of_a_restaurant_no_longer_owned(self):
+        job = self.finished(self.user, "owner")
+        self.assertEqual(self.fetch("owner", job), (200, 200))
+        Ownership.objects.filter(restaurant=self.rp).delete()
+        self.assertEqual(self.fetch("owner", job), (404, 404))
+
+    def test_reassigned_manager_loses_old_restaurants_exports(self):
+        manager = User.objects.create_user(username="mgr", email="mgr@example.com")
+        mp = ManagerProfile.objects.create(user=manager, phone=f"+1777{next(_phones)}", restaurant=self.rp)
+        job = self.finished(manager, "manager")
+        self.client.force_login(manager)
+        self.assertEqual(self.fetch("manager", job), (200, 200))
+        mp.restaurant = make_restaurant("Elsewhere")
+        mp.save()
+        self.assertEqual(self.fetch("manager", job), (404, 404))
+
+    def test_co_owner_cannot_fetch_someone_elses_job(self):
+        job = self.finished(self.user, "owner")
+        other, op = make_owner("coowner")
+        Ownership.objects.create(owner=op, restaurant=self.rp)
+        self.client.force_login(other)
+        self.assertEqual(self.fetch("owner", job), (404, 404))
+
+
+class ExportMixin(FreshCacheMixin):
+    """An owner's restaurant in a non-UTC zone with varied tax / paid / pos_ref values."""
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.op = make_owner()
+        self.rp = make_restaurant("Main St", time_zone="America/Chicago", owner=self.op)
+        self.links = make_closed(self.rp, 20, rate=False)
+        for i, tl in enumerate(self.links):
+            tl.tax_cents = 80 + 3 * i
+            tl.paid_cents = tl.total_cents + tl.tax_cents + tl.tip_cents + 50 if i % 3 == 0 else 0
+            tl.pos_ref = f"ref-{i}" if i % 2 else ""
+            tl.ticket_number = "" if i == 5 else tl.ticket_number   # falls back to ticket_id
+            tl.save()
+        self.client.force_login(self.user)
+
+    def expected(self, rp=None, start=None, end=None, q=""):
+        """The export's rows built the pre-streaming way: model instances, local days, q on ticket / member."""
+        rp = rp or self.rp
+        tz, rows = restaurant_tz(rp), []
+        for tl in TicketLink.objects.filter(restaurant=rp, status="closed").select_related("member").order_by("closed_at"):
+            day = local_day(tl.closed_at, tz)
+            if (start and day < start) or (end and day > end):
+                continue
+            ticket, member = tl.ticket_number or tl.ticket_id, tl.member.number if tl.member else ""
+            if q and q not in f"{ticket} {member}".lower():
+                continue
+            subtotal, tax, tip = tl.total_cents or 0, tl.tax_cents or 0, tl.tip_cents or 0
+            rows.append([tl.closed_at.strftime("%Y-%m-%d %H:%M"), ticket, member, tl.server_name or "",
+                         subtotal, tax, tip, tl.paid_cents or subtotal + tax + tip, tl.pos_ref or ""])
+        return rows
+
+    @staticmethod
+    def csv_rows(rows):
+        """expected() rows as the CSV lines, Grand total included."""
+        out = [exports.HEADERS]
+        out += [[*r[:4], *(f"{c / 100:.2f}" for c in r[4:8]), r[8]] for r in rows]
+        out.append(["", "", "", "", "", "", "Grand total", f"{sum(r[7] for r in rows) / 100:.2f}", ""])
+        return out
+
+    def download(self, name, **params):
+        resp = self.client.get(reverse(f"core:{name}"), params)
+        self.assertEqual(resp.status_code, 200)
+        return resp, b"".join(resp.streaming_content)
+
+
+class CsvExportTests(ExportMixin, TestCase):
+    def test_streams_the_same_rows_as_the_model_walk(self):
+        start, end = BASE.date() + timedelta(days=1), BASE.date() + timedelta(days=4)
+        for params, kwargs in (({}, {}), ({"start": start.isoformat(), "end": end.isoformat()}, {"start": start, "end": end}),
+                               ({"q": "M1-1"}, {"q": "m1-1"}), ({"q": "t1-5"}, {"q": "t1-5"})):
+            with self.subTest(params=params):
+                resp, body = self.download("owner_export", format="csv", **params)
+                self.assertTrue(resp.streaming)
+                self.assertEqual(resp["Content-Type"], "text/csv; charset=utf-8")
+                expected = self.expected(**kwargs)
+                self.assertTrue(expected)
+                self.assertEqual(list(csv.reader(io.StringIO(body.decode()))), self.csv_rows(expected))
+
+    def test_manager_export_matches_the_owners(self):
+        manager = User.objects.create_user(username="mgr", email="mgr@example.com")
+        ManagerProfile.objects.create(user=manager, phone=f"+1777{next(_phones)}", restaurant=self.rp)
+        _, owner_body = self.download("owner_export", format="csv")
+        self.client.force_login(manager)
+        _, manager_body = self.download("manager_export", format="csv")
+        self.assertEqual(manager_body, owner_body)
+
+
+class XlsxExportTests(ExportMixin, TestCase):
+    @staticmethod
+    def legacy_workbook(rows):
+        """The sheet the in-memory export used to build, cell by cell."""
+        from openpyxl import Workbook
+        from openpyxl.styles import Font
+        wb = Workbook()
+        ws = wb.active
+        ws.title = "Closed"
+        ws.append(exports.HEADERS)
+        for c in ws[1]:
+            c.font = Font(bold=True)
+        for r in rows:
+            ws.append([*r[:4], *(c / 100.0 for c in r[4:8]), r[8]])
+        for row in ws.iter_rows(min_row=2, min_col=5, max_col=8):
+            for cell in row:
+                cell.number_format = exports.CURRENCY_FMT
+        for i, w in enumerate(exports.WIDTHS, start=1):
+            ws.column_dimensions[chr(64 + i)].width = w
+        total_row = len(rows) + 2
+        ws.cell(row=total_row, column=7, value="Grand total").font = Font(bold=True)
+        ws.cell(row=total_row, column=8, value=f"=SUM(H2:H{total_row - 1})").number_format = exports.CURRENCY_FMT
+        ws.cell(row=total_row, column=8).font = Font(bold=True)
+        return wb
+
+    @staticmethod
+    def layout(data):
+        """(cells as (value, number_format, bold) rows, column widths) of an xlsx file's "Closed" sheet."""
+        from openpyxl import load_workbook
+        if not isinstance(data, bytes):
+            buf = io.BytesIO()
+            data.save(buf)
+            data = buf.getvalue()
+        ws = load_workbook(io.BytesIO(data))["Closed"]
+        cells = [[(c.value, c.number_format, bool(c.font.b)) for c in row] for row in ws.iter_rows()]
+        widths = {k: d.width for k, d in ws.column_dimensions.items() if d.width}
+        return cells, widths
+
+    def test_write_only_sheet_matches_the_old_layout(self):
+        start, end = BASE.date() + timedelta(days=1), BASE.date() + timedelta(days=4)
+        for params, kwargs in (({}, {}), ({"start": start.isoformat(), "end": end.isoformat()}, {"start": start, "end": end})):
+            with self.subTest(params=params):
+                resp, body = self.download("owner_export", **params)
+                self.assertEqual(resp["Content-Type"], exports.XLSX_CONTENT_TYPE)
+                cells, widths = self.layout(body)
+                old_cells, old_widths = self.layout(self.legacy_workbook(self.expected(**kwargs)))
+                # the old sheet padded the Grand total row with blank cells; compare the written ones
+                self.assertEqual([[c for c in row if c[0] is not None] for row in cells],
+                                 [[c for c in row if c[0] is not None] for row in old_cells])
+                self.assertEqual([[c for c in row if c[0] is not None] for row in cells][-1][-1],
+                                 (f"=SUM(H2:H{len(cells) - 1})", exports.CURRENCY_FMT, True))
+                self.assertEqual(widths, old_widths)
+
+
+class ExportJobFileTests(TempMediaMixin, ExportMixin, TestCase):
+    def enqueue(self, **params):
+        resp = self.client.post(reverse("core:owner_api_export_enqueue"), json.dumps(params),
+                                content_type="application/json")
+        self.assertEqual(resp.status_code, 202)
+        return resp.json()["job"]
+
+    def download_url(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return resp, b"".join(resp.streaming_content)
+
+    def test_job_file_matches_the_synchronous_export(self):
+        params = {"start": (BASE.date() + timedelta(days=1)).isoformat(), "end": (BASE.date() + timedelta(days=4)).isoformat()}
+        for fmt in ("csv", "xlsx"):
+            with self.subTest(fmt):
+                job = self.enqueue(format=fmt, **params)
+                self.assertEqual(self.enqueue(format=fmt, **params)["id"], job["id"])   # same job while in flight
+                call_command("run_export_jobs", once=True, stdout=StringIO())
+                status = self.client.get(reverse("core:owner_api_export_status", args=[job["id"]])).json()["job"]
+                self.assertEqual(status["status"], "done")
+                self.assertEqual(status["rows"], len(self.expected(start=BASE.date() + timedelta(days=1),
+                                                                   end=BASE.date() + timedelta(days=4))))
+                _, from_job = self.download_url(status["download_url"])
+                _, direct = self.download("owner_export", format=fmt, **params)
+                if fmt == "csv":
+                    self.assertEqual(from_job, direct)
+                else:   # zip timestamps differ between two saves; the sheets must not
+                    self.assertEqual(XlsxExportTests.layout(from_job), XlsxExportTests.layout(direct))
+
+    def test_cleanup_removes_expired_files(self):
+        job = export_jobs.run_job(export_jobs.enqueue(self.rp, self.user, "owner", {"format": "csv"}))
+        storage, name = job.file.storage, job.file.name
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(export_jobs.cleanup(), (0, 0))
+        self.assertEqual(export_jobs.cleanup(job.expires_at + timedelta(seconds=1)), (1, 0))
+        self.assertFalse(storage.exists(name))
+
+
+@skipUnless(columnar.HAS_PYARROW, "pyarrow is not installed")
+class ColumnarExportTests(ExportMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        sync_line_items(self.links)
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+
+    def read(self, table, fmt="parquet"):
+        import pyarrow.dataset as ds
+        data = ds.dataset(f"{self.root}/{table}", format="ipc" if fmt == "arrow" else fmt, partitioning="hive")
+        return sorted(data.to_table().to_pylist(), key=lambda r: (r["closed_at"], r["ticket_link_id"]))
+
+    def test_tickets_and_line_items_round_trip(self):
+        stats = columnar.export_restaurant(self.rp, self.root, batch=7)
+        self.assertEqual((stats["tickets"], stats["line_items"]), (20, TicketLineItem.objects.count()))
+        tickets = self.read("tickets")
+        self.assertEqual(
+            [[r["closed_at"].strftime("%Y-%m-%d %H:%M"), r["ticket_number"] or r["ticket_id"], r["member"], r["server"],
+              r["subtotal_cents"], r["tax_cents"], r["tip_cents"], r["total_cents"], r["pos_ref"]] for r in tickets],
+            self.expected(),
+        )
+        tz = restaurant_tz(self.rp)
+        self.assertEqual({(r["restaurant_id"], r["month"]) for r in tickets},
+                         {(self.rp.id, local_day(tl.closed_at, tz).strftime("%Y-%m")) for tl in self.links})
+        items = [(r["ticket_link_id"], r["name_norm"], r["qty"], r["unit_cents"], r["line_cents"]) for r in self.read("line_items")]
+        self.assertEqual(sorted(items), sorted(TicketLineItem.objects.values_list(
+            "ticket_link_id", "name_norm", "qty", "unit_cents", "line_cents")))
+
+    def test_incremental_runs_append_only_new_tickets(self):
+        columnar.export_restaurant(self.rp, self.root, fmt="arrow")
+        later = make_closed(self.rp, 5, start=20, every=timedelta(days=3), rate=False)   # into later months
+        sync_line_items(later)
+        self.assertEqual(columnar.export_restaurant(self.rp, self.root, fmt="arrow")["tickets"], 5)
+        self.assertEqual(columnar.export_restaurant(self.rp, self.root, fmt="arrow")["tickets"], 0)
+        ids = [r["ticket_link_id"] for r in self.read("tickets", "arrow")]
+        self.assertEqual(sorted(ids), sorted(TicketLink.objects.values_list("id", flat=True)))
+        with self.assertRaises(ValueError):   # switching format needs a full re-export
+            columnar.export_restaurant(self.rp, self.root, fmt="parquet")
+        self.assertEqual(columnar.export_restaurant(self.rp, self.root, fmt="parquet", full=True)["tickets"], 25)
+        self.assertEqual(len(self.read("tickets")), 25)
+
+
+class PortfolioExportTests(ExportMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tokyo = make_restaurant("Tokyo", time_zone="Asia/Tokyo", owner=self.op)
+        make_closed(self.tokyo, 10, every=timedelta(hours=5))
+        self.empty = make_restaurant("Empty", owner=self.op)
+        _, other = make_owner("other")
+        make_closed(make_restaurant("Not Mine", owner=other), 3)
+        self.mine = [self.rp, self.tokyo, self.empty]
+
+    def expected_csv(self, start=None, end=None):
+        out, grand = [exports.PORTFOLIO_HEADERS], [0] * 5
+        for rp in sorted(self.mine, key=lambda r: r.id):
+            rows = self.expected(rp, start, end)
+            name = exports.restaurant_name(rp)
+            out += [[name, *line] for line in self.csv_rows(rows)[1:-1]]
+            sums = [len(rows), *(sum(r[i] for r in rows) for i in range(4, 8))]
+            grand = [g + v for g, v in zip(grand, sums)]
+            out.append([name, "Subtotal", f"{sums[0]} tickets", "", "", *(f"{c / 100:.2f}" for c in sums[1:]), ""])
+        out.append(["All restaurants", "Grand total", f"{grand[0]} tickets", "", "",
+                    *(f"{c / 100:.2f}" for c in grand[1:]), ""])
+        return out, grand
+
+    def test_csv_has_every_restaurant_with_subtotals(self):
+        start, end = BASE.date() + timedelta(days=1), BASE.date() + timedelta(days=2)
+        for params, kwargs in (({}, {}), ({"start": start.isoformat(), "end": end.isoformat()}, {"start": start, "end": end})):
+            with self.subTest(params=params):
+                _, body = self.download("owner_portfolio_export", format="csv", **params)
+                expected, _ = self.expected_csv(**kwargs)
+                self.assertEqual(list(csv.reader(io.StringIO(body.decode()))), expected)
+
+    def test_summary_is_one_ticket_query(self):
+        _, grand = self.expected_csv()
+        self.client.get(reverse("core:owner_api_portfolio_summary"))   # resolve and cache the role context
+        with CaptureQueriesContext(connection) as queries:
+            summary = self.client.get(reverse("core:owner_api_portfolio_summary")).json()
+        self.assertEqual(len([q for q in queries if '"core_ticketlink"' in q["sql"]]), 1)
+        self.assertEqual([r["restaurant_id"] for r in summary["restaurants"]], sorted(r.id for r in self.mine))
+        self.assertEqual(list(summary["totals"].values()), grand)
+
+
+class RecentPageTests(FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user, op = make_owner()
+        self.rp = make_restaurant(owner=op)
+        self.links = make_closed(self.rp, 30, every=timedelta(days=1))
+        TicketLink.objects.filter(id__in=[tl.id for tl in self.links[10:14]]).update(closed_at=BASE)   # ties
+        TicketLink.objects.create(member=self.links[0].member, restaurant=self.rp, ticket_id="open-1", status="open")
+        self.client.force_login(self.user)
+
+    def walk(self, limit, **params):
+        ids, cursor, pages = [], None, 0
+        while True:
+            resp = self.client.get(reverse("core:owner_api_state_recent"),
+                                   {"limit": limit, **params, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(resp.status_code, 200)
+            page = resp.json()
+            self.assertLessEqual(len(page["recent"]), limit)
+            ids += [r["ticket_link_id"] for r in page["recent"]]
+            pages += 1
+            cursor = page["next_cursor"]
+            if not cursor:
+                return ids, pages
+
+    def test_pages_cover_every_closed_ticket_once_newest_first(self):
+        ids, pages = self.walk(7)
+        expected = list(TicketLink.objects.filter(restaurant=self.rp, status="closed")
+                        .order_by("-closed_at", "-id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 5)
+
+    def test_search_reaches_the_oldest_tickets(self):
+        # members M<id>-2 and M<id>-20..29: an early ticket past the newest pages, and ten recent ones
+        ids, _ = self.walk(4, q=f"m{self.rp.id}-2")
+        self.assertEqual(sorted(ids), sorted(tl.id for tl in self.links if tl.member.number.startswith(f"M{self.rp.id}-2")))
+        ids, _ = self.walk(50, q="1003")
+        self.assertEqual(ids, [self.links[3].id])
+
+    def test_bad_cursor_is_refused(self):
+        resp = self.client.get(reverse("core:owner_api_state_recent"), {"cursor": "not-a-cursor"})
+        self.assertEqual(resp.status_code, 400)
+
+
+class DashboardSectionTests(FreshCacheMixin, TestCase):
+    """people / open are cached per restaurant until their own generation moves."""
+
+    def setUp(self):
+        super().setUp()
+        self.user, op = make_owner()
+        self.rp = make_restaurant(owner=op)   # no POS location: open uses the stored totals
+        self.closed = make_closed(self.rp, 2, rate=False)
+        self.open = TicketLink.objects.create(member=self.closed[0].member, restaurant=self.rp,
+                                              ticket_id="open-1", status="open", last_total_cents=900)
+        self.client.force_login(self.user)
+        self.computed = Counter()
+        for name in ("compute_people", "compute_open"):
+            real = getattr(dashboard_state, name)
+            patcher = mock.patch.object(dashboard_state, name, side_effect=self.counting(name, real))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def counting(self, name, real):
+        def compute(rp):
+            self.computed[name] += 1
+            return real(rp)
+        return compute
+
+    def get(self, section, **params):
+        resp = self.client.get(reverse(f"core:owner_api_state_{section}"), params)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def assertComputed(self, people, open_):
+        self.assertEqual((self.computed["compute_people"], self.computed["compute_open"]), (people, open_))
+
+    def test_sections_are_cached_until_their_generation_moves(self):
+        self.get("people"), self.get("people")
+        self.assertEqual(self.get("open")["open"][0]["due_cents"], 900)
+        self.get("open")
+        self.assertComputed(1, 1)
+
+        # a new staff member drops people only
+        u = User.objects.create_user(username="staff", email="staff@example.com")
+        StaffProfile.objects.create(user=u, phone=f"+1777{next(_phones)}", restaurant=self.rp)
+        self.assertEqual([s["id"] for s in self.get("people")["staff"]], [u.staff_profile.id])
+        self.get("open")
+        self.assertComputed(2, 1)
+
+        # a close and a review drop open only
+        self.open.status, self.open.closed_at = "closed", BASE + timedelta(days=3)
+        self.open.save()
+        record_close([self.open])
+        self.assertEqual(self.get("open")["open"], [])
+        self.get("people")
+        self.assertComputed(2, 2)
+        Review.objects.create(restaurant=self.rp, ticket_link=self.closed[1], member=self.closed[1].member, stars=4)
+        self.get("open"), self.get("people")
+        self.assertComputed(2, 3)
+
+    def test_refresh_bypasses_the_cache(self):
+        self.get("people"), self.get("open")
+        self.get("people", refresh="1"), self.get("open", refresh="1")
+        self.assertComputed(2, 2)
+        self.get("people"), self.get("open")   # the refreshed values are cached again
+        self.assertComputed(2, 2)
+
+    def test_sections_are_per_restaurant(self):
+        other = make_restaurant("Other")
+        dashboard_state.people(self.rp), dashboard_state.open_tickets(self.rp)
+        dashboard_state.people(other), dashboard_state.open_tickets(other)
+        dashboard_state.invalidate_people(other.id)
+        analytics_cache.invalidate(other.id)
+        dashboard_state.people(self.rp), dashboard_state.open_tickets(self.rp)
+        self.assertComputed(2, 2)
+
+
+class PosFanoutTests(FreshCacheMixin, TestCase):
+    """fetch_live / fetch_one against a patched POS: one fast ticket, one past the deadline, one failing."""
+
+    def setUp(self):
+        super().setUp()
+        self.rp = make_restaurant(omnivore_location_id="loc-1")
+        customer = make_customer()
+        for tid in ("fast", "slow", "bad"):
+            TicketLink.objects.create(
+                member=Member.objects.create(number=f"M-{tid}", customer=customer), restaurant=self.rp,
+                ticket_id=tid, status="open", opened_at=BASE,
+                items_json=[{"name": "Burger", "quantity": 1, "price_cents": 1200}], tax_cents=100,
+            )
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)   # let the pool thread stuck on "slow" finish
+        for name, fake in (("get_ticket", self.fake_ticket), ("get_ticket_items", self.fake_items)):
+            patcher = mock.patch.object(pos_fanout, name, side_effect=fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_ticket(self, location_id, tid):
+        if tid == "slow":
+            self.release.wait(5)
+        if tid == "bad":
+            raise RuntimeError("POS 502")
+        return {"id": tid, "totals": {"tax": 80}}
+
+    def fake_items(self, location_id, tid):
+        return [{"name": "Burger", "quantity": 2, "price": 500}]
+
+    def test_slow_and_failing_tickets_are_dropped(self):
+        started = time.monotonic()
+        live = pos_fanout.fetch_live("loc-1", ["fast", "slow", "bad", "fast"], deadline=0.3)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(set(live), {"fast"})
+        self.assertEqual(live["fast"], ({"id": "fast", "totals": {"tax": 80}}, [{"name": "Burger", "quantity": 2, "price": 500}]))
+
+    def test_fetch_one(self):
+        self.assertEqual(pos_fanout.fetch_one("loc-1", "fast", deadline=0.3)[0]["id"], "fast")
+        self.assertIsNone(pos_fanout.fetch_one("loc-1", "bad", deadline=0.3))
+        self.assertIsNone(pos_fanout.fetch_one("loc-1", "slow", deadline=0.3))
+        self.assertEqual(pos_fanout.fetch_live("", ["fast"]), {})
+
+    def test_open_tickets_fall_back_to_stored_totals(self):
+        with mock.patch.object(pos_fanout, "POS_FANOUT_DEADLINE", 0.3):
+            state = dashboard_state.open_tickets(self.rp)
+        self.assertEqual(state["pos"], {"live": 1, "stale": 2})
+        due = {e["ticket_id"]: (e["live"], e["due_cents"]) for e in state["open"]}
+        self.assertEqual(due, {"fast": (True, 1080), "slow": (False, 1300), "bad": (False, 1300)})
+
+
+class TicketSearchTests(FreshCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        if not ticket_search.available():
+            self.skipTest("SQLite without FTS5")
+        self.user, op = make_owner()
+        self.rp = make_restaurant(owner=op)
+        self.links = make_closed(self.rp, 24)
+        sync_line_items(self.links)
+        ticket_search.rebuild(self.rp.id)
+        other = make_restaurant("Other")
+        make_closed(other, 6)
+        ticket_search.rebuild(other.id)
+
+    def ids(self, q, **kw):
+        return {r["ticket_link_id"] for r in ticket_search.search(self.rp, q, **kw)["results"]}
+
+    def matching(self, *words):
+        """Tickets where every word prefixes a word of the last name, server or an item name."""
+        def tokens(tl):
+            text = " ".join([tl.member.last_name, tl.server_name, *(r["name"] for r in tl.items_json)])
+            return text.lower().split()
+        return {tl.id for tl in self.links if all(any(t.startswith(w) for t in tokens(tl)) for w in words)}
+
+    def test_every_term_is_a_prefix_match(self):
+        for q in ("lee burg", "Carol", "wine ng", "BURGER alice"):
+            with self.subTest(q):
+                words = q.lower().split()
+                self.assertTrue(self.matching(*words))
+                self.assertEqual(self.ids(q), self.matching(*words))
+
+    def test_fallback_finds_the_same_tickets(self):
+        fts = {q: self.ids(q) for q in ("lee burg", "carol", "1007")}
+        with mock.patch.object(ticket_search, "_available", False):
+            self.assertEqual(ticket_search.search(self.rp, "carol")["backend"], "fallback")
+            self.assertEqual({q: self.ids(q) for q in fts}, fts)
+
+    def test_numbers_rank_above_names_and_pages_continue(self):
+        self.links[2].server_name = "1007"
+        self.links[2].save()
+        ticket_search.index_tickets([self.links[2]])   # as at close
+        self.assertEqual([r["ticket_link_id"] for r in ticket_search.search(self.rp, "1007")["results"]],
+                         [self.links[7].id, self.links[2].id])
+        first = ticket_search.search(self.rp, "burger", limit=5)
+        second = ticket_search.search(self.rp, "burger", page=first["next_page"], limit=5)
+        self.assertEqual(first["next_page"], 2)
+        seen = [r["ticket_link_id"] for r in first["results"] + second["results"]]
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_query_syntax_is_plain_text(self):
+        for q in ('burger OR "', "server:alice", "NEAR(lee", "*"):
+            with self.subTest(q):
+                ticket_search.search(self.rp, q)   # no OperationalError from FTS5 syntax
+
+    def test_endpoint(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse("core:owner_api_ticket_search"), {"q": "lee burg"}).json()
+        self.assertEqual({r["ticket_link_id"] for r in resp["results"]}, self.matching("lee", "burg"))
+        self.assertEqual(resp["backend"], "fts5")
+
+
+class RoleContextTests(FreshCacheMixin, TestCase):
+    """With a shared (file-based) ROLE_CTX_CACHE, as a multi-worker deploy must have."""
+
+    def setUp(self):
+        super().setUp()
+        shared = tempfile.TemporaryDirectory()
+        self.addCleanup(shared.cleanup)
+        override = override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "rolectx": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": shared.name},
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        alias = mock.patch.object(role_context, "CACHE_ALIAS", "rolectx")
+        alias.start()
+        self.addCleanup(alias.stop)
+        self.user, self.op = make_owner()
+        self.rp = make_restaurant("First", owner=self.op)
+
+    def request(self, user=None, session=None):
+        req = RequestFactory().get("/")
+        req.user = user or self.user
+        if session is None:
+            session = SessionStore()
+            session.create()
+        req.session = session
+        return req
+
+    def ctx(self, req):
+        return role_context.for_request(req)
+
+    def test_resolved_once_then_free(self):
+        req = self.request()
+        first = self.ctx(req)
+        with self.assertNumQueries(0):
+            again = self.ctx(req)
+        self.assertEqual((again.role, [r.id for r in again.restaurants]), ("owner", [self.rp.id]))
+        self.assertEqual(first.restaurant.id, again.restaurant.id)
+
+    def test_ownership_changes_reach_every_session(self):
+        sessions = [self.request(), self.request()]
+        for req in sessions:
+            self.ctx(req)
+        second = make_restaurant("Second", owner=self.op)
+        for req in sessions:
+            self.assertEqual([r.id for r in self.ctx(req).restaurants], [self.rp.id, second.id])
+        Ownership.objects.filter(restaurant=self.rp).delete()
+        for req in sessions:
+            self.assertIsNone(self.ctx(req).owns(self.rp.id))
+
+    def test_manager_reassignment_and_restaurant_edits(self):
+        manager = User.objects.create_user(username="mgr", email="mgr@example.com")
+        mp = ManagerProfile.objects.create(user=manager, phone=f"+1777{next(_phones)}", restaurant=self.rp)
+        req = self.request(manager)
+        self.assertEqual(self.ctx(req).manager_restaurant.id, self.rp.id)
+        mp.restaurant = make_restaurant("Elsewhere")
+        mp.save()
+        self.assertEqual(self.ctx(req).manager_restaurant.dba_name, "Elsewhere")
+        mp.restaurant.dba_name = "Renamed"
+        mp.restaurant.save()
+        self.assertEqual(self.ctx(req).manager_restaurant.dba_name, "Renamed")
+        mp.delete()
+        self.assertIsNone(self.ctx(req).role)
+
+    def test_switching_restaurant_keys_the_context(self):
+        second = make_restaurant("Second", owner=self.op)
+        req = self.request()
+        self.assertEqual(self.ctx(req).restaurant.id, self.rp.id)
+        req.session["current_restaurant_id"] = second.id
+        self.assertEqual(self.ctx(req).restaurant.id, second.id)
+
+    def test_restaurant_edit_drops_only_its_members(self):
+        other_user, other_op = make_owner("other")
+        other_rp = make_restaurant("Other", owner=other_op)
+        mine, theirs = self.request(), self.request(other_user)
+        self.ctx(mine), self.ctx(theirs)
+        self.rp.dba_name = "First & Co"
+        self.rp.save()
+        self.assertEqual(self.ctx(mine).restaurant.dba_name, "First & Co")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ctx(theirs).restaurant.id, other_rp.id)
+
+
+class LocalRoleCacheTests(FreshCacheMixin, TestCase):
+    """The default process-local cache can't carry invalidations between workers: no caching."""
+
+    def test_every_request_resolves_and_revocation_is_immediate(self):
+        user, op = make_owner()
+        rp = make_restaurant(owner=op)
+        req = RequestFactory().get("/")
+        req.user, req.session = user, SessionStore()
+        with mock.patch.object(role_context, "_warned_local", False), \
+                self.assertLogs("core.role_context", "WARNING"):
+            self.assertIsNotNone(role_context.for_request(req).owns(rp.id))
+        with CaptureQueriesContext(connection) as queries:
+            role_context.for_request(req)
+        self.assertTrue(queries.captured_queries)
+        # a write on "another worker": nothing reaches this process's cache, yet access is gone
+        with mock.patch.object(role_context, "invalidate_user"):
+            Ownership.objects.filter(restaurant=rp).delete()
+        self.assertIsNone(role_context.for_request(req).owns(rp.id))
@@ -0,0 +1,176 @@
+# core/ticket_search.py
+"""
+Full-text search over closed tickets: ticket number, member number, member last
+name, server name and the item names in items_json.
+
+On SQLite the documents live in an FTS5 table (core_ticketsearch, rowid =
+TicketLink id, created by migration 0040) and results are ranked by bm25 with
+ticket and member numbers weighted above names. Every term is a prefix match,
+and all terms must match: "smi burg" finds Smith's burger tickets. Where FTS5
+isn't available (another database backend, or SQLite built without it) search()
+falls back to icontains over TicketLink / Member / TicketLineItem, newest first.
+
+  index_tickets(links)    (re)index closed TicketLinks; called at close
+  rebuild(restaurant_id)  reindex everything (manage.py rebuild_ticket_search)
+  search(rp, q, page, limit)
+
+Results are paginated by page number: ranks can't be resumed from a keyset.
+"""
+from __future__ import annotations
+
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import TicketLineItem, TicketLink
+
+TABLE = "core_ticketsearch"
+
+# column weights for bm25(): ticket_number, member, last_name, server, items
+_WEIGHTS = (10.0, 10.0, 4.0, 2.0, 1.0)
+
+_DOC_FIELDS = ("id", "restaurant_id", "ticket_number", "member__number", "member__last_name", "server_name", "items_json")
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+_available = None
+
+
+def available() -> bool:
+    """True when the FTS5 table exists (SQLite with FTS5, migrations applied)."""
+    global _available
+    if _available is None:
+        _available = connection.vendor == "sqlite" and TABLE in connection.introspection.table_names()
+    return _available
+
+
+def terms(q: str) -> list[str]:
+    return _TERM.findall((q or "").lower())[:8]
+
+
+def _match_expr(words) -> str:
+    # quoted so FTS5 operators / column filters typed by the user are plain text
+    return " AND ".join(f'"{w}"*' for w in words)
+
+
+def _item_names(items_json) -> str:
+    names = []
+    for row in items_json or []:
+        if isinstance(row, dict):
+            name = (row.get("name") or row.get("label") or "").strip()
+            if name:
+                names.append(name)
+    return " ".join(names)
+
+
+def _write(rows) -> int:
+    """rows: values_list(*_DOC_FIELDS) tuples. Replaces their documents."""
+    if not rows:
+        return 0
+    docs = [
+        (tl_id, rid, number or "", member or "", last_name or "", server or "", _item_names(items))
+        for tl_id, rid, number, member, last_name, server, items in rows
+    ]
+    with transaction.atomic(), connection.cursor() as c:
+        c.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(d[0],) for d in docs])
+        c.executemany(
+            f"INSERT INTO {TABLE} (rowid, restaurant_id, ticket_number, member, last_name, server, items) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            docs,
+        )
+    return len(docs)
+
+
+def index_tickets(links) -> int:
+    """(Re)index the given TicketLinks that are closed. No-op without FTS5. Returns documents written."""
+    ids = [tl.id for tl in links if tl.status == "closed" and tl.closed_at]
+    if not ids or not available():
+        return 0
+    return _write(list(TicketLink.objects.filter(id__in=ids).values_list(*_DOC_FIELDS)))
+
+
+def rebuild(restaurant_id=None, chunk: int = 2000, progress=None) -> int:
+    """Drop and rewrite the documents (one restaurant's, or all). Returns documents written."""
+    if not available():
+        raise RuntimeError("Ticket search index needs SQLite with FTS5.")
+    with connection.cursor() as c:
+        if restaurant_id:
+            c.execute(f"DELETE FROM {TABLE} WHERE restaurant_id = %s", [restaurant_id])
+        else:
+            c.execute(f"DELETE FROM {TABLE}")
+    qs = TicketLink.objects.filter(status="closed", closed_at__isnull=False)
+    if restaurant_id:
+        qs = qs.filter(restaurant_id=restaurant_id)
+    qs = qs.order_by("id")
+
+    last_id, written = 0, 0
+    while True:
+        batch = list(qs.filter(id__gt=last_id).values_list(*_DOC_FIELDS)[:chunk])
+        if not batch:
+            break
+        written += _write(batch)
+        last_id = batch[-1][0]
+        if progress:
+            progress(last_id, written)
+    if not restaurant_id:
+        with connection.cursor() as c:
+            c.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return written
+
+
+def _fts_ids(rp, words, offset: int, limit: int) -> list[int]:
+    weights = ", ".join(str(w) for w in _WEIGHTS)
+    with connection.cursor() as c:
+        c.execute(
+            f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s AND restaurant_id = %s "
+            f"ORDER BY bm25({TABLE}, 0.0, {weights}), rowid DESC LIMIT %s OFFSET %s",
+            [_match_expr(words), rp.id, limit, offset],
+        )
+        return [r[0] for r in c.fetchall()]
+
+
+def _fallback_ids(rp, words, offset: int, limit: int) -> list[int]:
+    qs = TicketLink.objects.filter(restaurant=rp, status="closed", closed_at__isnull=False)
+    for w in words:
+        items = TicketLineItem.objects.filter(restaurant=rp, name_norm__contains=w).values("ticket_link_id")
+        qs = qs.filter(
+            Q(ticket_number__icontains=w) | Q(member__number__icontains=w) | Q(member__last_name__icontains=w)
+            | Q(server_name__icontains=w) | Q(id__in=items)
+        )
+    return list(qs.order_by("-closed_at", "-id").values_list("id", flat=True)[offset:offset + limit])
+
+
+def search(rp, q: str, page: int = 1, limit: int = 50) -> dict:
+    """
+    {"results": [...], "page", "next_page", "backend"}; results are recent-orders style
+    rows in rank order (newest first on the fallback).
+    """
+    words = terms(q)
+    page = max(1, int(page or 1))
+    backend = "fts5" if available() else "fallback"
+    if not words:
+        return {"results": [], "page": page, "next_page": None, "backend": backend}
+
+    offset = (page - 1) * limit
+    ids = (_fts_ids if backend == "fts5" else _fallback_ids)(rp, words, offset, limit + 1)
+    more = len(ids) > limit
+    ids = ids[:limit]
+    # join back for the row data; documents of deleted or reopened tickets drop out here
+    links = TicketLink.objects.select_related("member").filter(id__in=ids, restaurant=rp, status="closed").in_bulk()
+    results = []
+    for tl_id in ids:
+        tl = links.get(tl_id)
+        if tl is None:
+            continue
+        results.append({
+            "ticket_id": tl.ticket_id,
+            "ticket_number": tl.ticket_number or None,
+            "member": tl.member.number if tl.member else "",
+            "last_name": tl.member.last_name if tl.member else "",
+            "server": tl.server_name or "",
+            "closed_at": tl.closed_at.strftime("%Y-%m-%d %H:%M") if tl.closed_at else "",
+            "total_cents": (tl.paid_cents or tl.total_cents or tl.last_total_cents or 0),
+            "ticket_link_id": tl.id,
+        })
+    return {"results": results, "page": page, "next_page": page + 1 if more else None, "backend": backend}
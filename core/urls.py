@@ -46,6 +46,13 @@ urlpatterns = [
     path("auth/reset/finalize", views_auth_reset.reset_finalize, name="auth_reset_finalize"),
 
     path("owner/api/state", views_owner.owner_api_state, name="owner_api_state"),
+
+    path("owner/api/state/people", views_owner.owner_api_state_people, name="owner_api_state_people"),
+
+    path("owner/api/state/open", views_owner.owner_api_state_open, name="owner_api_state_open"),
+
+    path("owner/api/state/recent", views_owner.owner_api_state_recent, name="owner_api_state_recent"),
+    path("owner/api/tickets/search", views_owner.owner_api_ticket_search, name="owner_api_ticket_search"),
     path("owner/api/set-restaurant", views_owner.owner_api_set_restaurant, name="owner_api_set_restaurant"),
     path("owner/api/add-restaurant", views_owner.owner_api_add_restaurant, name="owner_api_add_restaurant"),
     path("owner/api/remove-restaurant", views_owner.owner_api_remove_restaurant, name="owner_api_remove_restaurant"),
@@ -57,6 +64,11 @@ urlpatterns = [
     path("owner/api/ticket/<str:ticket_id>", views_owner.owner_api_ticket_detail, name="owner_api_ticket_detail"),
     path("owner/invite-manager", views_owner.owner_invite_manager, name="owner_invite_manager"),
     path("owner/export", views_owner.owner_export, name="owner_export"),
+    path("owner/export/portfolio", views_owner.owner_portfolio_export, name="owner_portfolio_export"),
+    path("owner/api/portfolio/summary", views_owner.owner_api_portfolio_summary, name="owner_api_portfolio_summary"),
+    path("owner/api/exports", views_owner.owner_api_export_enqueue, name="owner_api_export_enqueue"),
+    path("owner/api/exports/<int:job_id>", views_owner.owner_api_export_status, name="owner_api_export_status"),
+    path("owner/exports/<int:job_id>/download", views_owner.owner_export_download, name="owner_export_download"),
     path("owner/api/remove-staff", views_owner.owner_api_remove_staff, name="owner_api_remove_staff"),
     path("owner/invite-staff",     views_owner.owner_invite_staff,     name="owner_invite_staff"),
 
@@ -76,9 +88,14 @@ urlpatterns = [
     path("manager/accept", views.manager_accept, name="manager_accept"),
     path("manager/dashboard/", views_manager.manager_dashboard, name="manager_dashboard"),
     path("manager/api/state", views_manager.manager_api_state, name="manager_api_state"),
+    path("manager/api/recent", views_manager.manager_api_recent, name="manager_api_recent"),
+    path("manager/api/tickets/search", views_manager.manager_api_ticket_search, name="manager_api_ticket_search"),
     path("manager/api/staff/remove", views_manager.manager_api_remove_staff, name="manager_api_remove_staff"),
     path("manager/api/ticket/<str:ticket_id>", views_manager.manager_api_ticket_detail, name="manager_api_ticket_detail"),
     path("manager/export", views_manager.manager_export, name="manager_export"),
+    path("manager/api/exports", views_manager.manager_api_export_enqueue, name="manager_api_export_enqueue"),
+    path("manager/api/exports/<int:job_id>", views_manager.manager_api_export_status, name="manager_api_export_status"),
+    path("manager/exports/<int:job_id>/download", views_manager.manager_export_download, name="manager_export_download"),
     # existing classic path B endpoints you already have
     path("auth/verify-otp", views.verify_otp, name="verify_otp"),
     # core/views.py
@@ -109,8 +126,10 @@ urlpatterns = [
     path("owner/OTP/verify",views_owner.owner_accept_verify, name = "owner_accept_verify"),
     path("owner/accept", views_owner.owner_accept, name="owner_accept"),
     path("stripe/webhook/owner/", views_restaurants.stripe_owner_webhook, name="stripe_owner_webhook"),
+    path("stripe/webhook/customer/", views_payments.stripe_customer_webhook, name="stripe_customer_webhook"),
     path("owner/api/menu-item-ratings/", views_owner.owner_api_menu_item_ratings, name="owner_api_menu_item_ratings"),
     path("owner/api/staff-ratings/", views_owner.owner_api_staff_ratings, name="owner_api_staff_ratings"),
+    path("owner/api/percentiles/", views_owner.owner_api_percentiles, name="owner_api_percentiles"),
     path("owner_api_staff_ratings_debug", views_owner.owner_api_staff_ratings_debug, name="owner_api_staff_ratings_debug"),
     path("api/me/transactions", views_home.api_me_transactions, name="api_me_transactions"),
     path("api/tickets/<int:tl_id>", views_home.api_ticket_link_receipt, name="api_ticket_link_receipt"),
@@ -124,6 +143,7 @@ urlpatterns = [
     # Manager analytics
     path("manager/api/menu-item-ratings", views_manager.manager_api_menu_item_ratings, name="manager_api_menu_item_ratings"),
     path("manager/api/staff-ratings", views_manager.manager_api_staff_ratings, name="manager_api_staff_ratings"),
+    path("manager/api/percentiles", views_manager.manager_api_percentiles, name="manager_api_percentiles"),
     path("manager/ticket/<int:ticket_link_id>/review.json",views_manager.manager_ticket_review_json,name="manager_ticket_review_json"),
     path("reset-pin/<str:token>/", views_resetpin.reset_pin_confirm, name="reset_pin_confirm"),
 ]
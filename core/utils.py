@@ -1,37 +1,34 @@
-from twilio.rest import Client
 from django.conf import settings
 from decouple import config
 import os
-from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 from .constants import CUSTOMER_SSR
+from .clients import stripe_client, sendgrid_send, twilio_client
 
 
 ACCOUNT_SID = config("TWILIO_ACCOUNT_SID")
 AUTH_TOKEN  = config("TWILIO_AUTH_TOKEN")
 VERIFY_SID  = config("TWILIO_VERIFY_SERVICE_SID")
 
-_client = Client(config("TWILIO_ACCOUNT_SID"), config("TWILIO_AUTH_TOKEN"))
-
 def send_sms_otp(phone_e164: str):
-    return _client.verify.v2.services(VERIFY_SID).verifications.create(
+    return twilio_client().verify.v2.services(VERIFY_SID).verifications.create(
         to=phone_e164, channel="sms"
     )
 
 def check_sms_otp(phone_e164: str, code: str) -> str:
-    vc = _client.verify.v2.services(VERIFY_SID).verification_checks.create(
+    vc = twilio_client().verify.v2.services(VERIFY_SID).verification_checks.create(
         to=phone_e164, code=code
     )
     return vc.status  # 'approved' on success
 
 # NEW — email channel
 def send_email_otp(email: str):
-    return _client.verify.v2.services(VERIFY_SID).verifications.create(
+    return twilio_client().verify.v2.services(VERIFY_SID).verifications.create(
         to=email, channel="email"
     )
 
 def check_email_otp(email: str, code: str) -> str:
-    vc = _client.verify.v2.services(VERIFY_SID).verification_checks.create(
+    vc = twilio_client().verify.v2.services(VERIFY_SID).verification_checks.create(
         to=email, code=code
     )
     return vc.status
@@ -80,12 +77,11 @@ def send_manager_invite_email(to_email: str, invite_link: str, restaurant_name:
     </div>
     """
 
-    sg = SendGridAPIClient(API_SENDGRID)
     msg = Mail(from_email=FROM_EMAIL, to_emails=to_email, subject=subject, html_content=html)
-    resp = sg.send(msg)
+    resp = sendgrid_send(msg)
     # Non-2xx? raise with details so you see why
     if not (200 <= resp.status_code < 300):
-        raise RuntimeError(f"SendGrid failed: {resp.status_code} {resp.body}")
+        raise RuntimeError(f"SendGrid failed: {resp.status_code} {resp.text}")
 
 def send_owner_invite_email(to_email: str, invite_link: str, restaurant_name: str, expires_at) -> None:
     """
@@ -116,12 +112,11 @@ def send_owner_invite_email(to_email: str, invite_link: str, restaurant_name: st
     </div>
     """
 
-    sg = SendGridAPIClient(API_SENDGRID)
     msg = Mail(from_email=FROM_EMAIL, to_emails=to_email, subject=subject, html_content=html)
-    resp = sg.send(msg)
+    resp = sendgrid_send(msg)
     # Non-2xx? raise with details so you see why
     if not (200 <= resp.status_code < 300):
-        raise RuntimeError(f"SendGrid failed: {resp.status_code} {resp.body}")
+        raise RuntimeError(f"SendGrid failed: {resp.status_code} {resp.text}")
 
 
 TWILIO_FROM_NUMBER = config("TWILIO_FROM_NUMBER", default="")
@@ -135,13 +130,11 @@ def send_sms(to_number: str, body: str) -> dict:
         return {"ok": False, "sid": None, "error": "Twilio not configured"}
 
     try:
-        # Local import so the project doesn't require twilio unless used
-        from twilio.rest import Client
+        client = twilio_client()
     except Exception as e:
         return {"ok": False, "sid": None, "error": f"Twilio SDK not installed: {e}"}
 
     try:
-        client = Client(ACCOUNT_SID, AUTH_TOKEN)
         msg = client.messages.create(
             to=' +18777804236',
             from_=TWILIO_FROM_NUMBER,
@@ -152,10 +145,9 @@ def send_sms(to_number: str, body: str) -> dict:
         return {"ok": False, "sid": None, "error": str(e)}
 
 # core/stripe_utils.py
-import stripe
 from django.conf import settings
 
-stripe.api_key = config('STRIPE_SK')
+stripe = stripe_client()
 
 def ensure_stripe_customer_by_email(email: str, metadata: dict | None = None) -> str:
     """
@@ -175,6 +167,38 @@ def create_setup_intent_for_customer(customer_id: str) -> stripe.SetupIntent:
         usage="off_session",
     )
 
+def _field(obj, key):
+    # dicts and StripeObjects both index by key; only dicts have .get()
+    try:
+        return obj[key] if obj else None
+    except (KeyError, TypeError):
+        return None
+
+def card_summary(pm) -> dict:
+    """
+    Brand/last4 from a Stripe PaymentMethod (object or webhook dict).
+    Returns {"card_brand": str, "card_last4": str}; blanks if it isn't a card.
+    """
+    card = _field(pm, "card") or {}
+    return {
+        "card_brand": (_field(card, "brand") or "").strip(),
+        "card_last4": (_field(card, "last4") or "").strip(),
+    }
+
+def cache_card_summary(cp, pm) -> None:
+    """
+    Persist the card summary for `pm` on the CustomerProfile.
+    `pm` may be a PaymentMethod object or a pm_* id (one Stripe call).
+    """
+    if isinstance(pm, str):
+        pm = stripe.PaymentMethod.retrieve(pm) if pm else None
+    summary = card_summary(pm)
+    changed = [f for f, v in summary.items() if getattr(cp, f) != v]
+    for f in changed:
+        setattr(cp, f, summary[f])
+    if changed:
+        cp.save(update_fields=changed)
+
 def seed_pending_card_session(request, *, user, phone_e164: str):
     """
     Prime the signup session so the existing /add-card -> /set-pin -> save_pin_finalize
@@ -221,12 +245,11 @@ def send_staff_invite_email(to_email: str, invite_link: str, restaurant_name: st
     </div>
     """
 
-    sg = SendGridAPIClient(API_SENDGRID)
     msg = Mail(from_email=FROM_EMAIL, to_emails=to_email, subject=subject, html_content=html)
-    resp = sg.send(msg)
+    resp = sendgrid_send(msg)
     # Non-2xx? raise with details so you see why
     if not (200 <= resp.status_code < 300):
-        raise RuntimeError(f"SendGrid failed: {resp.status_code} {resp.body}")
+        raise RuntimeError(f"SendGrid failed: {resp.status_code} {resp.text}")
 
 def send_customer_pin_reset_email(
     to_email: str,
@@ -262,8 +285,7 @@ def send_customer_pin_reset_email(
     </div>
     """
 
-    sg = SendGridAPIClient(API_SENDGRID)
     msg = Mail(from_email=FROM_EMAIL, to_emails=to_email, subject=subject, html_content=html)
-    resp = sg.send(msg)
+    resp = sendgrid_send(msg)
     if not (200 <= resp.status_code < 300):
-        raise RuntimeError(f"SendGrid failed: {resp.status_code} {resp.body}")
\ No newline at end of file
+        raise RuntimeError(f"SendGrid failed: {resp.status_code} {resp.text}")
\ No newline at end of file
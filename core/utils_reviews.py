@@ -0,0 +1,40 @@
+# core/utils_reviews.py
+"""
+Review JSON for the owner / manager ticket-review endpoints: review_payload(tl).
+"""
+from __future__ import annotations
+
+from .models import Review
+
+
+def review_payload(ticket_link) -> dict:
+    """
+    {ok, ticket_id, ticket_number, member, has_review, review} for one TicketLink, where
+    review = {id, stars, rating, comment, created_at, reviewer_name, reviewer_email} | None
+    and stars is clamped to 0..5 (rating is an alias for the front end).
+    """
+    review = Review.objects.filter(ticket_link=ticket_link).order_by("-created_at", "-id").first()
+    out = {
+        "ok": True,
+        "ticket_id": ticket_link.ticket_id,
+        "ticket_number": ticket_link.ticket_number,
+        "member": getattr(ticket_link.member, "member_id", None) or getattr(ticket_link.member, "id", None),
+        "has_review": bool(review),
+        "review": None,
+    }
+    if review:
+        try:
+            stars = int(review.stars or 0)
+        except Exception:
+            stars = 0
+        stars = max(0, min(5, stars))
+        out["review"] = {
+            "id": review.id,
+            "stars": stars,
+            "rating": stars,
+            "comment": review.comment or "",
+            "created_at": review.created_at.isoformat() if review.created_at else None,
+            "reviewer_name": getattr(review, "reviewer_name", "") or "",
+            "reviewer_email": getattr(review, "reviewer_email", "") or "",
+        }
+    return out
@@ -1,5 +1,7 @@
 # core/views_verify.py
 
+import logging
+
 from django.shortcuts import render, redirect
 from django.http import HttpResponseBadRequest
 from django.core import signing
@@ -10,6 +12,15 @@ from django.contrib.auth.hashers import check_password
 
 from .models import Member, TicketLink, RestaurantProfile
 from .omnivore import get_ticket
+from .views_processing import (
+    PAYMENT_MODE,
+    PaymentError,
+    build_idem_key,
+    charge_customer_off_session,
+    estimate_hold_cents,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def _due_from_ticket(t: dict) -> int:
@@ -40,6 +51,47 @@ def _safe_login(request, user):
     auth_login(request, user)
 
 
+def _place_auth_hold(tl: TicketLink, rp: RestaurantProfile, m: Member, due_cents: int) -> None:
+    """
+    PAYMENT_MODE=auth_capture: put a manual-capture hold on the member's saved card
+    so close only has to capture. Never blocks verification; close falls back to a
+    single-shot charge when there is no hold.
+    """
+    if PAYMENT_MODE != "auth_capture" or tl.auth_payment_intent_id:
+        return
+    cp = getattr(m, "customer", None)
+    if not cp or not cp.stripe_customer_id or not cp.default_payment_method:
+        return
+
+    amount = estimate_hold_cents(due_cents)
+    try:
+        intent = charge_customer_off_session(
+            customer_id=cp.stripe_customer_id,
+            payment_method_id=cp.default_payment_method,
+            amount_cents=amount,
+            currency="usd",
+            description=f"Dine N Dash — Ticket {tl.ticket_id} ({rp.display_name()}) hold",
+            idempotency_key=build_idem_key("hold", {"link": tl.id, "amount": amount}),
+            metadata={
+                "ticket_id": tl.ticket_id,
+                "restaurant_id": str(rp.id),
+                "member_number": m.number,
+                "customer_profile_id": str(cp.id),
+                "source": "verify_hold",
+            },
+            destination_account_id=(rp.stripe_account_id or None),
+            on_behalf_of=(rp.stripe_account_id or None),
+            capture_method="manual",
+        )
+    except PaymentError as e:
+        logger.warning("verify_member: hold failed for link %s: %s", tl.id, e)
+        return
+
+    tl.auth_payment_intent_id = intent.id
+    tl.auth_amount_cents = amount
+    tl.save(update_fields=["auth_payment_intent_id", "auth_amount_cents"])
+
+
 def _redirect_to_ticket_or_profile():
     """
     Prefer a dedicated live-ticket page if you have one,
@@ -174,7 +226,7 @@ def verify_member(request, member):
         tl.ticket_number = ticket_no
         tl.save(update_fields=["status", "server_name", "last_total_cents", "ticket_number"])
     else:
-        TicketLink.objects.create(
+        tl = TicketLink.objects.create(
             member=m,
             restaurant=rp,
             ticket_id=ticket_id,
@@ -185,6 +237,8 @@ def verify_member(request, member):
             opened_at=timezone.now(),
         )
 
+    _place_auth_hold(tl, rp, m, due_cents)
+
     # Auto-login & redirect to the live ticket
     if user:
         _safe_login(request, user)
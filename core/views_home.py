@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import json
+import logging
 from dataclasses import asdict
 from typing import Optional
 
@@ -17,10 +18,11 @@ from django.views.decorators.http import require_GET, require_POST
 
 # Third-party config
 from decouple import config
-import stripe
 
-# Set Stripe secret (keeps prior behavior)
-stripe.api_key = config("STRIPE_SK")
+from .clients import stripe_client
+
+# Shared pooled Stripe client (sets the secret key, keeps prior behavior)
+stripe = stripe_client()
 
 # Local imports
 from .models import (
@@ -30,6 +32,10 @@ from .models import (
     RestaurantProfile,
     Review,  # <-- make sure Review model exists as discussed
 )
+from .line_items import sync_line_items
+from . import ticket_search
+from .rollups import record_close, stamp_staff, staff_maps
+from .locks import serialize_ticket_close
 from .omnivore import (
     get_ticket,
     get_ticket_items,
@@ -37,11 +43,14 @@ from .omnivore import (
 )
 from core.views_processing import (
     charge_customer_off_session,
+    settle_authorization,
+    cancel_authorization,
     refund_payment_intent,
     PaymentError,
     build_idem_key,
 )
 
+logger = logging.getLogger(__name__)
 
 # --------------------
 # Small helpers (unchanged semantics)
@@ -104,7 +113,7 @@ def customer_home(request: HttpRequest) -> HttpResponse:
     """
     Render the profile/home page with:
       - has_customer, has_live_order, member_number
-      - Stripe card brand/last4
+      - card brand/last4 (cached on CustomerProfile, no Stripe calls)
       - maps_api_key
       - restaurants_json (for the map; can be empty and front-end will use demo)
     """
@@ -142,31 +151,11 @@ def customer_home(request: HttpRequest) -> HttpResponse:
             if m:
                 member_number = (m.number or "").strip()
 
-        # Stripe card details (brand/last4)
-        if cp and getattr(cp, "stripe_customer_id", None):
-            pm_id = (getattr(cp, "default_payment_method", "") or "").strip()
-            try:
-                if not pm_id:
-                    cust = stripe.Customer.retrieve(cp.stripe_customer_id)
-                    pm_id = (cust.get("invoice_settings", {}) or {}).get("default_payment_method") or ""
-                if not pm_id:
-                    pms = stripe.PaymentMethod.list(
-                        customer=cp.stripe_customer_id,
-                        type="card",
-                        limit=1,
-                    )
-                    if pms and pms.data:
-                        pm_id = pms.data[0].id
-                if pm_id:
-                    pm = stripe.PaymentMethod.retrieve(pm_id)
-                    card = (pm or {}).get("card") or {}
-                    if card:
-                        brand = (card.get("brand") or "").strip()
-                        card_brand = brand[:1].upper() + brand[1:] if brand else ""
-                        card_last4 = (card.get("last4") or "").strip()
-            except Exception:
-                # Page still renders fine if Stripe fails
-                pass
+        # Card brand/last4 (cached on the profile; refreshed at save + via Stripe webhooks)
+        if cp:
+            brand = (cp.card_brand or "").strip()
+            card_brand = brand[:1].upper() + brand[1:] if brand else ""
+            card_last4 = (cp.card_last4 or "").strip()
 
     # Google Maps API key
     maps_api_key = config("GOOGLE_MAPS_API", default="")
@@ -277,9 +266,20 @@ def api_ticket_receipt(request: HttpRequest, member_number: str) -> JsonResponse
 # Customer close tab (used by /api/member/<member>/close)
 # Includes review context in success JSON
 # --------------------
+def _member_close_lock_key(request: HttpRequest, member: str):
+    """(restaurant_id, ticket_id) of the member's open ticket, if the caller owns it."""
+    if not request.user.is_authenticated:
+        return None
+    return (TicketLink.objects
+            .filter(member__number=str(member), member__customer__user=request.user, status="open")
+            .order_by("-opened_at")
+            .values_list("restaurant_id", "ticket_id")
+            .first())
+
 @ensure_csrf_cookie
 @csrf_protect
 @require_POST
+@serialize_ticket_close(_member_close_lock_key)
 def api_close_tab(request: HttpRequest, member: str) -> JsonResponse:
     """
     Customer close (Stripe Connect version)
@@ -475,18 +475,40 @@ def api_close_tab(request: HttpRequest, member: str) -> JsonResponse:
         "tip": tip_cents,
     })
 
+    # auth-at-verify mode: capture the hold placed when the link opened
+    # (a hold that turns out captured is used as-is; only a released one falls through to a fresh charge)
+    intent = None
+    if tl.auth_payment_intent_id:
+        try:
+            intent = settle_authorization(
+                tl.auth_payment_intent_id,
+                authorized_cents=tl.auth_amount_cents,
+                amount_cents=gross_cents,
+                idempotency_key=f"cust_close:{tl.ticket_id}:{tl.auth_payment_intent_id}",
+            )
+        except PaymentError as e:
+            return JsonResponse({
+                "ok": False,
+                "error": "capture_state_unknown",
+                "detail": str(e),
+                "payment_intent": tl.auth_payment_intent_id,
+            }, status=502)
+        if intent is None:
+            TicketLink.objects.filter(pk=tl.pk).update(auth_payment_intent_id="", auth_amount_cents=0)
+
     try:
-        intent = charge_customer_off_session(
-            customer_id=cp.stripe_customer_id,
-            payment_method_id=cp.default_payment_method,
-            amount_cents=gross_cents,
-            currency="usd",
-            description=description,
-            idempotency_key=idem_key,
-            metadata=stripe_meta,
-            destination_account_id=(rp.stripe_account_id or None),
-            on_behalf_of=(rp.stripe_account_id or None),
-        )
+        if intent is None:
+            intent = charge_customer_off_session(
+                customer_id=cp.stripe_customer_id,
+                payment_method_id=cp.default_payment_method,
+                amount_cents=gross_cents,
+                currency="usd",
+                description=description,
+                idempotency_key=idem_key,
+                metadata=stripe_meta,
+                destination_account_id=(rp.stripe_account_id or None),
+                on_behalf_of=(rp.stripe_account_id or None),
+            )
     except PaymentError as e:
         return JsonResponse({
             "ok": False,
@@ -520,6 +542,8 @@ def api_close_tab(request: HttpRequest, member: str) -> JsonResponse:
         try:
             if getattr(intent, "id", None):
                 refund_payment_intent(intent.id, reason="requested_by_customer")
+                # refunded: a retry must charge afresh, not take the hold's capture for a payment
+                TicketLink.objects.filter(pk=tl.pk).update(auth_payment_intent_id="", auth_amount_cents=0)
         except PaymentError as refund_err:
             return JsonResponse({
                 "ok": False,
@@ -559,13 +583,23 @@ def api_close_tab(request: HttpRequest, member: str) -> JsonResponse:
         "items_json", "raw_ticket_json", "pos_ref",
         "merchant_name", "merchant_addr1", "merchant_addr2",
         "merchant_city", "merchant_state", "merchant_zip", "merchant_phone",
+        "staff_key", "staff_name",
+        "auth_payment_intent_id", "auth_amount_cents",
     ]
 
+    # other diners' holds on this ticket won't be captured now: release them before forgetting them
+    for link in open_links:
+        if link.auth_payment_intent_id and link.auth_payment_intent_id != getattr(intent, "id", None):
+            cancel_authorization(link.auth_payment_intent_id)
+
+    staff = staff_maps(rp)  # server -> staff_key once, here, instead of on every analytics read
     for link in open_links:
         _fill_merchant_snapshot(link, rp)
 
         link.status = "closed"
         link.closed_at = now
+        link.auth_payment_intent_id = ""   # captured or released above; nothing left to settle
+        link.auth_amount_cents = 0
 
         link.subtotal_cents  = int(totals_from_pos.get("subtotal_cents") or 0)
         link.tax_cents       = int(totals_from_pos.get("tax_cents") or 0)
@@ -579,9 +613,19 @@ def api_close_tab(request: HttpRequest, member: str) -> JsonResponse:
         link.raw_ticket_json = ticket_json or link.raw_ticket_json or {}
 
         link.pos_ref = reference
+        stamp_staff(link, staff)
 
         link.save(update_fields=update_fields)
 
+    # Normalized item rows, daily rollups and the search index; the charge already went through,
+    # so never fail the close here (backfill_line_items / rebuild_daily_stats / rebuild_ticket_search repair).
+    # Separate steps: one failing mustn't skip the others (catch-up writes items it finds missing).
+    for step in (sync_line_items, record_close, ticket_search.index_tickets):
+        try:
+            step(open_links)
+        except Exception:
+            logger.exception("close of ticket %s: %s failed", tl.ticket_id, step.__name__)
+
     return JsonResponse({
         "ok": True,
         "closed": len(open_links),
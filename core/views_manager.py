@@ -4,128 +4,27 @@ import json
 from datetime import timedelta, datetime
 
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpRequest, HttpResponse
+from django.http import FileResponse, Http404, JsonResponse, HttpRequest, HttpResponse
 from django.shortcuts import render, redirect
 from django.utils import timezone
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_protect
 from django.views.decorators.http import require_GET, require_POST
 
 from .models import ManagerProfile, RestaurantProfile, StaffProfile, TicketLink
-from .omnivore import get_ticket, get_ticket_items
-from django.apps import apps
-
-_POSSIBLE_RATING_ATTRS = ("rating", "review_rating", "stars", "score")
-_POSSIBLE_REVIEW_FIELDS = ("review_json", "raw_review_json", "raw_ticket_json", "extra_json")
-
-def _to_star(v):
-    try:
-        f = float(v)
-        # clamp to 0..5 and round to 3 decimals before casting if you prefer ints
-        return max(0.0, min(5.0, f))
-    except Exception:
-        return None
-
-def _dig_rating_from_mapping(m):
-    if not isinstance(m, dict):
-        return None
-
-    # direct keys
-    for k in _POSSIBLE_RATING_ATTRS:
-        v = m.get(k)
-        s = _to_star(v)
-        if s is not None:
-            return s
-
-    # nested common spots
-    for path in (
-        ("review", "rating"),
-        ("details", "rating"),
-        ("feedback", "rating"),
-        ("customer", "rating"),
-        ("data", "rating"),
-    ):
-        cur = m
-        try:
-            for k in path:
-                if not isinstance(cur, dict):
-                    cur = {}
-                cur = cur.get(k)
-            s = _to_star(cur)
-            if s is not None:
-                return s
-        except Exception:
-            pass
-    return None
-
-def get_ticket_rating_from_anywhere(ticket_link):
-    # --- 1) Review models
-    for label in ("core.Review", "core.TicketReview", "reviews.Review"):
-        try:
-            Review = apps.get_model(label)
-        except Exception:
-            Review = None
-        if not Review:
-            continue
-
-        r = None
-        # FK by object
-        try:
-            r = Review.objects.filter(ticket_link=ticket_link).order_by("-id").first()
-        except Exception:
-            pass
-        # Fallback: match by ticket_id (and restaurant if model has it)
-        if r is None:
-            try:
-                filt = {"ticket_id": ticket_link.ticket_id}
-                if hasattr(Review, "restaurant"):
-                    filt["restaurant"] = ticket_link.restaurant
-                r = Review.objects.filter(**filt).order_by("-id").first()
-            except Exception:
-                pass
-
-        if r is not None:
-            # scalar fields
-            for attr in _POSSIBLE_RATING_ATTRS:
-                if hasattr(r, attr):
-                    s = _to_star(getattr(r, attr))
-                    if s is not None:
-                        return s
-            # json/blob fields
-            for blob_attr in _POSSIBLE_REVIEW_FIELDS:
-                if hasattr(r, blob_attr):
-                    s = _dig_rating_from_mapping(getattr(r, blob_attr))
-                    if s is not None:
-                        return s
-
-    # --- 2) Direct attributes on TicketLink
-    for attr in _POSSIBLE_RATING_ATTRS:
-        if hasattr(ticket_link, attr):
-            s = _to_star(getattr(ticket_link, attr))
-            if s is not None:
-                return s
-
-    # --- 3) Dict/JSON blobs on TicketLink
-    for blob_attr in _POSSIBLE_REVIEW_FIELDS:
-        if hasattr(ticket_link, blob_attr):
-            s = _dig_rating_from_mapping(getattr(ticket_link, blob_attr))
-            if s is not None:
-                return s
-
-    return None
+from . import analytics
+from .utils_reviews import review_payload
+from .exports import csv_response, xlsx_response
+from . import dashboard_state, export_jobs, pos_fanout, ticket_search
+from .dates import parse_range
 
 def _require_manager(request: HttpRequest):
     """Return (manager_profile, restaurant) or (None, None)."""
-    mp = getattr(request.user, "manager_profile", None)
-    if mp is None:
-        mp = (
-            ManagerProfile.objects
-            .select_related("restaurant")
-            .filter(user=request.user)
-            .first()
-        )
-    if not mp or not getattr(mp, "restaurant", None):
+    # request.role_ctx (core/role_context.py): no queries once the session's context is cached
+    ctx = request.role_ctx
+    mp = ctx.manager_profile
+    if not mp or not ctx.manager_restaurant:
         return None, None
-    return mp, mp.restaurant
+    return mp, ctx.manager_restaurant
 
 
 @login_required
@@ -153,7 +52,7 @@ def manager_api_state(request: HttpRequest) -> JsonResponse:
     Dashboard data for manager:
       - staff list (name only + ids for Remove)
       - open tickets summary  (due = sum(items) + tax, NO TIP)
-      - recent closed tickets within optional date range
+      - first page of recent closed tickets within optional date range
     """
     mp, rp = _require_manager(request)
     if not mp or not rp:
@@ -178,94 +77,49 @@ def manager_api_state(request: HttpRequest) -> JsonResponse:
         staff.append({"id": s.id, "name": name})
 
     # ---------- Open tickets (grouped) ----------
-    # We compute "due_cents" as: sum(item line totals) + tax (NO TIP).
-    # Prefer a live POS read; fall back to our snapshots.
-    open_map = {}
-    open_qs = (
-        TicketLink.objects
-        .select_related("member")
-        .filter(restaurant=rp, status="open")
-        .order_by("-opened_at")[:400]
-    )
-    has_pos = bool((rp.omnivore_location_id or "").strip())
-
-    for tl in open_qs:
-        entry = open_map.setdefault(tl.ticket_id, {
-            "ticket_id": tl.ticket_id,
-            "ticket_number": tl.ticket_number or None,
-            "server": tl.server_name or "",
-            "members": [],
-            "due_cents": 0,
-        })
-        entry["members"].append(tl.member.number if tl.member else "")
-
-        due_live = None
-
-        # Try live POS (Omnivore) first
-        if has_pos:
-            try:
-                t = get_ticket(rp.omnivore_location_id, tl.ticket_id)
-                items = get_ticket_items(rp.omnivore_location_id, tl.ticket_id)
-                subtotal = 0
-                for it in items:
-                    qty  = int(it.get("quantity", 1) or 1)
-                    unit = int(it.get("price", 0) or 0)  # per-unit cents
-                    subtotal += qty * unit
-                tax = int((t.get("totals") or {}).get("tax", 0) or 0)
-                due_live = subtotal + tax  # NO TIP
-            except Exception:
-                due_live = None  # fall back below
-
-        # Fallback #1: compute from our saved items_json + tax_cents (if available)
-        if due_live is None and tl.items_json:
-            try:
-                subtotal = 0
-                for it in (tl.items_json or []):
-                    qty = int(it.get("qty") or it.get("quantity") or 1)
-                    unit = int(it.get("price_cents") or it.get("unit_cents") or it.get("cents") or it.get("price") or 0)
-                    line = int(it.get("total_cents") or it.get("line_total_cents") or (unit * qty))
-                    subtotal += line
-                tax = int(tl.tax_cents or 0)
-                due_live = subtotal + tax  # NO TIP
-            except Exception:
-                due_live = None
-
-        # Fallback #2: last known totals snapshot
-        if due_live is None:
-            due_live = int(tl.last_total_cents or tl.total_cents or 0)
-
-        # Keep the max in case there are multiple rows for the same ticket_id
-        entry["due_cents"] = max(int(entry["due_cents"] or 0), int(due_live or 0))
-
-    open_list = list(open_map.values())
+    # due_cents = sum(item line totals) + tax (NO TIP), live from the POS where it answers
+    # in time, else from our snapshots; shared with the owner dashboard (core/dashboard_state.py).
+    open_section = dashboard_state.open_tickets(rp)
 
     # ---------- Recent closed tickets ----------
-    recent_qs = TicketLink.objects.select_related("member").filter(restaurant=rp, status="closed")
-    if start:
-        try: recent_qs = recent_qs.filter(closed_at__date__gte=start)
-        except Exception: pass
-    if end:
-        try: recent_qs = recent_qs.filter(closed_at__date__lte=end)
-        except Exception: pass
-
-    recent = []
-    for tl in recent_qs.order_by("-closed_at")[:500]:
-        row = {
-            "ticket_id": tl.ticket_id,
-            "ticket_number": tl.ticket_number or None,
-            "member": tl.member.number if tl.member else "",
-            "server": tl.server_name or "",
-            "closed_at": tl.closed_at.strftime("%Y-%m-%d %H:%M") if tl.closed_at else "",
-            "total_cents": (tl.paid_cents or tl.total_cents or tl.last_total_cents or 0),
-            "ticket_link_id": tl.id,  # used by the UI "Review" button
-        }
-        if q:
-            hay = f'{row["ticket_number"] or ""} {row["member"] or ""}'.lower()
-            if q not in hay:
-                continue
-        recent.append(row)
+    # first page only; "Load more" pages through manager_api_recent with next_cursor
+    recent = dashboard_state.recent(rp, q, start, end)
 
-    return JsonResponse({"ok": True, "staff": staff, "open": open_list, "recent": recent})
+    return JsonResponse({"ok": True, "staff": staff, **open_section, **recent})
+
+
+@require_GET
+@login_required
+def manager_api_recent(request: HttpRequest) -> JsonResponse:
+    """One page of recent closed tickets for ?q=&start=&end=&cursor=&limit= (cursor = the previous next_cursor)."""
+    mp, rp = _require_manager(request)
+    if not mp or not rp:
+        return JsonResponse({"ok": False, "error": "Not a manager for any restaurant."}, status=403)
+    q = (request.GET.get("q") or "").strip().lower()
+    start, end = parse_range(request.GET)
+    cursor = (request.GET.get("cursor") or "").strip() or None
+    try:
+        page = dashboard_state.recent(rp, q, start, end, cursor, request.GET.get("limit"))
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({"ok": True, **page})
+
+
+@require_GET
+@login_required
+def manager_api_ticket_search(request: HttpRequest) -> JsonResponse:
+    """Closed tickets matching ?q= (ticket / member number, last name, server, items), ranked; ?page=&limit=."""
+    mp, rp = _require_manager(request)
+    if not mp or not rp:
+        return JsonResponse({"ok": False, "error": "Not a manager for any restaurant."}, status=403)
+    try:
+        page = int(request.GET.get("page") or 1)
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "Bad page."}, status=400)
+    return JsonResponse({
+        "ok": True,
+        **ticket_search.search(rp, request.GET.get("q") or "", page, dashboard_state.page_limit(request.GET.get("limit"))),
+    })
 
 
 
@@ -319,12 +173,12 @@ def manager_api_ticket_detail(request: HttpRequest, ticket_id: str) -> JsonRespo
         return JsonResponse({"ok": False, "error": "Ticket not found."}, status=404)
 
     # ---------- OPEN: compute totals from items, ignore Omnivore's 'due/total' ----------
+    # both POS calls run concurrently; past POS_FANOUT_DEADLINE the saved snapshot below is served instead
+    live = None
     if tl.status == "open" and (rp.omnivore_location_id or "").strip():
-        try:
-            t = get_ticket(rp.omnivore_location_id, tl.ticket_id)
-            items = get_ticket_items(rp.omnivore_location_id, tl.ticket_id)
-        except Exception as e:
-            return JsonResponse({"ok": False, "error": f"POS error: {e}"}, status=502)
+        live = pos_fanout.fetch_one(rp.omnivore_location_id, tl.ticket_id)
+    if live is not None:
+        t, items = live
 
         rows = []
         subtotal = 0
@@ -361,9 +215,10 @@ def manager_api_ticket_detail(request: HttpRequest, ticket_id: str) -> JsonRespo
             "tip_cents": tip,
             "total_cents": computed_total,
             "is_open": True,
+            "pos": {"live": 1, "stale": 0},
         })
 
-    # ---------- CLOSED: use saved snapshot; expose unit and line totals ----------
+    # ---------- CLOSED (or OPEN without a timely POS answer): saved snapshot; unit and line totals ----------
     rows = []
     for it in (tl.items_json or []):
         name  = it.get("name") or it.get("label") or "Item"
@@ -389,19 +244,16 @@ def manager_api_ticket_detail(request: HttpRequest, ticket_id: str) -> JsonRespo
         "tax_cents": int(tl.tax_cents or 0),
         "tip_cents": int(tl.tip_cents or 0),
         "total_cents": int(tl.paid_cents or (tl.total_cents or 0) + (tl.tax_cents or 0) + (tl.tip_cents or 0)),
-        "is_open": False,
+        "is_open": tl.status == "open",
+        "pos": {"live": 0, "stale": 1 if tl.status == "open" else 0},
     })
 
 
 
-from io import BytesIO
 from datetime import datetime, time, timedelta
 from django.http import HttpResponse
 from django.utils.dateparse import parse_date
 from django.db.models import Q
-from openpyxl import Workbook
-from openpyxl.styles import Font
-from openpyxl.utils import get_column_letter
 
 @require_GET
 @login_required
@@ -414,172 +266,53 @@ def manager_export(request: HttpRequest) -> HttpResponse:
     start = (request.GET.get("start") or "").strip()
     end   = (request.GET.get("end") or "").strip()
 
-    qs = (
-        TicketLink.objects
-        .select_related("member")
-        .filter(restaurant=rp, status="closed")
-    )
-    if start:
-        try:
-            qs = qs.filter(closed_at__date__gte=start)
-        except Exception:
-            pass
-    if end:
-        try:
-            qs = qs.filter(closed_at__date__lte=end)
-        except Exception:
-            pass
+    if (request.GET.get("format") or "").strip().lower() == "csv":
+        return csv_response(rp, start, end, q)
 
-    rows = []
-    for tl in qs.order_by("closed_at"):
-        # optional search filter
-        if q:
-            hay = f"{(tl.ticket_number or tl.ticket_id)} {(tl.member.number if tl.member else '')}".lower()
-            if q not in hay:
-                continue
-
-        subtotal = int(tl.total_cents or 0)   # <-- per your mapping
-        tax      = int(tl.tax_cents or 0)
-        tip      = int(tl.tip_cents or 0)
-        total    = int(tl.paid_cents or (subtotal + tax + tip))  # <-- Total shows what was paid
+    return xlsx_response(rp, start, end, q)
 
-        rows.append({
-            "closed": tl.closed_at,
-            "ticket": tl.ticket_number or tl.ticket_id,
-            "member": tl.member.number if tl.member else "",
-            "server": tl.server_name or "",
-            "subtotal": subtotal,
-            "tax": tax,
-            "tip": tip,
-            "total": total,
-            "pos_ref": tl.pos_ref or "",
-        })
 
-    # Build workbook
-    from openpyxl import Workbook
-    from openpyxl.styles import Font
-    from openpyxl.utils import get_column_letter
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Closed"
-
-    headers = ["Closed", "Ticket", "Member", "Server", "Subtotal", "Tax", "Tip", "Total", "POS Ref"]
-    ws.append(headers)
-    for c in ws[1]:
-        c.font = Font(bold=True)
-
-    currency_fmt = u'[$$-409]#,##0.00'
-
-    for r in rows:
-        ws.append([
-            r["closed"].strftime("%Y-%m-%d %H:%M") if r["closed"] else "",
-            r["ticket"],
-            r["member"],
-            r["server"],
-            r["subtotal"]/100.0,
-            r["tax"]/100.0,
-            r["tip"]/100.0,
-            r["total"]/100.0,
-            r["pos_ref"],
-        ])
-
-    # Format currency columns E..H
-    if rows:
-        for row in ws.iter_rows(min_row=2, min_col=5, max_col=8):
-            for cell in row:
-                cell.number_format = currency_fmt
-
-    # Column widths
-    widths = [18, 12, 14, 12, 12, 12, 12, 12, 16]
-    for i, w in enumerate(widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = w
-
-    # Grand total row (sum of Total column)
-    total_row = len(rows) + 2
-    ws.cell(row=total_row, column=7, value="Grand total").font = Font(bold=True)
-    total_col = get_column_letter(8)
-    ws.cell(row=total_row, column=8, value=f"=SUM({total_col}2:{total_col}{total_row-1})").number_format = currency_fmt
-    ws.cell(row=total_row, column=8).font = Font(bold=True)
-
-    # Return file
-    rest_name = getattr(rp, "dba_name", "") or getattr(rp, "legal_name", "") or "restaurant"
-    filename = f"{rest_name.replace(' ', '_')}_closed_{timezone.now().strftime('%Y%m%d')}.xlsx"
-
-    bio = BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    resp = HttpResponse(bio.getvalue(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    resp["Content-Disposition"] = f'attachment; filename="{filename}"'
-    return resp
-
-def get_ticket_rating_from_anywhere(ticket_link):
-    # 1) Review models
-    for label in ("core.Review", "core.TicketReview", "reviews.Review"):
-        try:
-            Review = apps.get_model(label)
-        except Exception:
-            Review = None
-        if not Review:
-            continue
-
-        try:
-            r = Review.objects.filter(ticket_link=ticket_link).order_by("-id").first()
-        except Exception:
-            r = None
-
-        if r is None:
-            try:
-                filt = {"ticket_id": ticket_link.ticket_id}
-                if hasattr(Review, "restaurant"):
-                    filt["restaurant"] = ticket_link.restaurant
-                r = Review.objects.filter(**filt).order_by("-id").first()
-            except Exception:
-                r = None
-
-        if r is not None:
-            for attr in _POSSIBLE_RATING_ATTRS:
-                try:
-                    val = getattr(r, attr, None)
-                    if val is not None:
-                        val = int(val)
-                        if 0 <= val <= 5:
-                            return val
-                except Exception:
-                    pass
-            for blob_attr in _POSSIBLE_REVIEW_FIELDS:
-                try:
-                    blob = getattr(r, blob_attr, None)
-                    if blob:
-                        v = _dig_rating_from_mapping(blob)
-                        if v is not None:
-                            return v
-                except Exception:
-                    pass
-
-    # 2) Direct attrs on TicketLink
-    for attr in _POSSIBLE_RATING_ATTRS:
-        try:
-            val = getattr(ticket_link, attr, None)
-            if val is not None:
-                val = int(val)
-                if 0 <= val <= 5:
-                    return val
-        except Exception:
-            pass
-
-    # 3) Dict/JSON blobs on TicketLink
-    for blob_attr in _POSSIBLE_REVIEW_FIELDS:
-        try:
-            blob = getattr(ticket_link, blob_attr, None)
-            if blob:
-                v = _dig_rating_from_mapping(blob)
-                if v is not None:
-                    return v
-        except Exception:
-            pass
-
-    return None
+@csrf_protect
+@require_POST
+@login_required
+def manager_api_export_enqueue(request: HttpRequest) -> JsonResponse:
+    """Queue a background export of the manager's restaurant (body: start, end, q, format)."""
+    mp, rp = _require_manager(request)
+    if not mp or not rp:
+        return JsonResponse({"ok": False, "error": "Not authorized."}, status=403)
+    try:
+        data = json.loads(request.body.decode() or "{}")
+    except Exception:
+        data = {}
+    try:
+        job = export_jobs.enqueue(rp, request.user, "manager", data)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({"ok": True, "job": export_jobs.job_payload(job, "core:manager_export_download")}, status=202)
+
+
+@require_GET
+@login_required
+def manager_api_export_status(request: HttpRequest, job_id: int) -> JsonResponse:
+    mp, rp = _require_manager(request)
+    if not mp or not rp:
+        return JsonResponse({"ok": False, "error": "Not authorized."}, status=403)
+    job = export_jobs.job_for_user(request, job_id, "manager")
+    if not job:
+        return JsonResponse({"ok": False, "error": "Export not found."}, status=404)
+    return JsonResponse({"ok": True, "job": export_jobs.job_payload(job, "core:manager_export_download")})
+
+
+@require_GET
+@login_required
+def manager_export_download(request: HttpRequest, job_id: int) -> HttpResponse:
+    mp, rp = _require_manager(request)
+    if not mp or not rp:
+        return HttpResponse("Not authorized.", status=403)
+    job = export_jobs.job_for_user(request, job_id, "manager", status="done")
+    if not job or not job.file:
+        return HttpResponse("Export not found or expired.", status=404)
+    return FileResponse(job.file.open("rb"), as_attachment=True, filename=job.file.name.rsplit("/", 1)[-1])
 
 @login_required
 @require_GET
@@ -594,216 +327,9 @@ def manager_api_menu_item_ratings(request: HttpRequest) -> JsonResponse:
     if not mp or not rp:
         return JsonResponse({"ok": False, "error": "Not authorized."}, status=403)
 
-    start_s = (request.GET.get("start") or "").strip()
-    end_s   = (request.GET.get("end") or "").strip()
-
-    qs = TicketLink.objects.filter(restaurant=rp, status="closed")
-    if start_s:
-        try: qs = qs.filter(closed_at__date__gte=parse_date(start_s))
-        except Exception: pass
-    if end_s:
-        try: qs = qs.filter(closed_at__date__lte=parse_date(end_s))
-        except Exception: pass
-
-    # ---------- helpers ----------
-    def norm_name(s: str) -> str:
-        s = (s or "").strip().lower()
-        return " ".join(s.replace("$", "").split())
-
-    def unit_cents_from_row(row: dict) -> int | None:
-        """
-        Best-effort unit price in cents. Order:
-          1) total_cents or line_total_cents / qty
-          2) explicit *_cents fields
-          3) dollar-looking 'price' with decimal -> dollars * 100
-          4) bare integer 'price' treated as CENTS (legacy), not dollars
-        """
-        # qty
-        try:
-            qty = int(row.get("quantity") or row.get("qty") or 1)
-            qty = max(qty, 1)
-        except Exception:
-            qty = 1
-
-        # 1) derive from totals
-        for k in ("total_cents", "line_total_cents"):
-            v = row.get(k)
-            if v is None: 
-                continue
-            try:
-                tc = int(v)
-                if tc >= 0:
-                    return int(round(tc / qty))
-            except Exception:
-                pass
-
-        # 2) explicit cents fields
-        for k in ("unit_cents", "price_cents", "cents", "unit_price_cents"):
-            v = row.get(k)
-            if v is None:
-                continue
-            try:
-                uc = int(v)
-                if uc >= 0:
-                    return uc
-            except Exception:
-                pass
-
-        # 3) dollar-looking strings/floats with a decimal
-        for k in ("unit_price", "price"):
-            v = row.get(k)
-            if v is None:
-                continue
-            s = str(v).strip()
-            if "." in s:
-                try:
-                    from decimal import Decimal
-                    return int(Decimal(s) * 100)
-                except Exception:
-                    continue
-
-        # 4) last resort: bare integer 'price' as CENTS (legacy exports)
-        for k in ("unit_price", "price"):
-            v = row.get(k)
-            if v is None:
-                continue
-            try:
-                iv = int(str(v).replace(",", ""))
-                # treat as cents
-                return max(iv, 0)
-            except Exception:
-                pass
-
-        return None
-
-    def median_int(vals):
-        vals = sorted(vals)
-        n = len(vals)
-        if n == 0:
-            return None
-        mid = n // 2
-        if n % 2:
-            return vals[mid]
-        return (vals[mid - 1] + vals[mid]) // 2
-
-    # plausible price band for a unit item (in cents)
-    MIN_CENTS, MAX_CENTS = 50, 4000
-
-    # Menu cache maps
-    menu_cache = getattr(rp, "menu_cache", None) or []
-    meta_by_id = {str(x.get("id")): x for x in menu_cache if str(x.get("id") or "")}
-    meta_by_name = {norm_name(x.get("name")): x for x in menu_cache if (x.get("name") or "").strip()}
-
-    # ---------- aggregate with de-dupe ----------
-    agg = {}
-    id_to_key = {}
-    name_to_key = {}
-
-    for tl in qs.iterator():
-        rating = get_ticket_rating_from_anywhere(tl)
-
-        for row in (tl.items_json or []):
-            mid   = str(row.get("menu_item_id") or row.get("id") or "").strip()
-            name  = (row.get("name") or row.get("label") or "").strip() or "Unknown item"
-            nname = norm_name(name)
-
-            # resolve bucket key
-            if mid:
-                key = id_to_key.get(mid)
-                if not key and nname in name_to_key:
-                    key = name_to_key[nname]
-                    id_to_key[mid] = key
-                    agg[key]["menu_item_id"] = mid or agg[key]["menu_item_id"]
-                if not key:
-                    key = mid
-                    id_to_key[mid] = key
-                    name_to_key.setdefault(nname, key)
-            else:
-                key = name_to_key.get(nname) or f"name:{nname}"
-                name_to_key.setdefault(nname, key)
-
-            rec = agg.setdefault(key, {
-                "menu_item_id": mid or None,
-                "name": name,
-                "category": "",
-                "observed_prices": [],   # collect per-row unit cents
-                "cache_price": None,     # from menu_cache if available
-                "sum": 0,
-                "n": 0,
-                "qty_rated_tickets": 0,
-                "qty_all_tickets": 0,
-                "num_rated_tickets": 0,
-                "num_all_tickets": 0,
-            })
-
-            # enrich category + cache price
-            meta = meta_by_id.get(mid) or meta_by_name.get(nname)
-            if meta and not rec["category"]:
-                rec["category"] = (meta.get("category") or "").strip()
-            if meta and rec["cache_price"] is None:
-                try:
-                    pc = meta.get("price_cents")
-                    if pc is not None:
-                        rec["cache_price"] = int(pc)
-                except Exception:
-                    pass
-
-            # derive per-row unit price and record if plausible
-            uc = unit_cents_from_row(row)
-            if uc is not None:
-                # keep all observations; we'll filter to plausible band when summarizing
-                rec["observed_prices"].append(int(uc))
-
-            # quantities + counters
-            try:
-                qty = int(row.get("quantity") or row.get("qty") or 1)
-            except Exception:
-                qty = 1
-            rec["qty_all_tickets"] += qty
-            rec["num_all_tickets"] += 1
-
-            if rating is not None:
-                rec["sum"] += int(rating)
-                rec["n"]   += 1
-                rec["qty_rated_tickets"] += qty
-                rec["num_rated_tickets"] += 1
-
-    # ---------- shape + choose final price ----------
-    out = []
-    for _, r in agg.items():
-        # choose price: median of plausible observed, else any observed, else cache
-        observed_plausible = [p for p in r["observed_prices"] if MIN_CENTS <= p <= MAX_CENTS]
-        price_cents = median_int(observed_plausible)
-        if price_cents is None:
-            # if all observed are out-of-band (e.g., 5000), try to recompute a safer median anyway
-            price_cents = median_int(r["observed_prices"]) if r["observed_prices"] else None
-            # clamp clearly bogus high values by preferring cache if cache is plausible
-            if price_cents is not None and price_cents > MAX_CENTS and r["cache_price"] and MIN_CENTS <= r["cache_price"] <= MAX_CENTS:
-                price_cents = r["cache_price"]
-        if price_cents is None:
-            # final fallback: cache if plausible; else 0
-            cp = r["cache_price"]
-            price_cents = cp if (cp is not None and MIN_CENTS <= cp <= MAX_CENTS) else 0
-
-        avg = (r["sum"] / r["n"]) if r["n"] else None
-        out.append({
-            "menu_item_id": r["menu_item_id"] or "",
-            "name": r["name"],
-            "category": r["category"],
-            "price_cents": int(price_cents or 0),
-            "avg_rating": round(avg, 3) if avg is not None else None,
-            "num_rated_tickets": r["num_rated_tickets"],
-            "total_qty_on_rated_tickets": r["qty_rated_tickets"],
-            "num_all_tickets": r["num_all_tickets"],
-            "total_qty_all_tickets": r["qty_all_tickets"],
-        })
-
-    def sort_key(row):
-        rated = row["avg_rating"] is not None
-        return (0 if rated else 1, -(row["avg_rating"] or 0), -row.get("num_all_tickets", 0))
-
-    out.sort(key=sort_key)
-    return JsonResponse({"ok": True, "items": out})
+    start, end = parse_range(request.GET)
+    # shared with the other role's endpoint and cached until the next close/review (core/analytics.py)
+    return JsonResponse({"ok": True, "items": analytics.menu_item_ratings(rp, start, end)})
 
 
 
@@ -820,139 +346,31 @@ def manager_api_staff_ratings(request: HttpRequest) -> JsonResponse:
     if not mp or not rp:
         return JsonResponse({"ok": False, "error": "Not authorized."}, status=403)
 
-    start_s = (request.GET.get("start") or "").strip()
-    end_s   = (request.GET.get("end") or "").strip()
-    qs = TicketLink.objects.filter(restaurant=rp, status="closed")
-    if start_s:
-        try: qs = qs.filter(closed_at__date__gte=parse_date(start_s))
-        except Exception: pass
-    if end_s:
-        try: qs = qs.filter(closed_at__date__lte=parse_date(end_s))
-        except Exception: pass
-
-    staff_cache = getattr(rp, "staff_cache", None) or []
-    by_ck_lower = { (s.get("check_name") or "").strip().lower(): s for s in staff_cache if (s.get("check_name") or "").strip() }
-    by_nm_lower = { (s.get("name") or "").strip().lower():       s for s in staff_cache if (s.get("name") or "").strip() }
-
-    agg = {}
-    def seed_row(key, display, active=True):
-        if key not in agg:
-            agg[key] = {"display": display or "", "active": bool(active), "sum": 0, "n": 0, "tickets_all": 0, "tickets_rated": 0}
-
-    # Seed cached staff so they appear even with 0 tickets (but only if we have a display)
-    for s in staff_cache:
-        key = (str(s.get("id") or "").strip()
-               or (s.get("check_name") or "").strip()
-               or (s.get("name") or "").strip()
-               or f"seed:{id(s)}")
-        disp = (s.get("check_name") or s.get("name") or "").strip()
-        if disp:
-            seed_row(key, disp, s.get("is_active", True))
-
-    agg_all = {"display": "All staff", "active": True, "sum": 0, "n": 0, "tickets_all": 0, "tickets_rated": 0}
-
-    for tl in qs.iterator():
-        rating = get_ticket_rating_from_anywhere(tl)
-
-        # ALL
-        agg_all["tickets_all"] += 1
-        if rating is not None:
-            agg_all["sum"] += int(rating)
-            agg_all["n"]   += 1
-            agg_all["tickets_rated"] += 1
-
-        resolved = (tl.server_name or "").strip()
-        key = None
-        display = None
-
-        if resolved:
-            low = resolved.lower()
-            if low in by_ck_lower:
-                s = by_ck_lower[low]
-                key = str(s.get("id") or s.get("check_name") or resolved)
-                display = (s.get("check_name") or s.get("name") or resolved)
-                seed_row(key, display, s.get("is_active", True))
-            elif low in by_nm_lower:
-                s = by_nm_lower[low]
-                key = str(s.get("id") or s.get("name") or resolved)
-                display = (s.get("check_name") or s.get("name") or resolved)
-                seed_row(key, display, s.get("is_active", True))
-            else:
-                display = resolved
-                key = resolved
-                if display:
-                    seed_row(key, display, True)
-
-        if not key:
-            try:
-                raw = tl.raw_ticket_json or {}
-                emb = (raw.get("_embedded") or {})
-                emp = emb.get("employee") or raw.get("employee") or {}
-                pos_name = (emp.get("check_name") or emp.get("name") or "").strip()
-            except Exception:
-                pos_name = ""
-            if pos_name:
-                low = pos_name.lower()
-                if low in by_ck_lower:
-                    s = by_ck_lower[low]
-                    key = str(s.get("id") or s.get("check_name") or pos_name)
-                    display = (s.get("check_name") or s.get("name") or pos_name)
-                    seed_row(key, display, s.get("is_active", True))
-                elif low in by_nm_lower:
-                    s = by_nm_lower[low]
-                    key = str(s.get("id") or s.get("name") or pos_name)
-                    display = (s.get("check_name") or s.get("name") or pos_name)
-                    seed_row(key, display, s.get("is_active", True))
-                else:
-                    display = pos_name
-                    key = pos_name
-                    if display:
-                        seed_row(key, display, True)
-
-        if not key:
-            continue
-
-        row = agg[key]
-        row["tickets_all"] += 1
-        if rating is not None:
-            row["sum"] += int(rating)
-            row["n"]   += 1
-            row["tickets_rated"] += 1
-
-    # Shape output exactly like owner endpoint
-    out = []
-    avg_all = (agg_all["sum"] / agg_all["n"]) if agg_all["n"] else None
-    out.append({
-        "staff_key": "ALL",
-        "name": agg_all["display"],
-        "avg_rating": round(avg_all, 3) if avg_all is not None else None,
-        "num_rated_tickets": agg_all["tickets_rated"],
-        "is_active_in_pos": True,
-        "num_all_tickets": agg_all["tickets_all"],
-    })
-    for key, r in agg.items():
-        avg = (r["sum"] / r["n"]) if r["n"] else None
-        out.append({
-            "staff_key": key,
-            "name": r["display"],
-            "avg_rating": round(avg, 3) if avg is not None else None,
-            "num_rated_tickets": r["tickets_rated"],
-            "is_active_in_pos": bool(r["active"]),
-            "num_all_tickets": r["tickets_all"],
-        })
-
-    def sort_key(row):
-        if row["staff_key"] == "ALL": return (-999, 0, 0)
-        rated = row["avg_rating"] is not None
-        return (0 if rated else 1, -(row["avg_rating"] or 0), -row["num_all_tickets"])
-
-    out[1:] = sorted(out[1:], key=sort_key)
-
+    start, end = parse_range(request.GET)
     return JsonResponse({
         "ok": True,
         "synced_at": (rp.staff_cache_synced_at.isoformat() if getattr(rp, "staff_cache_synced_at", None) else None),
-        "staff": out,
+        "staff": analytics.staff_ratings(rp, start, end),
     })
+
+
+@login_required
+@require_GET
+def manager_api_percentiles(request: HttpRequest) -> JsonResponse:
+    """
+    Percentiles over a date range, merged from the per-day sketches (core/sketches.py).
+    GET: metric=ticket_total|tip_pct|item_price, p=50,90,99, start, end, item (item_price only).
+    """
+    mp, rp = _require_manager(request)
+    if not mp or not rp:
+        return JsonResponse({"ok": False, "error": "Not authorized."}, status=403)
+    try:
+        metric, qs, item = analytics.percentile_args(request.GET)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    start, end = parse_range(request.GET)
+    return JsonResponse({"ok": True, **analytics.percentiles(rp, metric, qs, start, end, item=item)})
+
 def _manager_restaurant_or_404(request: HttpRequest):
     mp, rp = _require_manager(request)
     if not mp or not rp:
@@ -963,7 +381,7 @@ def _manager_restaurant_or_404(request: HttpRequest):
 @require_GET
 def manager_ticket_review_json(request: HttpRequest, ticket_link_id: int) -> JsonResponse:
     """
-    Returns a normalized review payload for a given TicketLink id, mirroring the owner view shape:
+    Returns the normalized review payload (core/utils_reviews.review_payload) for a TicketLink id, same as the owner view:
       {
         ok, ticket_id, ticket_number, member,
         has_review: bool,
@@ -976,74 +394,4 @@ def manager_ticket_review_json(request: HttpRequest, ticket_link_id: int) -> Jso
     except TicketLink.DoesNotExist:
         return JsonResponse({"ok": False, "error": "Ticket not found."}, status=404)
 
-    # Try to locate a Review model we may have
-    ReviewModel = None
-    for label in ("core.Review", "core.TicketReview", "reviews.Review"):
-        try:
-            ReviewModel = apps.get_model(label)
-            break
-        except Exception:
-            continue
-
-    review = None
-    if ReviewModel:
-        # Prefer FK by object, fall back to ticket_id (+restaurant if available)
-        try:
-            review = ReviewModel.objects.filter(ticket_link=tl).order_by("-created_at", "-id").first()
-        except Exception:
-            review = None
-        if review is None:
-            try:
-                filt = {"ticket_id": tl.ticket_id}
-                if hasattr(ReviewModel, "restaurant"):
-                    filt["restaurant"] = tl.restaurant
-                review = ReviewModel.objects.filter(**filt).order_by("-created_at", "-id").first()
-            except Exception:
-                review = None
-
-    out = {
-        "ok": True,
-        "ticket_id": tl.ticket_id,
-        "ticket_number": tl.ticket_number,
-        "member": getattr(tl.member, "member_id", None) or getattr(tl.member, "id", None),
-        "has_review": bool(review),
-        "review": None,
-    }
-
-    if review:
-        # Normalize stars 0..5 from scalar attrs or blobs
-        stars = None
-        for attr in ("stars", "rating", "score"):
-            try:
-                v = getattr(review, attr, None)
-                if v is not None:
-                    stars = max(0, min(5, int(v)))
-                    break
-            except Exception:
-                pass
-        if stars is None:
-            for blob_attr in ("review_json", "raw_review_json", "raw_ticket_json", "extra_json"):
-                try:
-                    blob = getattr(review, blob_attr, None)
-                    if blob and isinstance(blob, dict):
-                        v = (blob.get("rating")
-                             or (blob.get("review") or {}).get("rating")
-                             or (blob.get("details") or {}).get("rating"))
-                        if v is not None:
-                            stars = max(0, min(5, int(v)))
-                            break
-                except Exception:
-                    pass
-        stars = stars if stars is not None else 0
-
-        out["review"] = {
-            "id": review.id,
-            "stars": stars,
-            "rating": stars,
-            "comment": getattr(review, "comment", "") or "",
-            "created_at": getattr(review, "created_at", None).isoformat() if getattr(review, "created_at", None) else None,
-            "reviewer_name": getattr(review, "reviewer_name", "") or "",
-            "reviewer_email": getattr(review, "reviewer_email", "") or "",
-        }
-
-    return JsonResponse(out)
+    return JsonResponse(review_payload(tl))
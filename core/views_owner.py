@@ -1,13 +1,12 @@
 from __future__ import annotations
 
 import json
-from io import BytesIO
 from typing import Optional
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
-from django.http import JsonResponse, HttpRequest, HttpResponse
+from django.http import FileResponse, Http404, JsonResponse, HttpRequest, HttpResponse
 from django.shortcuts import render
 from django.utils import timezone
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_protect
@@ -23,9 +22,14 @@ from .models import (
     ManagerInvite,
     StaffInvite,
     StaffProfile,
-    Review
 )
-from .omnivore import get_ticket, get_ticket_items
+from . import analytics
+from .utils_reviews import review_payload
+from .exports import (
+    csv_response, xlsx_response, portfolio_csv_response, portfolio_summary, portfolio_xlsx_response,
+)
+from . import dashboard_state, export_jobs, pos_fanout, ticket_search
+from .dates import filter_days, parse_range, restaurant_tz
 from django.views.decorators.http import require_http_methods
 from django.db import transaction
 User = get_user_model()
@@ -41,15 +45,11 @@ from django.utils import timezone
 from django.http import JsonResponse, HttpRequest
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q
-from django.utils.dateparse import parse_date
-from django.apps import apps
 
 
-def _get_owner_profile(user):
-    op = getattr(user, "owner_profile", None)
-    if op is None:
-        op = OwnerProfile.objects.select_related("user").filter(user=user).first()
-    return op
+def _get_owner_profile(request):
+    # request.role_ctx (core/role_context.py): no queries once the session's context is cached
+    return request.role_ctx.owner_profile
 
 
 def _owner_restaurants(op):
@@ -62,14 +62,9 @@ def _owner_restaurants(op):
 
 
 def _get_current_restaurant(request, op):
-    qs = _owner_restaurants(op)
-    if not qs.exists():
-        return None
-
-    rid = request.session.get("current_restaurant_id")
-    current = qs.filter(id=rid).first() if rid else None
+    current = request.role_ctx.restaurant if op else None
     if not current:
-        current = qs.first()
+        return None
 
     # persist
     if request.session.get("current_restaurant_id") != current.id:
@@ -83,156 +78,118 @@ def _get_current_restaurant(request, op):
 @login_required
 def owner_api_state(request: HttpRequest) -> JsonResponse:
     """
-    Owner dashboard data:
+    Owner dashboard data in one response (the page itself loads the sections below):
       - restaurants list + current selection
       - owners, managers, staff
       - open tickets summary (computed: items + tax, no tip)
-      - recent closed tickets
+      - first page of recent closed tickets (more via owner_api_state_recent ?cursor=)
     """
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
 
-    # --- Restaurants this owner controls ---
-    rqs = _owner_restaurants(op).order_by("created_at")
-    restaurants = [
-        {
-            "id": r.id,
-            "name": r.dba_name or r.legal_name,
-            "phone": r.phone or "",
-            "email": r.email or "",
-        }
-        for r in rqs
-    ]
-
     current = _get_current_restaurant(request, op)
-    current_id = current.id if current else None
-
     q = (request.GET.get("q") or "").strip().lower()
-    start = (request.GET.get("start") or "").strip()
-    end   = (request.GET.get("end") or "").strip()
+    start, end = parse_range(request.GET)
 
-    # --- Owners ---
-    owners, managers, staff = [], [], []
-    if current:
-        # owners
-        for lk in Ownership.objects.select_related("owner", "owner__user").filter(restaurant=current):
-            u = getattr(lk.owner, "user", None)
-            owners.append({"id": lk.owner_id, "email": u.email if u else ""})
-
-        # managers
-        for m in (
-            ManagerProfile.objects.select_related("user")
-            .filter(restaurant=current)
-            .order_by("user__email")
-        ):
-            u = getattr(m, "user", None)
-            email = (u.email if u else "")
-            name = (u.get_full_name() if u else "") or (email.split("@")[0] if email else "")
-            managers.append({"id": m.id, "name": name})
-
-        # staff
-        for s in (
-            StaffProfile.objects.select_related("user")
-            .filter(restaurant=current)
-            .order_by("user__email")
-        ):
-            u = getattr(s, "user", None)
-            email = (u.email if u else "")
-            name = (u.get_full_name() if u else "") or (email.split("@")[0] if email else "")
-            staff.append({"id": s.id, "name": name})
-
-    # --- Open tickets ---
-    open_map = {}
-    if current:
-        open_qs = (
-            TicketLink.objects.select_related("member")
-            .filter(restaurant=current, status="open")
-            .order_by("-opened_at")[:400]
-        )
-        has_pos = bool((current.omnivore_location_id or "").strip())
-
-        for tl in open_qs:
-            entry = open_map.setdefault(tl.ticket_id, {
-                "ticket_id": tl.ticket_id,
-                "ticket_number": tl.ticket_number or None,
-                "server": tl.server_name or "",
-                "members": [],
-                "due_cents": 0,
-            })
-            entry["members"].append(tl.member.number if tl.member else "")
-
-            due_live = None
-            if has_pos:
-                try:
-                    t = get_ticket(current.omnivore_location_id, tl.ticket_id)
-                    items = get_ticket_items(current.omnivore_location_id, tl.ticket_id)
-                    subtotal = 0
-                    for it in items:
-                        qty = int(it.get("quantity", 1) or 1)
-                        unit = int(it.get("price", 0) or 0)
-                        subtotal += qty * unit
-                    tax = int((t.get("totals") or {}).get("tax", 0) or 0)
-                    due_live = subtotal + tax
-                except Exception:
-                    due_live = None
-
-            if due_live is None and tl.items_json:
-                try:
-                    subtotal = 0
-                    for it in (tl.items_json or []):
-                        qty = int(it.get("qty") or it.get("quantity") or 1)
-                        unit = int(it.get("price_cents") or it.get("unit_cents") or it.get("cents") or it.get("price") or 0)
-                        line = int(it.get("total_cents") or it.get("line_total_cents") or (unit * qty))
-                        subtotal += line
-                    tax = int(tl.tax_cents or 0)
-                    due_live = subtotal + tax
-                except Exception:
-                    due_live = None
-
-            if due_live is None:
-                due_live = int(tl.last_total_cents or tl.total_cents or 0)
-
-            entry["due_cents"] = max(int(entry["due_cents"] or 0), int(due_live or 0))
-
-    open_list = list(open_map.values())
-
-    # --- Recent closed ---
-    recent = []
-    if current:
-        recent_qs = TicketLink.objects.select_related("member").filter(restaurant=current, status="closed")
-        if start:
-            try: recent_qs = recent_qs.filter(closed_at__date__gte=start)
-            except Exception: pass
-        if end:
-            try: recent_qs = recent_qs.filter(closed_at__date__lte=end)
-            except Exception: pass
-
-        for tl in recent_qs.order_by("-closed_at")[:500]:
-            row = {
-                "ticket_id": tl.ticket_id,
-                "ticket_number": tl.ticket_number or None,
-                "member": tl.member.number if tl.member else "",
-                "server": tl.server_name or "",
-                "closed_at": tl.closed_at.strftime("%Y-%m-%d %H:%M") if tl.closed_at else "",
-                "total_cents": (tl.paid_cents or tl.total_cents or tl.last_total_cents or 0),
-                "ticket_link_id": tl.id,
+    people = dashboard_state.people(current) if current else {"owners": [], "managers": [], "staff": []}
+    open_section = dashboard_state.open_tickets(current) if current else {"open": [], "pos": {"live": 0, "stale": 0}}
+    return JsonResponse({
+        "ok": True,
+        **_restaurants_payload(request.role_ctx, current),
+        **people,
+        **open_section,
+        **(dashboard_state.recent(current, q, start, end) if current else {"recent": [], "next_cursor": None}),
+    })
+
+
+def _restaurants_payload(ctx, current) -> dict:
+    return {
+        "restaurants": [
+            {
+                "id": r.id,
+                "name": r.dba_name or r.legal_name,
+                "phone": r.phone or "",
+                "email": r.email or "",
             }
-            if q:
-                hay = f'{row["ticket_number"] or ""} {row["member"] or ""}'.lower()
-                if q not in hay:
-                    continue
-            recent.append(row)
+            for r in sorted(ctx.restaurants, key=lambda r: (r.created_at, r.id))
+        ],
+        "current_restaurant_id": current.id if current else None,
+    }
+
 
+def _section_request(request: HttpRequest):
+    """(op, current restaurant, refresh?) for a dashboard section endpoint; op None = not an owner."""
+    op = _get_owner_profile(request)
+    if not op:
+        return None, None, False
+    return op, _get_current_restaurant(request, op), request.GET.get("refresh") == "1"
+
+
+@ensure_csrf_cookie
+@require_GET
+@login_required
+def owner_api_state_people(request: HttpRequest) -> JsonResponse:
+    """Restaurants + owners / managers / staff. No POS calls."""
+    op, current, refresh = _section_request(request)
+    if not op:
+        return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
+    people = dashboard_state.people(current, refresh) if current else {"owners": [], "managers": [], "staff": []}
+    return JsonResponse({"ok": True, **_restaurants_payload(request.role_ctx, current), **people})
+
+
+@require_GET
+@login_required
+def owner_api_state_open(request: HttpRequest) -> JsonResponse:
+    """Open tickets with the amount due (live from the POS, cached for DASHBOARD_OPEN_TTL) + live/stale counts."""
+    op, current, refresh = _section_request(request)
+    if not op:
+        return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
+    return JsonResponse({
+        "ok": True,
+        "current_restaurant_id": current.id if current else None,
+        **(dashboard_state.open_tickets(current, refresh) if current else {"open": [], "pos": {"live": 0, "stale": 0}}),
+    })
+
+
+@require_GET
+@login_required
+def owner_api_state_recent(request: HttpRequest) -> JsonResponse:
+    """One page of recent closed tickets for ?q=&start=&end=&cursor=&limit= (cursor = the previous next_cursor)."""
+    op, current, refresh = _section_request(request)
+    if not op:
+        return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
+    q = (request.GET.get("q") or "").strip().lower()
+    start, end = parse_range(request.GET)
+    cursor = (request.GET.get("cursor") or "").strip() or None
+    try:
+        page = (dashboard_state.recent(current, q, start, end, cursor, request.GET.get("limit"), refresh)
+                if current else {"recent": [], "next_cursor": None})
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({
+        "ok": True,
+        "current_restaurant_id": current.id if current else None,
+        **page,
+    })
+
+
+@require_GET
+@login_required
+def owner_api_ticket_search(request: HttpRequest) -> JsonResponse:
+    """Closed tickets of the current restaurant matching ?q= (ticket / member number, last name, server, items), ranked; ?page=&limit=."""
+    op, current, _refresh = _section_request(request)
+    if not op:
+        return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
+    if not current:
+        return JsonResponse({"ok": True, "results": [], "page": 1, "next_page": None})
+    try:
+        page = int(request.GET.get("page") or 1)
+    except ValueError:
+        return JsonResponse({"ok": False, "error": "Bad page."}, status=400)
     return JsonResponse({
         "ok": True,
-        "restaurants": restaurants,
-        "current_restaurant_id": current_id,
-        "owners": owners,
-        "managers": managers,
-        "staff": staff,
-        "open": open_list,
-        "recent": recent,
+        **ticket_search.search(current, request.GET.get("q") or "", page, dashboard_state.page_limit(request.GET.get("limit"))),
     })
 
 
@@ -314,36 +271,11 @@ def _set_current_restaurant(request: HttpRequest, rp: Optional[RestaurantProfile
 # ----------------- page -----------------
 def _current_restaurant(request):
     """Resolve the restaurant for the signed-in owner."""
-    # 1) session selection
-    rid = request.session.get("current_restaurant_id")
-    if rid:
-        rp = RestaurantProfile.objects.filter(id=rid).first()
-        if rp:
-            return rp
-
-    # 2) first active restaurant this owner owns
-    op = OwnerProfile.objects.filter(user=request.user).first()
-    if not op:
-        return None
-
-    # Use through model; respect is_active if present
-    ow_qs = Ownership.objects.filter(owner=op)
-    if any(f.name == "is_active" for f in Ownership._meta.fields):
-        ow_qs = ow_qs.filter(is_active=True)
-
-    rid = ow_qs.values_list("restaurant_id", flat=True).first()
-    if rid:
-        rp = RestaurantProfile.objects.filter(id=rid).first()
-        if rp:
-            # remember it in session for next time
-            request.session["current_restaurant_id"] = rp.id
-            request.session.modified = True
-            return rp
-    return None
+    return _get_current_restaurant(request, _get_owner_profile(request))
 
 @login_required
 def owner_dashboard(request: HttpRequest) -> HttpResponse:
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         # If the logged-in user doesn't have an OwnerProfile yet, bail with a clear error.
         return render(request, "core/owner_dashboard.html", {"op": None, "restaurant": None})
@@ -359,7 +291,7 @@ def owner_dashboard(request: HttpRequest) -> HttpResponse:
 @require_POST
 @login_required
 def owner_api_set_restaurant(request: HttpRequest) -> JsonResponse:
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     try:
@@ -367,7 +299,7 @@ def owner_api_set_restaurant(request: HttpRequest) -> JsonResponse:
     except Exception:
         data = {}
     rid = data.get("restaurant_id")
-    rp = _owner_restaurants(op).filter(id=rid).first()
+    rp = request.role_ctx.owns(rid)
     if not rp:
         return JsonResponse({"ok": False, "error": "Restaurant not found."}, status=404)
     _set_current_restaurant(request, rp)
@@ -381,7 +313,7 @@ def owner_api_add_restaurant(request: HttpRequest) -> JsonResponse:
     Create a restaurant and link it to the current owner via Ownership.
     Your model requires legal_name and email.
     """
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     try:
@@ -411,7 +343,7 @@ def owner_api_add_restaurant(request: HttpRequest) -> JsonResponse:
 @require_POST
 @login_required
 def owner_api_remove_restaurant(request: HttpRequest) -> JsonResponse:
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
 
@@ -425,7 +357,7 @@ def owner_api_remove_restaurant(request: HttpRequest) -> JsonResponse:
         return JsonResponse({"ok": False, "error": "Missing restaurant_id."}, status=400)
 
     # Owner must own this restaurant
-    rp = _owner_restaurants(op).filter(id=rid).first()
+    rp = request.role_ctx.owns(rid)
     if not rp:
         return JsonResponse({"ok": False, "error": "Restaurant not found."}, status=404)
 
@@ -457,7 +389,7 @@ def owner_api_remove_restaurant(request: HttpRequest) -> JsonResponse:
 @require_POST
 @login_required
 def owner_api_remove_manager(request: HttpRequest) -> JsonResponse:
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     try:
@@ -466,7 +398,7 @@ def owner_api_remove_manager(request: HttpRequest) -> JsonResponse:
         data = {}
     rid = data.get("restaurant_id")
     mid = data.get("manager_id")
-    rp = _owner_restaurants(op).filter(id=rid).first()
+    rp = request.role_ctx.owns(rid)
     if not rp:
         return JsonResponse({"ok": False, "error": "Restaurant not found."}, status=404)
 
@@ -557,7 +489,7 @@ def _set_current_restaurant(request: HttpRequest, rp: Optional[RestaurantProfile
 @require_POST
 @login_required
 def owner_api_remove_owner(request: HttpRequest) -> JsonResponse:
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     try:
@@ -566,7 +498,7 @@ def owner_api_remove_owner(request: HttpRequest) -> JsonResponse:
         data = {}
     rid = data.get("restaurant_id")
     oid = data.get("owner_id")
-    rp = _owner_restaurants(op).filter(id=rid).first()
+    rp = request.role_ctx.owns(rid)
     if not rp:
         return JsonResponse({"ok": False, "error": "Restaurant not found."}, status=404)
 
@@ -583,7 +515,7 @@ def owner_api_remove_owner(request: HttpRequest) -> JsonResponse:
 @require_GET
 @login_required
 def owner_api_ticket_detail(request: HttpRequest, ticket_id: str) -> JsonResponse:
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     rp = _get_current_restaurant(request, op)
@@ -600,12 +532,12 @@ def owner_api_ticket_detail(request: HttpRequest, ticket_id: str) -> JsonRespons
         return JsonResponse({"ok": False, "error": "Ticket not found."}, status=404)
 
     # ---------- OPEN (live pull) ----------
+    # both POS calls run concurrently; past POS_FANOUT_DEADLINE the saved snapshot below is served instead
+    live = None
     if tl.status == "open" and (rp.omnivore_location_id or "").strip():
-        try:
-            t = get_ticket(rp.omnivore_location_id, tl.ticket_id) or {}
-            items = get_ticket_items(rp.omnivore_location_id, tl.ticket_id) or []
-        except Exception as e:
-            return JsonResponse({"ok": False, "error": f"POS error: {e}"}, status=502)
+        live = pos_fanout.fetch_one(rp.omnivore_location_id, tl.ticket_id)
+    if live is not None:
+        t, items = live
 
         # Build rows with explicit unit + line totals
         rows = []
@@ -658,9 +590,10 @@ def owner_api_ticket_detail(request: HttpRequest, ticket_id: str) -> JsonRespons
             "tip_cents": int(tip),
             "total_cents": int(display_total),
             "is_open": True,
+            "pos": {"live": 1, "stale": 0},
         })
 
-    # ---------- CLOSED (snapshot) ----------
+    # ---------- CLOSED, or OPEN without a timely POS answer (snapshot) ----------
     rows = []
     for it in (tl.items_json or []):
         name  = it.get("name") or it.get("label") or "Item"
@@ -686,13 +619,14 @@ def owner_api_ticket_detail(request: HttpRequest, ticket_id: str) -> JsonRespons
         "tax_cents": int(tl.tax_cents or 0),
         "tip_cents": int(tl.tip_cents or 0),
         "total_cents": int(tl.paid_cents or (tl.total_cents or 0) + (tl.tax_cents or 0) + (tl.tip_cents or 0)),
-        "is_open": False,
+        "is_open": tl.status == "open",
+        "pos": {"live": 0, "stale": 1 if tl.status == "open" else 0},
     })
 
 
 def _owner_restaurant_or_404(request):
     # however you currently get the active restaurant (reusing your helper if you have one)
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         raise Http404("Owner not found")
     rp = _get_current_restaurant(request, op)
@@ -711,210 +645,7 @@ def owner_ticket_review_json(request, ticket_link_id: int) -> JsonResponse:
     except TicketLink.DoesNotExist:
         return JsonResponse({"ok": False, "error": "Ticket not found."}, status=404)
 
-    # If you store one review per ticket, this is fine; otherwise pick your rule
-    review = (
-        Review.objects.filter(ticket_link=tl)
-        .order_by("-created_at")
-        .first()
-    )
-
-    out = {
-        "ok": True,
-        "ticket_id": tl.ticket_id,
-        "ticket_number": tl.ticket_number,
-        "member": getattr(tl.member, "member_id", None) or getattr(tl.member, "id", None),
-        "has_review": bool(review),
-        "review": None,
-    }
-
-    if review:
-        # Stars must be a number 0..5
-        stars = review.stars or 0  # adjust field name if different
-        try:
-            stars = int(stars)
-        except Exception:
-            try:
-                stars = float(stars)
-            except Exception:
-                stars = 0
-        stars = max(0, min(5, stars))
-
-        out["review"] = {
-            "id": review.id,
-            "stars": stars,     # canonical
-            "rating": stars,    # redundant alias for front-end safety
-            "comment": review.comment or "",
-            "created_at": review.created_at.isoformat() if review.created_at else None,
-            "reviewer_name": getattr(review, "reviewer_name", "") or "",
-            "reviewer_email": getattr(review, "reviewer_email", "") or "",
-        }
-
-    return JsonResponse(out)
-# core/utils_reviews.py
-from django.apps import apps
-
-# Common attribute names across projects
-_POSSIBLE_RATING_ATTRS = ("rating", "review_rating", "stars", "score")
-# Common JSON/blob fields that may contain nested review data
-_POSSIBLE_REVIEW_FIELDS = ("review_json", "raw_review_json", "raw_ticket_json", "extra_json")
-
-def _dig_rating_from_mapping(m):
-    """
-    Try common keys/paths inside a dict-like review/ticket payload.
-    Return int 0–5 (usually 1–5) or None.
-    """
-    if not isinstance(m, dict):
-        return None
-
-    # Direct keys first
-    for k in ("rating", "review_rating", "stars", "score"):
-        try:
-            v = m.get(k)
-            if v is not None:
-                v = int(v)
-                if 0 <= v <= 5:
-                    return v
-        except Exception:
-            pass
-
-    # Nested "review": { rating: ... }
-    try:
-        rev = m.get("review") or {}
-        v = rev.get("rating")
-        if v is not None:
-            v = int(v)
-            if 0 <= v <= 5:
-                return v
-    except Exception:
-        pass
-
-    # Other common nesting patterns
-    for path in (("details", "rating"), ("feedback", "rating"), ("customer", "rating")):
-        try:
-            cur = m
-            for k in path:
-                if not isinstance(cur, dict):
-                    cur = {}
-                cur = cur.get(k)
-            if cur is not None:
-                v = int(cur)
-                if 0 <= v <= 5:
-                    return v
-        except Exception:
-            pass
-
-    return None
-
-
-# core/utils_reviews.py
-from django.apps import apps
-
-_POSSIBLE_RATING_ATTRS = ("rating", "review_rating", "stars", "score")
-_POSSIBLE_REVIEW_FIELDS = ("review_json", "raw_review_json", "raw_ticket_json", "extra_json")
-
-def _dig_rating_from_mapping(m):
-    if not isinstance(m, dict):
-        return None
-    for k in ("rating", "review_rating", "stars", "score"):
-        try:
-            v = m.get(k)
-            if v is not None:
-                v = int(v)
-                if 0 <= v <= 5:
-                    return v
-        except Exception:
-            pass
-    try:
-        rev = m.get("review") or {}
-        v = rev.get("rating")
-        if v is not None:
-            v = int(v)
-            if 0 <= v <= 5:
-                return v
-    except Exception:
-        pass
-    for path in (("details", "rating"), ("feedback", "rating"), ("customer", "rating")):
-        try:
-            cur = m
-            for k in path:
-                if not isinstance(cur, dict):
-                    cur = {}
-                cur = cur.get(k)
-            if cur is not None:
-                v = int(cur)
-                if 0 <= v <= 5:
-                    return v
-        except Exception:
-            pass
-    return None
-
-def get_ticket_rating_from_anywhere(ticket_link):
-    # 1) Review models
-    for label in ("core.Review", "core.TicketReview", "reviews.Review"):
-        try:
-            Review = apps.get_model(label)
-        except Exception:
-            Review = None
-        if not Review:
-            continue
-
-        try:
-            r = Review.objects.filter(ticket_link=ticket_link).order_by("-id").first()
-        except Exception:
-            r = None
-
-        if r is None:
-            try:
-                filt = {"ticket_id": ticket_link.ticket_id}
-                if hasattr(Review, "restaurant"):
-                    filt["restaurant"] = ticket_link.restaurant
-                r = Review.objects.filter(**filt).order_by("-id").first()
-            except Exception:
-                r = None
-
-        if r is not None:
-            for attr in _POSSIBLE_RATING_ATTRS:
-                try:
-                    val = getattr(r, attr, None)
-                    if val is not None:
-                        val = int(val)
-                        if 0 <= val <= 5:
-                            return val
-                except Exception:
-                    pass
-            for blob_attr in _POSSIBLE_REVIEW_FIELDS:
-                try:
-                    blob = getattr(r, blob_attr, None)
-                    if blob:
-                        v = _dig_rating_from_mapping(blob)
-                        if v is not None:
-                            return v
-                except Exception:
-                    pass
-
-    # 2) Direct attrs on TicketLink
-    for attr in _POSSIBLE_RATING_ATTRS:
-        try:
-            val = getattr(ticket_link, attr, None)
-            if val is not None:
-                val = int(val)
-                if 0 <= val <= 5:
-                    return val
-        except Exception:
-            pass
-
-    # 3) Dict/JSON blobs on TicketLink
-    for blob_attr in _POSSIBLE_REVIEW_FIELDS:
-        try:
-            blob = getattr(ticket_link, blob_attr, None)
-            if blob:
-                v = _dig_rating_from_mapping(blob)
-                if v is not None:
-                    return v
-        except Exception:
-            pass
-
-    return None
+    return JsonResponse(review_payload(tl))
 
 
 # --- MENU ITEMS ANALYTICS ---
@@ -928,217 +659,16 @@ def owner_api_menu_item_ratings(request: HttpRequest) -> JsonResponse:
     - Unit price is the MEDIAN of observed per-row unit_cents across tickets.
       Falls back to menu_cache only if no sane observed price exists.
     """
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     rp = _get_current_restaurant(request, op)
     if not rp:
         return JsonResponse({"ok": False, "error": "Select a restaurant."}, status=400)
 
-    start_s = (request.GET.get("start") or "").strip()
-    end_s   = (request.GET.get("end") or "").strip()
-
-    qs = TicketLink.objects.filter(restaurant=rp, status="closed")
-    if start_s:
-        try: qs = qs.filter(closed_at__date__gte=parse_date(start_s))
-        except Exception: pass
-    if end_s:
-        try: qs = qs.filter(closed_at__date__lte=parse_date(end_s))
-        except Exception: pass
-
-    # ---------- helpers ----------
-    def norm_name(s: str) -> str:
-        s = (s or "").strip().lower()
-        return " ".join(s.replace("$", "").split())
-
-    def unit_cents_from_row(row: dict) -> int | None:
-        """
-        Best-effort unit price in cents. Order:
-          1) total_cents or line_total_cents / qty
-          2) explicit *_cents fields
-          3) dollar-looking 'price' with decimal -> dollars * 100
-          4) bare integer 'price' treated as CENTS (legacy), not dollars
-        """
-        # qty
-        try:
-            qty = int(row.get("quantity") or row.get("qty") or 1)
-            qty = max(qty, 1)
-        except Exception:
-            qty = 1
-
-        # (1) derive from totals
-        for k in ("total_cents", "line_total_cents"):
-            v = row.get(k)
-            if v is None:
-                continue
-            try:
-                tc = int(v)
-                if tc >= 0:
-                    return int(round(tc / qty))
-            except Exception:
-                pass
-
-        # (2) explicit cents fields
-        for k in ("unit_cents", "price_cents", "cents", "unit_price_cents"):
-            v = row.get(k)
-            if v is None:
-                continue
-            try:
-                uc = int(v)
-                if uc >= 0:
-                    return uc
-            except Exception:
-                pass
-
-        # (3) dollar-looking strings/floats with a decimal
-        for k in ("unit_price", "price"):
-            v = row.get(k)
-            if v is None:
-                continue
-            s = str(v).strip()
-            if "." in s:
-                try:
-                    from decimal import Decimal
-                    return int(Decimal(s) * 100)
-                except Exception:
-                    continue
-
-        # (4) last resort: bare integer 'price' as CENTS (legacy exports)
-        for k in ("unit_price", "price"):
-            v = row.get(k)
-            if v is None:
-                continue
-            try:
-                iv = int(str(v).replace(",", ""))
-                return max(iv, 0)  # treat as cents
-            except Exception:
-                pass
-
-        return None
-
-    def median_int(vals):
-        vals = sorted(vals)
-        n = len(vals)
-        if n == 0:
-            return None
-        mid = n // 2
-        if n % 2:
-            return vals[mid]
-        return (vals[mid - 1] + vals[mid]) // 2
-
-    # plausible band in cents for menu items
-    MIN_CENTS, MAX_CENTS = 50, 4000
-
-    # Menu cache maps
-    menu_cache = getattr(rp, "menu_cache", None) or []
-    meta_by_id = {str(x.get("id")): x for x in menu_cache if str(x.get("id") or "")}
-    meta_by_name = {norm_name(x.get("name")): x for x in menu_cache if (x.get("name") or "").strip()}
-
-    # ---------- aggregate with de-dupe ----------
-    agg = {}
-    id_to_key = {}
-    name_to_key = {}
-
-    for tl in qs.iterator():
-        rating = get_ticket_rating_from_anywhere(tl)  # may be None
-
-        for row in (tl.items_json or []):
-            mid   = str(row.get("menu_item_id") or row.get("id") or "").strip()
-            name  = (row.get("name") or row.get("label") or "").strip() or "Unknown item"
-            nname = norm_name(name)
-
-            # resolve key (id preferred; merge name-only into id bucket)
-            if mid:
-                key = id_to_key.get(mid)
-                if not key and nname in name_to_key:
-                    key = name_to_key[nname]
-                    id_to_key[mid] = key
-                    agg[key]["menu_item_id"] = mid or agg[key]["menu_item_id"]
-                if not key:
-                    key = mid
-                    id_to_key[mid] = key
-                    name_to_key.setdefault(nname, key)
-            else:
-                key = name_to_key.get(nname) or f"name:{nname}"
-                name_to_key.setdefault(nname, key)
-
-            rec = agg.setdefault(key, {
-                "menu_item_id": mid or None,
-                "name": name,
-                "category": "",
-                "observed_prices": [],   # store unit cents observations
-                "cache_price": None,     # from menu_cache, if any
-                "sum": 0,
-                "n": 0,
-                "qty_rated_tickets": 0,
-                "qty_all_tickets": 0,
-                "num_rated_tickets": 0,
-                "num_all_tickets": 0,
-            })
-
-            # category / cache price from menu_cache
-            meta = meta_by_id.get(mid) or meta_by_name.get(nname)
-            if meta and not rec["category"]:
-                rec["category"] = (meta.get("category") or "").strip()
-            if meta and rec["cache_price"] is None:
-                try:
-                    pc = meta.get("price_cents")
-                    if pc is not None:
-                        rec["cache_price"] = int(pc)
-                except Exception:
-                    pass
-
-            # collect per-row unit price observation
-            uc = unit_cents_from_row(row)
-            if uc is not None:
-                rec["observed_prices"].append(int(uc))
-
-            # counts
-            try:
-                qty = int(row.get("quantity") or row.get("qty") or 1)
-            except Exception:
-                qty = 1
-            rec["qty_all_tickets"] += qty
-            rec["num_all_tickets"] += 1
-
-            if rating is not None:
-                rec["sum"] += int(rating)
-                rec["n"]   += 1
-                rec["qty_rated_tickets"] += qty
-                rec["num_rated_tickets"] += 1
-
-    # ---------- shape + choose final price ----------
-    out = []
-    for _, r in agg.items():
-        observed_plausible = [p for p in r["observed_prices"] if MIN_CENTS <= p <= MAX_CENTS]
-        price_cents = median_int(observed_plausible)
-        if price_cents is None:
-            price_cents = median_int(r["observed_prices"]) if r["observed_prices"] else None
-            if price_cents is not None and price_cents > MAX_CENTS and r["cache_price"] and MIN_CENTS <= r["cache_price"] <= MAX_CENTS:
-                price_cents = r["cache_price"]
-        if price_cents is None:
-            cp = r["cache_price"]
-            price_cents = cp if (cp is not None and MIN_CENTS <= cp <= MAX_CENTS) else 0
-
-        avg = (r["sum"] / r["n"]) if r["n"] else None
-        out.append({
-            "menu_item_id": r["menu_item_id"] or "",
-            "name": r["name"],
-            "category": r["category"],
-            "price_cents": int(price_cents or 0),
-            "avg_rating": round(avg, 3) if avg is not None else None,
-            "num_rated_tickets": r["num_rated_tickets"],
-            "total_qty_on_rated_tickets": r["qty_rated_tickets"],
-            "num_all_tickets": r["num_all_tickets"],
-            "total_qty_all_tickets": r["qty_all_tickets"],
-        })
-
-    def sort_key(row):
-        rated = row["avg_rating"] is not None
-        return (0 if rated else 1, -(row["avg_rating"] or 0), -row.get("num_all_tickets", 0))
-
-    out.sort(key=sort_key)
-    return JsonResponse({"ok": True, "items": out})
+    start, end = parse_range(request.GET)
+    # shared with the other role's endpoint and cached until the next close/review (core/analytics.py)
+    return JsonResponse({"ok": True, "items": analytics.menu_item_ratings(rp, start, end)})
 
 
 
@@ -1155,7 +685,7 @@ def owner_api_staff_ratings(request: HttpRequest) -> JsonResponse:
     """
 
     # --- access ---
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     rp = _get_current_restaurant(request, op)
@@ -1163,147 +693,11 @@ def owner_api_staff_ratings(request: HttpRequest) -> JsonResponse:
         return JsonResponse({"ok": False, "error": "Select a restaurant."}, status=400)
 
     # --- filters ---
-    start_s = (request.GET.get("start") or "").strip()
-    end_s   = (request.GET.get("end") or "").strip()
-    qs = TicketLink.objects.filter(restaurant=rp, status="closed")
-    if start_s:
-        try: qs = qs.filter(closed_at__date__gte=parse_date(start_s))
-        except Exception: pass
-    if end_s:
-        try: qs = qs.filter(closed_at__date__lte=parse_date(end_s))
-        except Exception: pass
-
-    # --- cache maps ---
-    staff_cache = rp.staff_cache or []
-    by_ck_lower = { (s.get("check_name") or "").strip().lower(): s for s in staff_cache if (s.get("check_name") or "").strip() }
-    by_nm_lower = { (s.get("name") or "").strip().lower():       s for s in staff_cache if (s.get("name") or "").strip() }
-
-    # --- seed rows + buckets ---
-    agg = {}
-    def seed_row(key, display, active=True):
-        if key not in agg:
-            agg[key] = {
-                "display": display or "",
-                "active": bool(active),
-                "sum": 0, "n": 0,
-                "tickets_all": 0, "tickets_rated": 0
-            }
-
-    # seed every cached staffer so they appear even with 0 tickets
-    for s in staff_cache:
-        key = (str(s.get("id") or "").strip()
-               or (s.get("check_name") or "").strip()
-               or (s.get("name") or "").strip()
-               or f"seed:{id(s)}")
-        disp = (s.get("check_name") or s.get("name") or "").strip()
-        if disp:  # ✅ only seed if we actually have a display name
-            seed_row(key, disp, s.get("is_active", True))
-
-    agg_all = {"display": "All staff", "active": True, "sum": 0, "n": 0, "tickets_all": 0, "tickets_rated": 0}
-
-    # --- aggregation ---
-    for tl in qs.iterator():
-        rating = get_ticket_rating_from_anywhere(tl)
-
-        # ALL row
-        agg_all["tickets_all"] += 1
-        if rating is not None:
-            agg_all["sum"] += int(rating)
-            agg_all["n"]   += 1
-            agg_all["tickets_rated"] += 1
-
-        resolved = (tl.server_name or "").strip()
-        key = None
-        display = None
-
-        if resolved:
-            low = resolved.lower()
-            if low in by_ck_lower:
-                s = by_ck_lower[low]
-                key = str(s.get("id") or s.get("check_name") or resolved)
-                display = (s.get("check_name") or s.get("name") or resolved)
-                seed_row(key, display, s.get("is_active", True))
-            elif low in by_nm_lower:
-                s = by_nm_lower[low]
-                key = str(s.get("id") or s.get("name") or resolved)
-                display = (s.get("check_name") or s.get("name") or resolved)
-                seed_row(key, display, s.get("is_active", True))
-            else:
-                # keep raw server_name, but skip if it's blank
-                display = resolved
-                key = resolved
-                if display:
-                    seed_row(key, display, True)
-
-        if not key:
-            try:
-                raw = tl.raw_ticket_json or {}
-                emb = (raw.get("_embedded") or {})
-                emp = emb.get("employee") or raw.get("employee") or {}
-                pos_name = (emp.get("check_name") or emp.get("name") or "").strip()
-            except Exception:
-                pos_name = ""
-            if pos_name:
-                low = pos_name.lower()
-                if low in by_ck_lower:
-                    s = by_ck_lower[low]
-                    key = str(s.get("id") or s.get("check_name") or pos_name)
-                    display = (s.get("check_name") or s.get("name") or pos_name)
-                    seed_row(key, display, s.get("is_active", True))
-                elif low in by_nm_lower:
-                    s = by_nm_lower[low]
-                    key = str(s.get("id") or s.get("name") or pos_name)
-                    display = (s.get("check_name") or s.get("name") or pos_name)
-                    seed_row(key, display, s.get("is_active", True))
-                else:
-                    display = pos_name
-                    key = pos_name
-                    if display:
-                        seed_row(key, display, True)
-
-        # ✅ If still no key, SKIP (don’t create “Unknown”)
-        if not key:
-            continue
-
-        row = agg[key]
-        row["tickets_all"] += 1
-        if rating is not None:
-            row["sum"] += int(rating)
-            row["n"]   += 1
-            row["tickets_rated"] += 1
-
-    # --- shape response ---
-    out = []
-    avg_all = (agg_all["sum"] / agg_all["n"]) if agg_all["n"] else None
-    out.append({
-        "staff_key": "ALL",
-        "name": agg_all["display"],
-        "avg_rating": round(avg_all, 3) if avg_all is not None else None,
-        "num_rated_tickets": agg_all["tickets_rated"],
-        "is_active_in_pos": True,
-        "num_all_tickets": agg_all["tickets_all"],
-    })
-    for key, r in agg.items():
-        avg = (r["sum"] / r["n"]) if r["n"] else None
-        out.append({
-            "staff_key": key,
-            "name": r["display"],
-            "avg_rating": round(avg, 3) if avg is not None else None,
-            "num_rated_tickets": r["tickets_rated"],
-            "is_active_in_pos": bool(r["active"]),
-            "num_all_tickets": r["tickets_all"],
-        })
-
-    def sort_key(row):
-        if row["staff_key"] == "ALL": return (-999, 0, 0)
-        rated = row["avg_rating"] is not None
-        return (0 if rated else 1, -(row["avg_rating"] or 0), -row["num_all_tickets"])
-    out[1:] = sorted(out[1:], key=sort_key)
-
+    start, end = parse_range(request.GET)
     return JsonResponse({
         "ok": True,
-        "synced_at": (rp.staff_cache_synced_at.isoformat() if rp.staff_cache_synced_at else None),
-        "staff": out,
+        "synced_at": (rp.staff_cache_synced_at.isoformat() if getattr(rp, "staff_cache_synced_at", None) else None),
+        "staff": analytics.staff_ratings(rp, start, end),
     })
 
 
@@ -1311,12 +705,11 @@ def owner_api_staff_ratings(request: HttpRequest) -> JsonResponse:
 @login_required
 @require_GET
 def owner_api_staff_ratings_debug(request: HttpRequest) -> JsonResponse:
-    """Quick visibility into distinct server names & how many tickets have them."""
-    from django.utils.dateparse import parse_date
-    from collections import Counter
+    """Quick visibility into distinct resolved servers (staff_key set at close) & how many tickets have them."""
+    from django.db.models import Count
     from .models import TicketLink
 
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     rp = _get_current_restaurant(request, op)
@@ -1325,36 +718,45 @@ def owner_api_staff_ratings_debug(request: HttpRequest) -> JsonResponse:
 
     start_s = (request.GET.get("start") or "").strip()
     end_s   = (request.GET.get("end") or "").strip()
-    qs = TicketLink.objects.filter(restaurant=rp, status="closed")
-    if start_s:
-        try: qs = qs.filter(closed_at__date__gte=parse_date(start_s))
-        except Exception: pass
-    if end_s:
-        try: qs = qs.filter(closed_at__date__lte=parse_date(end_s))
-        except Exception: pass
-
-    names = []
-    for tl in qs.iterator():
-        nm = (tl.server_name or "").strip()
-        if not nm:
-            try:
-                raw = tl.raw_ticket_json or {}
-                emb = (raw.get("_embedded") or {})
-                emp = emb.get("employee") or raw.get("employee") or {}
-                nm = (emp.get("check_name") or emp.get("name") or "").strip()
-            except Exception:
-                nm = ""
-        names.append(nm or "<blank>")
+    qs = filter_days(TicketLink.objects.filter(restaurant=rp, status="closed"), start_s, end_s, restaurant_tz(rp))
 
-    counts = Counter(names)
-    rows = [{"server_name": k, "tickets": v} for k, v in sorted(counts.items(), key=lambda x: (-x[1], x[0]))]
+    grouped = qs.values("staff_key", "staff_name").annotate(tickets=Count("id")).order_by("-tickets", "staff_name")
+    rows = [
+        {
+            "server_name": ("<unresolved>" if g["staff_key"] is None else g["staff_name"] or "<blank>"),
+            "staff_key": g["staff_key"],
+            "tickets": g["tickets"],
+        }
+        for g in grouped
+    ]
     return JsonResponse({"ok": True, "rows": rows})
 
 
+@login_required
+@require_GET
+def owner_api_percentiles(request: HttpRequest) -> JsonResponse:
+    """
+    Percentiles over a date range, merged from the per-day sketches (core/sketches.py).
+    GET: metric=ticket_total|tip_pct|item_price, p=50,90,99, start, end, item (item_price only).
+    """
+    op = _get_owner_profile(request)
+    if not op:
+        return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
+    rp = _get_current_restaurant(request, op)
+    if not rp:
+        return JsonResponse({"ok": False, "error": "Select a restaurant."}, status=400)
+    try:
+        metric, qs, item = analytics.percentile_args(request.GET)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    start, end = parse_range(request.GET)
+    return JsonResponse({"ok": True, **analytics.percentiles(rp, metric, qs, start, end, item=item)})
+
+
 @require_GET
 @login_required
 def owner_export(request: HttpRequest) -> HttpResponse:
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return HttpResponse("Not an owner.", status=403)
 
@@ -1366,91 +768,90 @@ def owner_export(request: HttpRequest) -> HttpResponse:
     if not rp:
         return HttpResponse("Select a restaurant.", status=400)
 
-    qs = TicketLink.objects.select_related("member").filter(restaurant=rp, status="closed")
-    if start:
-        try: qs = qs.filter(closed_at__date__gte=start)
-        except Exception: pass
-    if end:
-        try: qs = qs.filter(closed_at__date__lte=end)
-        except Exception: pass
+    if (request.GET.get("format") or "").strip().lower() == "csv":
+        return csv_response(rp, start, end, q)   # streamed, constant memory (core/exports.py)
 
-    rows = []
-    for tl in qs.order_by("closed_at"):
-        if q:
-            hay = f"{(tl.ticket_number or tl.ticket_id)} {(tl.member.number if tl.member else '')}".lower()
-            if q not in hay: continue
+    return xlsx_response(rp, start, end, q)
 
-        subtotal = int(tl.total_cents or 0)   # per your mapping
-        tax      = int(tl.tax_cents or 0)
-        tip      = int(tl.tip_cents or 0)
-        total    = int(tl.paid_cents or (subtotal + tax + tip))
 
-        rows.append({
-            "closed": tl.closed_at,
-            "ticket": tl.ticket_number or tl.ticket_id,
-            "member": tl.member.number if tl.member else "",
-            "server": tl.server_name or "",
-            "subtotal": subtotal,
-            "tax": tax,
-            "tip": tip,
-            "total": total,
-            "pos_ref": tl.pos_ref or "",
-        })
+@require_GET
+@login_required
+def owner_portfolio_export(request: HttpRequest) -> HttpResponse:
+    """Closed tickets of every restaurant the owner has, one file with per-restaurant subtotals."""
+    op = _get_owner_profile(request)
+    if not op:
+        return HttpResponse("Not an owner.", status=403)
+    restaurants = request.role_ctx.restaurants
+    if not restaurants:
+        return HttpResponse("No restaurants.", status=400)
+    q = (request.GET.get("q") or "").strip().lower()
+    start, end = parse_range(request.GET)
 
-    from openpyxl import Workbook
-    from openpyxl.styles import Font
-    from openpyxl.utils import get_column_letter
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Closed"
-
-    headers = ["Closed", "Ticket", "Member", "Server", "Subtotal", "Tax", "Tip", "Total", "POS Ref"]
-    ws.append(headers)
-    for c in ws[1]:
-        c.font = Font(bold=True)
-
-    currency_fmt = u'[$$-409]#,##0.00'
-
-    for r in rows:
-        ws.append([
-            r["closed"].strftime("%Y-%m-%d %H:%M") if r["closed"] else "",
-            r["ticket"], r["member"], r["server"],
-            r["subtotal"]/100.0, r["tax"]/100.0, r["tip"]/100.0, r["total"]/100.0,
-            r["pos_ref"],
-        ])
-
-    if rows:
-        for row in ws.iter_rows(min_row=2, min_col=5, max_col=8):
-            for cell in row:
-                cell.number_format = currency_fmt
-
-    widths = [18, 12, 14, 12, 12, 12, 12, 12, 16]
-    for i, w in enumerate(widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = w
-
-    total_row = len(rows) + 2
-    ws.cell(row=total_row, column=7, value="Grand total").font = Font(bold=True)
-    total_col = get_column_letter(8)
-    ws.cell(row=total_row, column=8, value=f"=SUM({total_col}2:{total_col}{total_row-1})").number_format = currency_fmt
-    ws.cell(row=total_row, column=8).font = Font(bold=True)
-
-    rest_name = _display_name(rp)
-    filename = f"{rest_name.replace(' ', '_')}_closed_{timezone.now().strftime('%Y%m%d')}.xlsx"
-
-    bio = BytesIO(); wb.save(bio); bio.seek(0)
-    resp = HttpResponse(
-        bio.getvalue(),
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    resp["Content-Disposition"] = f'attachment; filename="{filename}"'
-    return resp
+    if (request.GET.get("format") or "").strip().lower() == "csv":
+        return portfolio_csv_response(restaurants, start, end, q)
+    return portfolio_xlsx_response(restaurants, start, end, q)
+
+
+@require_GET
+@login_required
+def owner_api_portfolio_summary(request: HttpRequest) -> JsonResponse:
+    op = _get_owner_profile(request)
+    if not op:
+        return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
+    q = (request.GET.get("q") or "").strip().lower()
+    start, end = parse_range(request.GET)
+    return JsonResponse({"ok": True, **portfolio_summary(request.role_ctx.restaurants, start, end, q)})
+
+@csrf_protect
+@require_POST
+@login_required
+def owner_api_export_enqueue(request: HttpRequest) -> JsonResponse:
+    """Queue a background export of the current restaurant (body: start, end, q, format)."""
+    op = _get_owner_profile(request)
+    if not op:
+        return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
+    rp = _get_current_restaurant(request, op)
+    if not rp:
+        return JsonResponse({"ok": False, "error": "Select a restaurant."}, status=400)
+    try:
+        data = json.loads(request.body.decode() or "{}")
+    except Exception:
+        data = {}
+    try:
+        job = export_jobs.enqueue(rp, request.user, "owner", data)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({"ok": True, "job": export_jobs.job_payload(job, "core:owner_export_download")}, status=202)
+
+
+@require_GET
+@login_required
+def owner_api_export_status(request: HttpRequest, job_id: int) -> JsonResponse:
+    op = _get_owner_profile(request)
+    if not op:
+        return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
+    job = export_jobs.job_for_user(request, job_id, "owner")
+    if not job:
+        return JsonResponse({"ok": False, "error": "Export not found."}, status=404)
+    return JsonResponse({"ok": True, "job": export_jobs.job_payload(job, "core:owner_export_download")})
+
+
+@require_GET
+@login_required
+def owner_export_download(request: HttpRequest, job_id: int) -> HttpResponse:
+    op = _get_owner_profile(request)
+    if not op:
+        return HttpResponse("Not an owner.", status=403)
+    job = export_jobs.job_for_user(request, job_id, "owner", status="done")
+    if not job or not job.file:
+        return HttpResponse("Export not found or expired.", status=404)
+    return FileResponse(job.file.open("rb"), as_attachment=True, filename=job.file.name.rsplit("/", 1)[-1])
 
 @csrf_protect
 @require_POST
 @login_required
 def owner_api_remove_staff(request: HttpRequest) -> JsonResponse:
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
     try:
@@ -1459,7 +860,7 @@ def owner_api_remove_staff(request: HttpRequest) -> JsonResponse:
         data = {}
     rid = data.get("restaurant_id")
     sid = data.get("staff_id")
-    rp = _owner_restaurants(op).filter(id=rid).first()
+    rp = request.role_ctx.owns(rid)
     if not rp:
         return JsonResponse({"ok": False, "error": "Restaurant not found."}, status=404)
 
@@ -1478,7 +879,7 @@ from datetime import timedelta
 @login_required
 def owner_invite_staff(request: HttpRequest) -> JsonResponse:
     """Owner sends a staff invite for the current restaurant."""
-    op = _get_owner_profile(request.user)
+    op = _get_owner_profile(request)
     if not op:
         return JsonResponse({"ok": False, "error": "Not an owner."}, status=403)
 
@@ -2,26 +2,30 @@
 from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth import get_user_model
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, redirect
 from django.urls import reverse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 
-import stripe
 from allauth.socialaccount.models import SocialAccount
 from .models import CustomerProfile, Member
-from .utils import ensure_stripe_customer_by_email, create_setup_intent_for_customer
+from .utils import _field, ensure_stripe_customer_by_email, create_setup_intent_for_customer, card_summary, cache_card_summary
 from decouple import config
 from .constants import CUSTOMER_SSR
+from .clients import stripe_client
 from . import views, views_staff, views_home, veiws_verify, views_payments
 from django.contrib.auth.hashers import make_password
+import json
+import logging
 import random
 import re
 
 
 User = get_user_model()
-stripe.api_key = config('STRIPE_SK')
+stripe = stripe_client()
+
+logger = logging.getLogger(__name__)
 
 def _names_from_google(user):
     """
@@ -137,16 +141,17 @@ def save_pin_finalize(request):
     if not setup_intent_id:
         return JsonResponse({"ok": False, "error": "Missing saved card reference."}, status=400)
 
-    # Validate SetupIntent
+    # Validate SetupIntent (expand the PM so we can cache brand/last4 without another call)
     try:
-        si = stripe.SetupIntent.retrieve(setup_intent_id)
+        si = stripe.SetupIntent.retrieve(setup_intent_id, expand=["payment_method"])
     except Exception as e:
         return JsonResponse({"ok": False, "error": f"Stripe error: {e}"}, status=400)
-    if si.get("status") != "succeeded":
+    if _field(si, "status") != "succeeded":
         return JsonResponse({"ok": False, "error": "Card was not saved."}, status=400)
 
-    pm_id = si.get("payment_method")
-    customer_id = si.get("customer")
+    pm = _field(si, "payment_method")
+    pm_id = pm if isinstance(pm, str) else _field(pm, "id")
+    customer_id = _field(si, "customer")
     if not (pm_id and customer_id):
         return JsonResponse({"ok": False, "error": "Payment method missing from SetupIntent."}, status=400)
 
@@ -195,6 +200,9 @@ def save_pin_finalize(request):
         cp.email_verified  = True
     cp.stripe_customer_id = customer_id
     cp.default_payment_method = pm_id
+    if not isinstance(pm, str):
+        for f, v in card_summary(pm).items():
+            setattr(cp, f, v)
     cp.pin_hash = make_password(pin1)
     cp.save()
 
@@ -323,21 +331,26 @@ def finalize_card_update(request):
 
     # Validate the SetupIntent
     try:
-        si = stripe.SetupIntent.retrieve(si_id)
+        si = stripe.SetupIntent.retrieve(si_id, expand=["payment_method"])
     except Exception as e:
         return JsonResponse({"ok": False, "error": f"Stripe error: {e}"}, status=400)
 
-    if si.get("status") != "succeeded":
+    if _field(si, "status") != "succeeded":
         return JsonResponse({"ok": False, "error": "Card was not saved."}, status=400)
 
-    pm_id = si.get("payment_method")
-    customer_id = si.get("customer") or cp.stripe_customer_id
+    pm = _field(si, "payment_method")
+    pm_id = pm if isinstance(pm, str) else _field(pm, "id")
+    customer_id = _field(si, "customer") or cp.stripe_customer_id
     if not (pm_id and customer_id):
         return JsonResponse({"ok": False, "error": "Payment method missing."}, status=400)
 
-    # Update default payment method locally
+    # Update default payment method (+ cached brand/last4) locally
     updates = ["default_payment_method"]
     cp.default_payment_method = pm_id
+    if not isinstance(pm, str):
+        for f, v in card_summary(pm).items():
+            setattr(cp, f, v)
+            updates.append(f)
     if not cp.stripe_customer_id and customer_id:
         cp.stripe_customer_id = customer_id
         updates.append("stripe_customer_id")
@@ -357,3 +370,50 @@ def finalize_card_update(request):
     return JsonResponse({"ok": True, "redirect": next_url})
 
 
+# ---------- STRIPE WEBHOOK (customer card cache) ----------
+STRIPE_WH_CUSTOMER = config("STRIPE_WH_CUSTOMER", default="")
+
+@csrf_exempt
+@require_POST
+def stripe_customer_webhook(request):
+    """
+    Keeps CustomerProfile.card_brand/card_last4 in sync with Stripe:
+      - payment_method.attached -> refresh if it's the default (or none is set yet)
+      - customer.updated        -> follow invoice_settings.default_payment_method
+    """
+    if not STRIPE_WH_CUSTOMER:
+        # unsigned events could rewrite anyone's default card: refuse rather than trust them
+        logger.error("stripe_customer_webhook: STRIPE_WH_CUSTOMER is not set; rejecting event")
+        return HttpResponse("Webhook secret not configured", status=500)
+
+    payload = request.body
+    sig = request.META.get("HTTP_STRIPE_SIGNATURE", "")
+    try:
+        # verify, then read the verified bytes as plain dicts (a StripeObject has no .get())
+        stripe.WebhookSignature.verify_header(payload.decode(), sig, STRIPE_WH_CUSTOMER)
+        event = json.loads(payload.decode() or "{}")
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        return HttpResponseBadRequest(f"Invalid payload/signature: {e}")
+
+    evt_type = event.get("type")
+    obj      = (event.get("data") or {}).get("object") or {}
+
+    try:
+        if evt_type == "payment_method.attached":
+            cp = CustomerProfile.objects.filter(stripe_customer_id=obj.get("customer") or "").first()
+            if cp and cp.stripe_customer_id and (not cp.default_payment_method or cp.default_payment_method == obj.get("id")):
+                if not cp.default_payment_method:
+                    cp.default_payment_method = obj.get("id") or ""
+                    cp.save(update_fields=["default_payment_method"])
+                cache_card_summary(cp, obj)
+        elif evt_type == "customer.updated":
+            cp = CustomerProfile.objects.filter(stripe_customer_id=obj.get("id") or "").first()
+            pm_id = ((obj.get("invoice_settings") or {}).get("default_payment_method") or "")
+            if cp and cp.stripe_customer_id and pm_id and (pm_id != cp.default_payment_method or not cp.card_last4):
+                cp.default_payment_method = pm_id
+                cp.save(update_fields=["default_payment_method"])
+                cache_card_summary(cp, pm_id)
+    except Exception:
+        logger.exception("stripe_customer_webhook: failed to handle %s", evt_type)
+
+    return HttpResponse(status=200)
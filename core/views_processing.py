@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import os
+import logging
 from typing import Optional, Dict
 import uuid
 import stripe
@@ -10,13 +11,25 @@ import hashlib
 
 
 import stripe
+from decimal import Decimal
+from decouple import config
 
+from .clients import stripe_client
+
+logger = logging.getLogger(__name__)
 
 # --- Stripe setup ---
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 
+# --- Close payment mode ---
+#   "single"       -> create+confirm the full PaymentIntent at close (default)
+#   "auth_capture" -> manual-capture hold when the link opens, capture at close
+PAYMENT_MODE = config("PAYMENT_MODE", default="single").strip().lower()
+AUTH_HOLD_PAD_PCT   = Decimal(config("AUTH_HOLD_PAD_PCT", default="40"))   # head-room for tip + more items
+AUTH_HOLD_MIN_CENTS = int(config("AUTH_HOLD_MIN_CENTS", default="5000"))   # tickets often open near $0
+
 
 class PaymentError(Exception):
     def __init__(self, msg, *, code=None, decline_code=None, payment_intent_id=None):
@@ -26,12 +39,15 @@ class PaymentError(Exception):
         self.payment_intent_id = payment_intent_id
 
 def ensure_stripe_key():
+    stripe_client()  # pooled HTTP client + key (no-op after first call)
     if not getattr(stripe, "api_key", None):
         raise RuntimeError("Stripe secret key not configured")
 
 def build_idem_key(prefix: str, payload: Dict) -> str:
-    # Whatever you already use; keeping simple & deterministic
-    return f"{prefix}:{hash(frozenset(payload.items()))}"
+    # sha256, not hash(): str hashes are salted per process, so a retry that lands on
+    # another worker (or after a restart) would get a different key
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{prefix}:{digest[:32]}"
 
 def charge_customer_off_session(
     *,
@@ -46,10 +62,12 @@ def charge_customer_off_session(
     destination_account_id: Optional[str] = None,   # acct_...
     on_behalf_of: Optional[str] = None,             # usually same acct_...
     application_fee_amount: Optional[int] = None,   # in cents; optional
+    capture_method: str = "automatic",              # "manual" -> authorization hold only
 ) -> stripe.PaymentIntent:
     """
     Creates & confirms an off-session PaymentIntent against a saved card.
     Supports Stripe Connect destination charges via transfer_data / on_behalf_of.
+    With capture_method="manual" this only places a hold (see capture_authorization).
     Returns the PaymentIntent on success or raises PaymentError on failure.
     """
     ensure_stripe_key()
@@ -80,6 +98,11 @@ def charge_customer_off_session(
     if application_fee_amount is not None:
         request_payload["application_fee_amount"] = int(application_fee_amount)
 
+    # Authorization hold: ask for incremental auth so close can grow the amount
+    if capture_method == "manual":
+        request_payload["capture_method"] = "manual"
+        request_payload["payment_method_options"] = {"card": {"request_incremental_authorization": "if_available"}}
+
     # Stable idem key (include connect bits so params stay consistent)
     idem_key = idempotency_key or build_idem_key("close", {
         "amount": request_payload["amount"],
@@ -90,6 +113,7 @@ def charge_customer_off_session(
         "fee": request_payload.get("application_fee_amount", 0),
         "currency": currency,
         "desc": description or "",
+        "capture": capture_method,
     })
 
     def _create_with_key(_key: str) -> stripe.PaymentIntent:
@@ -98,11 +122,12 @@ def charge_customer_off_session(
     try:
         intent = _create_with_key(idem_key)
     except stripe.error.CardError as e:
-        pi = (getattr(e, "json_body", None) or {}).get("error", {}).get("payment_intent", {}) or {}
+        err = (getattr(e, "json_body", None) or {}).get("error", {})
+        pi = err.get("payment_intent", {}) or {}
         raise PaymentError(
             f"card_error: {e.user_message or str(e)}",
             code=getattr(e, "code", None),
-            decline_code=getattr(e, "decline_code", None),
+            decline_code=err.get("decline_code"),   # only in the error body, not an attribute of CardError
             payment_intent_id=pi.get("id"),
         )
     except stripe.error.StripeError as e:
@@ -113,11 +138,12 @@ def charge_customer_off_session(
                 fresh_key = f"{idem_key}:r:{uuid.uuid4().hex[:8]}"
                 intent = _create_with_key(fresh_key)
             except stripe.error.CardError as e2:
-                pi = (getattr(e2, "json_body", None) or {}).get("error", {}).get("payment_intent", {}) or {}
+                err = (getattr(e2, "json_body", None) or {}).get("error", {})
+                pi = err.get("payment_intent", {}) or {}
                 raise PaymentError(
                     f"card_error: {e2.user_message or str(e2)}",
                     code=getattr(e2, "code", None),
-                    decline_code=getattr(e2, "decline_code", None),
+                    decline_code=err.get("decline_code"),
                     payment_intent_id=pi.get("id"),
                 )
             except stripe.error.StripeError as e2:
@@ -145,4 +171,112 @@ def refund_payment_intent(intent_id: str, reason: Optional[str] = None) -> strip
     try:
         return stripe.Refund.create(payment_intent=intent_id, reason=reason or None)
     except stripe.error.StripeError as e:
-        raise PaymentError(f"refund_failed: {e.user_message or str(e)}")
\ No newline at end of file
+        raise PaymentError(f"refund_failed: {e.user_message or str(e)}")
+
+
+def estimate_hold_cents(due_cents: int) -> int:
+    """Hold amount for auth-at-verify: current due + AUTH_HOLD_PAD_PCT, never below AUTH_HOLD_MIN_CENTS."""
+    padded = (Decimal(max(int(due_cents or 0), 0)) * (Decimal(100) + AUTH_HOLD_PAD_PCT) / Decimal(100))
+    return max(int(padded.quantize(Decimal("1"))), AUTH_HOLD_MIN_CENTS)
+
+def capture_authorization(
+    intent_id: str,
+    *,
+    authorized_cents: int,
+    amount_cents: int,
+    application_fee_amount: Optional[int] = None,
+    idempotency_key: Optional[str] = None,
+) -> stripe.PaymentIntent:
+    """
+    Capture a manual-capture hold for the final amount.
+    If the final amount is above the hold, try an incremental authorization first.
+    Both calls carry idempotency keys derived from idempotency_key (default: per intent
+    and amount), so a retried close replays Stripe's first answer instead of acting twice.
+    Raises PaymentError if the hold can't cover the amount (see settle_authorization).
+    """
+    ensure_stripe_key()
+    amount_cents = int(amount_cents)
+    key = f"{idempotency_key or f'auth:{intent_id}'}:{amount_cents}"
+    try:
+        if amount_cents > int(authorized_cents or 0):
+            stripe.PaymentIntent.increment_authorization(intent_id, amount=amount_cents, idempotency_key=f"{key}:incr")
+        params: Dict = {"amount_to_capture": amount_cents}
+        if application_fee_amount is not None:
+            params["application_fee_amount"] = int(application_fee_amount)
+        intent = stripe.PaymentIntent.capture(intent_id, idempotency_key=f"{key}:capture", **params)
+    except stripe.error.StripeError as e:
+        raise PaymentError(
+            f"capture_failed: {e.user_message or str(e)}",
+            code=getattr(e, "code", None),
+            payment_intent_id=intent_id,
+        )
+
+    if intent.status != "succeeded":
+        raise PaymentError(f"unexpected_intent_status: {intent.status}", payment_intent_id=intent.id)
+    return intent
+
+def retrieve_intent(intent_id: str) -> stripe.PaymentIntent:
+    ensure_stripe_key()
+    try:
+        return stripe.PaymentIntent.retrieve(intent_id)
+    except stripe.error.StripeError as e:
+        raise PaymentError(
+            f"retrieve_failed: {e.user_message or str(e)}",
+            code=getattr(e, "code", None),
+            payment_intent_id=intent_id,
+        )
+
+def cancel_authorization(intent_id: str) -> None:
+    """Release a hold we won't capture. Best-effort: holds also lapse on their own after ~7 days."""
+    try:
+        ensure_stripe_key()
+        stripe.PaymentIntent.cancel(intent_id)
+    except Exception:
+        logger.warning("cancel_authorization(%s) failed", intent_id, exc_info=True)
+
+# the money moved (or is moving): never charge again on top of these
+_CAPTURED_STATUSES = ("succeeded", "processing")
+
+def settle_authorization(
+    intent_id: str,
+    *,
+    authorized_cents: int,
+    amount_cents: int,
+    application_fee_amount: Optional[int] = None,
+    idempotency_key: Optional[str] = None,
+) -> Optional[stripe.PaymentIntent]:
+    """
+    Close-time handling of an auth-at-verify hold. Returns the captured PaymentIntent,
+    or None once the hold is known not to be captured (and has been released): only
+    then may the caller charge afresh.
+
+    A capture error doesn't mean nothing was captured (timeouts, a retried close whose
+    first attempt got through), so Stripe's state is read back before giving up on
+    the hold. Raises PaymentError when that state can't be read: the caller must fail
+    the close rather than risk a second charge.
+    """
+    try:
+        return capture_authorization(
+            intent_id,
+            authorized_cents=authorized_cents,
+            amount_cents=amount_cents,
+            application_fee_amount=application_fee_amount,
+            idempotency_key=idempotency_key,
+        )
+    except PaymentError as capture_err:
+        logger.warning("capture of hold %s failed: %s", intent_id, capture_err)
+
+    intent = retrieve_intent(intent_id)
+    if intent.status in _CAPTURED_STATUSES:
+        return intent
+    if intent.status == "canceled":
+        return None
+
+    cancel_authorization(intent_id)
+    intent = retrieve_intent(intent_id)
+    if intent.status in _CAPTURED_STATUSES:
+        return intent
+    if intent.status == "requires_capture":
+        # still capturable: a fresh charge now could end up next to a later capture of this hold
+        raise PaymentError(f"hold_not_released: {intent.status}", payment_intent_id=intent_id)
+    return None
@@ -7,11 +7,11 @@ from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 from decouple import config
-import stripe
 
+from core.clients import stripe_client
 from core.models import RestaurantProfile, OwnerProfile
 
-stripe.api_key = config("STRIPE_SK")
+stripe = stripe_client()
 
 
 def _abs(request: HttpRequest, named_url: str) -> str:
@@ -282,11 +282,9 @@ from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction
 from decouple import config
-import stripe
 
 from core.models import RestaurantProfile, OwnerProfile
 
-stripe.api_key = config("STRIPE_SK")
 WEBHOOK_SECRET = config("STRIPE_WH_OWNER", default="")
 
 
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import json
+import logging
 from datetime import timedelta
 
 from decouple import config
@@ -23,8 +24,21 @@ from .omnivore import (
     create_payment_with_tender_type,
 )
 from .utils import send_sms
+from .line_items import sync_line_items
+from . import ticket_search
+from .rollups import record_close, stamp_staff, staff_maps
+from .locks import serialize_ticket_close
+
+from .views_processing import (
+    charge_customer_off_session,
+    settle_authorization,
+    cancel_authorization,
+    refund_payment_intent,
+    PaymentError,
+    build_idem_key,
+)
 
-from .views_processing import charge_customer_off_session, refund_payment_intent, PaymentError, build_idem_key
+logger = logging.getLogger(__name__)
 
 # ---------- Config ----------
 LOCATION_ID = config("OMNIVORE_LOCATION_ID", default="").strip()
@@ -39,19 +53,23 @@ def _due_cents(ticket: dict) -> int:
     totals = (ticket or {}).get("totals") or {}
     return int(totals.get("due") if totals.get("due") is not None else totals.get("total", 0)) or 0
 
-def _rp_for_location(loc_id: str) -> RestaurantProfile | None:
+def _rp_for_location(loc_id: str, ctx=None) -> RestaurantProfile | None:
+    # the signed-in staff member's / manager's own restaurant (request.role_ctx) needs no query
+    for rp in ((ctx.staff_restaurant, ctx.manager_restaurant) if ctx else ()):
+        if rp and loc_id and rp.omnivore_location_id == loc_id:
+            return rp
     rp = RestaurantProfile.objects.filter(omnivore_location_id=loc_id).first()
     if not rp:
         # fallback: single restaurant installs often have one row
         rp = RestaurantProfile.objects.first()
     return rp
 
-def _create_pending_row(member: Member, loc_id: str, ticket_id: str) -> TicketLink:
+def _create_pending_row(member: Member, loc_id: str, ticket_id: str, ctx=None) -> TicketLink:
     """
     Ensure there's a PENDING TicketLink visible on the board as soon as an invite is sent.
     Idempotent per (member, restaurant, ticket, status='pending').
     """
-    rp = _rp_for_location(loc_id)
+    rp = _rp_for_location(loc_id, ctx)
     try:
         t = get_ticket(loc_id, ticket_id)
     except Exception:
@@ -241,7 +259,7 @@ def api_link_member_to_ticket(request: HttpRequest):
     sent = send_sms(phone, body)
 
     # 5) create / ensure PENDING row appears
-    tl = _create_pending_row(m, LOCATION_ID, chosen_id)
+    tl = _create_pending_row(m, LOCATION_ID, chosen_id, request.role_ctx)
 
     return JsonResponse({"ok": True, "sent": sent, "ticket_link_id": tl.id})
 
@@ -304,17 +322,33 @@ def api_staff_cancel_link(request: HttpRequest):
 from decimal import Decimal
 from django.utils import timezone
 from decouple import config
-import stripe
+from .clients import stripe_client
 
-# assumes stripe.api_key is already set globally
+stripe = stripe_client()
 
 # Optional: read a platform fee percent from env, e.g. 5 = 5%. Default 0 (no fee).
 _PLATFORM_FEE_PCT = Decimal(config("PLATFORM_FEE_PCT", default="0"))  # e.g. "5" for 5%
 
+def _staff_close_lock_key(request: HttpRequest, *args, **kwargs):
+    """(restaurant_id, ticket_id) for the ticket in the body, if it has open links."""
+    try:
+        ticket_id = (json.loads(request.body.decode() or "{}").get("ticket_id") or "").strip()
+    except Exception:
+        return None
+    if not ticket_id:
+        return None
+    rid = (TicketLink.objects
+           .filter(ticket_id=ticket_id, status="open")
+           .order_by("opened_at")
+           .values_list("restaurant_id", flat=True)
+           .first())
+    return (rid, ticket_id) if rid else None
+
 @ensure_csrf_cookie
 @csrf_protect
 @require_POST
 @login_required
+@serialize_ticket_close(_staff_close_lock_key)
 def api_staff_close_ticket(request: HttpRequest):
     """
     Body: { ticket_id, reference? }
@@ -372,8 +406,9 @@ def api_staff_close_ticket(request: HttpRequest):
     tip_cents = int(round((AUTO_TIP_PCT / 100.0) * base_due))
     gross_cents = base_due + tip_cents
 
-    # Billable customer (take the first link with a member->customer)
-    member = next((lk.member for lk in links if getattr(lk, "member", None)), None)
+    # Billable customer: whoever holds the auth (auth-at-verify mode), else the first link with a member->customer
+    hold_link = next((lk for lk in links if lk.auth_payment_intent_id), None)
+    member = hold_link.member if hold_link else next((lk.member for lk in links if getattr(lk, "member", None)), None)
     customer_profile = getattr(member, "customer", None) if member else None
     if not customer_profile:
         return JsonResponse({"ok": False, "error": "no_customer_for_ticket"}, status=400)
@@ -402,9 +437,31 @@ def api_staff_close_ticket(request: HttpRequest):
         "pm": customer_profile.default_payment_method,
     })
 
+    # auth-at-verify mode: capture the hold (fee applied at capture)
+    # (a hold that turns out captured is used as-is; only a released one falls through to a fresh charge)
+    intent = None
+    if hold_link:
+        try:
+            intent = settle_authorization(
+                hold_link.auth_payment_intent_id,
+                authorized_cents=hold_link.auth_amount_cents,
+                amount_cents=gross_cents,
+                application_fee_amount=app_fee_cents or None,
+                idempotency_key=f"staff_close:{ticket_id}:{hold_link.auth_payment_intent_id}",
+            )
+        except PaymentError as e:
+            return JsonResponse({
+                "ok": False,
+                "error": "capture_state_unknown",
+                "detail": str(e),
+                "payment_intent": hold_link.auth_payment_intent_id,
+            }, status=502)
+        if intent is None:
+            TicketLink.objects.filter(pk=hold_link.pk).update(auth_payment_intent_id="", auth_amount_cents=0)
+
     # Charge (destination charge)
     try:
-        intent = stripe.PaymentIntent.create(
+        intent = intent or stripe.PaymentIntent.create(
             amount=int(gross_cents),
             currency="usd",
             customer=customer_profile.stripe_customer_id,
@@ -457,6 +514,9 @@ def api_staff_close_ticket(request: HttpRequest):
         try:
             if getattr(intent, "id", None):
                 stripe.Refund.create(payment_intent=intent.id, reason="requested_by_customer")
+                if hold_link:
+                    # refunded: a retry must charge afresh, not take the hold's capture for a payment
+                    TicketLink.objects.filter(pk=hold_link.pk).update(auth_payment_intent_id="", auth_amount_cents=0)
         except stripe.error.StripeError as refund_err:
             return JsonResponse({
                 "ok": False,
@@ -491,12 +551,22 @@ def api_staff_close_ticket(request: HttpRequest):
         "items_json", "raw_ticket_json", "pos_ref",
         "merchant_name","merchant_addr1","merchant_addr2",
         "merchant_city","merchant_state","merchant_zip","merchant_phone",
+        "staff_key","staff_name",
+        "auth_payment_intent_id","auth_amount_cents",
     ]
 
+    # holds on the ticket's other links won't be captured now: release them before forgetting them
+    for link in links:
+        if link.auth_payment_intent_id and link.auth_payment_intent_id != getattr(intent, "id", None):
+            cancel_authorization(link.auth_payment_intent_id)
+
+    staff = staff_maps(rp)
     for link in links:
         _fill_merchant_snapshot(link, rp)
         link.status         = "closed"
         link.closed_at      = now
+        link.auth_payment_intent_id = ""   # captured or released above; nothing left to settle
+        link.auth_amount_cents      = 0
         link.subtotal_cents = int(totals_from_pos.get("subtotal_cents") or 0)
         link.tax_cents      = int(totals_from_pos.get("tax_cents") or 0)
         link.discounts_cents= int(totals_from_pos.get("discounts_cents") or 0)
@@ -511,8 +581,18 @@ def api_staff_close_ticket(request: HttpRequest):
         link.raw_ticket_json = ticket_json or link.raw_ticket_json or {}
 
         link.pos_ref = reference
+        stamp_staff(link, staff)
         link.save(update_fields=update_fields)
 
+    # Normalized item rows, daily rollups and the search index; the charge already went through,
+    # so never fail the close here (backfill_line_items / rebuild_daily_stats / rebuild_ticket_search repair).
+    # Separate steps: one failing mustn't skip the others (catch-up writes items it finds missing).
+    for step in (sync_line_items, record_close, ticket_search.index_tickets):
+        try:
+            step(links)
+        except Exception:
+            logger.exception("close of ticket %s: %s failed", ticket_id, step.__name__)
+
     return JsonResponse({
         "ok": True,
         "paid_cents": gross_cents,